@@ -0,0 +1,112 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 benchmark.py --kernel_radius=128 --data_path=/tmp/benchmark
+#     --report_path=benchmark.json
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+
+# Benchmarks are CPU only, to be comparable across machines
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import tensorflow as tf
+import training
+from training import benchmark
+from training import mutlicnn
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark input pipeline '
+                                     'and models')
+    parser.add_argument('--kernel_radius', type=int, default=128)
+    parser.add_argument('--bands', type=str,
+                        default="spectral,tropo,dsm,wind,road",
+                        help="comma separated band groups of the records")
+    parser.add_argument('--num_bands', type=int, default=None,
+                        help="keeps only the first bands of the groups")
+    parser.add_argument('--num_files', type=int, default=4)
+    parser.add_argument('--records_per_file', type=int, default=16)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--num_batches', type=int, default=20,
+                        help="batches measured per pipeline stage")
+    parser.add_argument('--num_steps', type=int, default=5,
+                        help="training steps measured per model")
+    parser.add_argument('--model_types', type=str,
+                        default=",".join(training.SINGLE_INPUT_MODELS +
+                                         ["MULTICNN"]),
+                        help="comma separated models of the train step "
+                        "benchmark")
+    parser.add_argument('--data_path', type=str, default=None,
+                        help="folder of the synthetic TFRecords, temporary "
+                        "if not set")
+    parser.add_argument('--report_path', type=str, default='benchmark.json')
+
+    args = parser.parse_args()
+    band_groups = args.bands.split(',')
+    kept = training.select_bands(band_groups)[:args.num_bands]
+    input_bands = [[band for band in training.BAND_GROUPS[group]
+                    if band in kept] for group in band_groups]
+    input_bands = [bands for bands in input_bands if bands]
+    input_bands.append(training.DATE_BANDS)
+    output = training.OUTPUT_BANDS
+    features_dict = training.project_features(
+        training.get_features_dict(args.kernel_radius), input_bands, output)
+
+    data_path = args.data_path or tempfile.mkdtemp()
+    start = time.time()
+    files = benchmark.write_synthetic_tfrecords(
+        data_path, features_dict, args.num_files, args.records_per_file)
+    print("Wrote %i records in %.1fs" % (
+        args.num_files * args.records_per_file, time.time() - start))
+
+    pipeline = benchmark.benchmark_pipeline(
+        files, features_dict, input_bands, output, args.batch_size,
+        args.num_batches)
+    stages = benchmark.pipeline_stages(files, features_dict, input_bands,
+                                       output, args.batch_size)
+    stacked = next(iter(dict((name, dataset) for name, dataset, _
+                             in stages)['stack']))
+    groups, target = list(stacked[:-2]), stacked[-1]
+    merged = [tf.concat(groups, -1)]
+    train_step = {}
+    for model_type in args.model_types.upper().split(','):
+        if model_type == 'MULTICNN':
+            train_step[model_type] = benchmark.benchmark_train_step(
+                mutlicnn.get_model, groups, target, args.num_steps)
+        else:
+            train_step[model_type] = benchmark.benchmark_train_step(
+                lambda inputs: training.build_model(model_type, inputs[0]),
+                merged, target, args.num_steps)
+
+    report = {'config': vars(args),
+              'bands': input_bands,
+              'bytes_per_record': sum(os.path.getsize(f) for f in files) /
+              (args.num_files * args.records_per_file),
+              'pipeline_records_per_second': pipeline,
+              'train_step': train_step,
+              'environment': {'tensorflow': tf.__version__,
+                              'python': platform.python_version(),
+                              'processor': platform.processor(),
+                              'cpus': os.cpu_count()},
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    json.dump(report, open(args.report_path, 'w'), indent=2)
+    print(json.dumps({'pipeline_records_per_second': pipeline,
+                      'train_step': train_step}, indent=2))
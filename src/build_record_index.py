@@ -0,0 +1,41 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 build_record_index.py --tfrecords_path=samples
+#     --index_path=samples/index
+
+import argparse
+import training
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Index exported TFRecords')
+    parser.add_argument('--tfrecords_path', type=str,
+                        help="folder of the GZIP TFRecords")
+    parser.add_argument('--index_path', type=str,
+                        help="folder of the index")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="number of files indexed in parallel")
+    parser.add_argument('--uncompressed', action='store_true',
+                        help="stores the records of the index uncompressed, "
+                        "faster to read but larger than the GZIP files")
+
+    args = parser.parse_args()
+    index = training.build_record_index(
+        training.list_tfrecords(args.tfrecords_path), args.index_path,
+        args.processes, compress=not args.uncompressed)
+    print("Indexed %i records from %i files" % (len(index),
+                                                 len(index.files)))
@@ -0,0 +1,45 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 build_static_cache.py --tiles_path=samples/static
+#     --static_index=static_index.json --cache_path=static_cache
+# python3 build_static_cache.py --tiles_path=samples/scenes
+#     --scene_catalog=scene_catalog.json --cache_path=scenes
+
+import argparse
+import training
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build static layer cache')
+    parser.add_argument('--tiles_path', type=str,
+                        help="local folder of the exported static tiles")
+    parser.add_argument('--static_index', type=str,
+                        help="json file written by export_data.py")
+    parser.add_argument('--scene_catalog', type=str, default=None,
+                        help="json file written by export_data.py, builds "
+                        "the scenes.json catalog of serve_model.py instead")
+    parser.add_argument('--cache_path', type=str,
+                        help="folder of the cache or of the catalog to build")
+
+    args = parser.parse_args()
+    if args.scene_catalog:
+        scenes = training.build_scene_catalog(
+            args.tiles_path, args.scene_catalog, args.cache_path)
+        print("Cataloged %i scenes" % len(scenes))
+    else:
+        training.build_static_cache(args.tiles_path, args.static_index,
+                                    args.cache_path)
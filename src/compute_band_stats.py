@@ -0,0 +1,70 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 compute_band_stats.py --params_path=candid.json
+#     --tfrecords_path=samples --processes=16
+
+import argparse
+import json
+import training
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compute band statistics')
+    parser.add_argument('--params_path', type=str,
+                        help="json parameters file location")
+    parser.add_argument('--tfrecords_path', type=str,
+                        help="folder of the GZIP TFRecords")
+    parser.add_argument('--output_path', type=str, default=None,
+                        help="folder of band_stats.json, defaults to "
+                        "tfrecords_path")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="number of files scanned in parallel")
+    parser.add_argument('--static_cache', type=str, default=None,
+                        help="static layer cache built by "
+                        "build_static_cache.py, for shards exported with "
+                        "--static_index")
+    parser.add_argument('--max_records', type=int, default=None,
+                        help="number of records read per file")
+
+    args = parser.parse_args()
+    params = json.load(open(args.params_path, 'r'))
+    features_dict = training.get_features_dict(params['kernel_radius'])
+    static_cache = None
+    if args.static_cache:
+        # Static bands are not in the records, they are in the cache
+        static_cache = training.StaticLayerCache(args.static_cache,
+                                                 params['kernel_radius'])
+        for band in static_cache.bands:
+            features_dict.pop(band, None)
+    stats = training.compute_band_stats(
+        training.list_tfrecords(args.tfrecords_path), sorted(features_dict),
+        quantization=training.load_quantization(args.tfrecords_path),
+        processes=args.processes, max_records=args.max_records)
+    if static_cache:
+        # Static bands are accumulated over the cached regions, in blocks
+        # of rows so that regions are not loaded at once
+        for i, band in enumerate(static_cache.bands):
+            accumulator = training.BandAccumulator()
+            for array in static_cache.arrays.values():
+                for row in range(0, array.shape[0], 256):
+                    accumulator.update(array[row:row + 256, :, i])
+            if accumulator.count:
+                stats[band] = accumulator.summary()
+    training.save_band_stats(stats, args.output_path or args.tfrecords_path)
+    missing = sorted(set(features_dict) - set(stats))
+    if missing:
+        print("No values for %s" % ", ".join(missing))
@@ -0,0 +1,150 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 evaluate_model.py --params_path=candid.json --model_type=CNN
+#     --model_path=checkpoints/CNN_99.ckp --tfrecords_path=samples
+#     --report_path=reports/CNN_99.json
+# python3 evaluate_model.py --compare=reports/CNN_49.json,reports/CNN_99.json
+
+import argparse
+import json
+import os
+import numpy as np
+import training
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Evaluate a model')
+    parser.add_argument('--params_path', type=str,
+                        help="json parameters file location")
+    parser.add_argument('--model_type', type=str, default='CNN',
+                        choices=training.SINGLE_INPUT_MODELS,
+                        help="type of the trained model")
+    parser.add_argument('--model_path', type=str,
+                        help="SavedModel written by train_models.py or "
+                        "folder of its checkpoints")
+    parser.add_argument('--bands', type=str,
+                        default='spectral,tropo,dsm,wind,road',
+                        help="comma separated band groups of the model")
+    parser.add_argument('--tfrecords_path', type=str,
+                        help="folder of the GZIP TFRecords")
+    parser.add_argument('--split_path', type=str, default=None,
+                        help="split.json written by train_models.py, only "
+                        "its evaluation records are evaluated, defaults to "
+                        "the one next to model_path")
+    parser.add_argument('--batch_size', type=int, default=256,
+                        help="number of records per batch")
+    parser.add_argument('--max_batches', type=int, default=None,
+                        help="number of batches evaluated, all by default")
+    parser.add_argument('--latitude_band', type=float, default=5.0,
+                        help="degrees of latitude per bin")
+    parser.add_argument('--road_edges', type=str, default=None,
+                        help="comma separated edges of the road density "
+                        "bins, quartiles of --band_stats by default")
+    parser.add_argument('--static_cache', type=str, default=None,
+                        help="static layer cache built by "
+                        "build_static_cache.py")
+    parser.add_argument('--band_stats', type=str, default=None,
+                        help="band_stats.json the model was trained with")
+    parser.add_argument('--global_pooling', action='store_true',
+                        help="CNN trained with --crop_schedule")
+    parser.add_argument('--report_path', type=str, default=None,
+                        help="json file of the report")
+    parser.add_argument('--compare', type=str, default=None,
+                        help="comma separated reports to compare instead "
+                        "of evaluating")
+    parser.add_argument('--metric', type=str, default='rmse',
+                        choices=['rmse', 'mae', 'bias', 'count'],
+                        help="metric compared by --compare")
+
+    args = parser.parse_args()
+    if args.compare:
+        reports = {path: json.load(open(path, 'r'))
+                   for path in args.compare.split(',')}
+        for row in training.compare_reports(reports, args.metric):
+            print('\t'.join('%.6g' % value if isinstance(value, float)
+                            else str(value) for value in row))
+        raise SystemExit
+
+    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+    params = json.load(open(args.params_path, 'r'))
+    kernel_radius = params['kernel_radius']
+    bands = training.select_bands(args.bands.split(','))
+    features_dict = training.get_features_dict(kernel_radius)
+    static_cache = None
+    if args.static_cache:
+        static_cache = training.StaticLayerCache(args.static_cache,
+                                                 kernel_radius)
+        for band in static_cache.bands:
+            features_dict.pop(band, None)
+    offsets = scales = stats = None
+    # Errors are reported in NO2 units
+    output_scale = 10000.0
+    if args.band_stats:
+        stats = training.load_band_stats(args.band_stats)
+        offsets, scales = training.normalization_constants(stats, bands)
+        output_scale = float(training.normalization_constants(
+            stats, training.OUTPUT_BANDS, center=False)[1][0])
+    road_edges = None
+    if args.road_edges:
+        road_edges = [float(edge) for edge in args.road_edges.split(',')]
+    elif stats and training.ROAD_BANDS[0] in stats:
+        road_edges = training.road_edges_from_stats(stats)
+
+    split_path = args.split_path
+    if split_path is None:
+        # Checkpoint folder, or the folder of a saved model
+        split_path = os.path.join(args.model_path, training.SPLIT_FILE)
+        if not os.path.exists(split_path):
+            split_path = os.path.join(os.path.dirname(os.path.normpath(
+                args.model_path)), training.SPLIT_FILE)
+    eval_files = sorted(training.list_tfrecords(args.tfrecords_path))
+    index = record_ids = None
+    if os.path.exists(split_path):
+        split = training.load_split(split_path)
+        if split['split'] == 'file':
+            eval_files = split['eval_files']
+        else:
+            # Blocks of records held out by a spatial or temporal split
+            index = training.load_record_index(
+                sorted(split['train_files'] + split['eval_files']),
+                split['index_path'])
+            record_ids = np.flatnonzero(training.eval_records(
+                index, split['split'], split['eval_fold']))
+    else:
+        print("No %s, evaluating all the files" % split_path)
+
+    model = training.load_inference_model(
+        args.model_path, args.model_type, len(bands), stats is None,
+        args.global_pooling)
+    sliced, seconds = training.evaluate_model(
+        model, eval_files, features_dict, bands, args.batch_size,
+        static_cache=static_cache,
+        quantization=training.load_quantization(args.tfrecords_path),
+        offsets=offsets, scales=scales, output_scale=output_scale,
+        latitude_band=args.latitude_band, road_edges=road_edges,
+        max_batches=args.max_batches, index=index, record_ids=record_ids)
+    report = sliced.report()
+    report.update(model_path=args.model_path, model_type=args.model_type,
+                  split_path=split_path if os.path.exists(split_path)
+                  else None,
+                  seconds=seconds,
+                  records_per_second=report['overall']['count'] / seconds)
+    print(json.dumps(report['overall'], indent=2))
+    print("%i records in %.1fs" % (report['overall']['count'], seconds))
+    if args.report_path:
+        os.makedirs(os.path.dirname(args.report_path) or '.', exist_ok=True)
+        json.dump(report, open(args.report_path, 'w'), indent=2)
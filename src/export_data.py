@@ -17,10 +17,14 @@ limitations under the License.
 # python3 export_data.py --params_path=candid.json --export_folder=samples
 
 import json
+import os
 import argparse
 import ee
 from utils import TaskManager, SampleExporter, TropomiImagery, DSMImagery
 from utils import RoadImagery, MultiSpectralImagery, WindImagery, stack_bands_from_imagery
+from utils import TargetStratification, SceneIndex, geometry_bounds
+from utils import grid_cells
+from utils import date_to_millis
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Export TFRecords from EE')
@@ -32,8 +36,6 @@ if __name__ == "__main__":
     parser.add_argument('--end_date', type=str,
                         help="end of the date range to export in YYYY-MM-DD",
                         default="2019-12-31")
-    parser.add_argument('--params_path', type=str,
-                        help="json parameters file location")
     parser.add_argument('--export_folder', type=str,
                         help="Cloud export folder")
     parser.add_argument('--bucket_name', type=str,
@@ -45,6 +47,51 @@ if __name__ == "__main__":
     parser.add_argument('--num_shards', type=int,
                         help="number of sharding of samples before export",
                         default=10)
+    parser.add_argument('--export_format', type=str,
+                        choices=['patches', 'tiles'],
+                        help="export one patch per sample or one tile per "
+                        "image with sample offsets",
+                        default='patches')
+    parser.add_argument('--static_index', type=str,
+                        help="local json file indexing static layers, when "
+                        "given road and DSM bands are exported once per "
+                        "region instead of with every sample",
+                        default=None)
+    parser.add_argument('--scene_catalog', type=str,
+                        help="local json file indexing the scenes exported "
+                        "for the location and time requests of "
+                        "serve_model.py, see build_static_cache.py",
+                        default=None)
+    parser.add_argument('--static_cell_size', type=float,
+                        help="size in degrees of the grid cells the static "
+                        "layers are exported for", default=1.0)
+    parser.add_argument('--no2_bins', type=int,
+                        help="number of NO2 quantile bins to stratify the "
+                        "samples on, 0 to sample uniformly from valid pixels",
+                        default=0)
+    parser.add_argument('--strata_band', type=str,
+                        help="band crossed with the NO2 bins, e.g. road "
+                        "density", default=None)
+    parser.add_argument('--strata_thresholds', type=str,
+                        help="comma separated thresholds of strata_band bins",
+                        default="")
+    parser.add_argument('--quotas', type=str,
+                        help="comma separated number of samples per stratum, "
+                        "split equally by default", default="")
+    parser.add_argument('--manifest_path', type=str,
+                        help="local json file recording the achieved strata",
+                        default=None)
+    parser.add_argument('--aoi', type=str,
+                        help="GeoJSON file of the geometries of interest, "
+                        "only intersecting scenes are exported",
+                        default=None)
+    parser.add_argument('--scene_index', type=str,
+                        help="local json cache of the scene footprints index",
+                        default="scene_index.json")
+    parser.add_argument('--first_image', type=int,
+                        help="index of the first multispectral image to "
+                        "export, to resume an interrupted export",
+                        default=0)
 
     args = parser.parse_args()
     params_path = args.params_path
@@ -54,6 +101,21 @@ if __name__ == "__main__":
     export_folder = args.export_folder
     num_samples = args.num_samples
     num_shards = args.num_shards
+    export_format = args.export_format
+    static_index_path = args.static_index
+    static_cell_size = args.static_cell_size
+    scene_catalog_path = args.scene_catalog
+    no2_bins = args.no2_bins
+    strata_band = args.strata_band
+    strata_thresholds = [float(t) for t in args.strata_thresholds.split(',')
+                         if t]
+    quotas = [int(q) for q in args.quotas.split(',') if q] or None
+    if (strata_band or strata_thresholds) and no2_bins == 0:
+        raise ValueError("strata_band and strata_thresholds require no2_bins")
+    manifest_path = args.manifest_path
+    aoi_path = args.aoi
+    scene_index_path = args.scene_index
+    first_image = args.first_image
 
     # params formated as folllows:
     # params = {"collections" : collections_dict,
@@ -74,6 +136,18 @@ if __name__ == "__main__":
     patch_bands += params['bands']['road'] + params['bands']['dsm']
     patch_bands += ["%i_%s" % (i, b) for b in params['bands']['wind']
                     for i in range(12)]
+    # static_bands are exported once per region if static_index_path is set
+    static_bands = params['bands']['road'] + params['bands']['dsm']
+    static_index = {}
+    if static_index_path:
+        # Regions exported by previous runs are kept
+        if os.path.exists(static_index_path):
+            static_index = json.load(open(static_index_path, 'r'))
+        patch_bands = [b for b in patch_bands if b not in static_bands]
+    scene_catalog = {}
+    if scene_catalog_path and os.path.exists(scene_catalog_path):
+        # Scenes exported by previous runs are kept
+        scene_catalog = json.load(open(scene_catalog_path, 'r'))
 
     all_bands = patch_bands + ["HOD", "DOW", "DOM", "MOY", "latitude",
                                "longitude", "valid"]
@@ -92,16 +166,46 @@ if __name__ == "__main__":
     horizontal_kernel = ee.Kernel.rectangle(xRadius=kernel_radius,
                                             yRadius=1,
                                             units='pixels')
+    # Sampling strategy, stratified on NO2 bins if no2_bins > 0
+    sampling = None
+    if no2_bins > 0:
+        sampling = TargetStratification(num_bins=no2_bins,
+                                        strata_band=strata_band,
+                                        strata_thresholds=strata_thresholds,
+                                        quotas=quotas)
     # Initializing SampleExporter and TaskManager
     task_manager = TaskManager(verbose=True)
     sampler = SampleExporter(task_manager, num_samples, num_shards,
                              neighborhood_kernel, scale, bucket_name,
-                             export_folder)
+                             export_folder, sampling=sampling,
+                             manifest_path=manifest_path)
+    # Selecting the scenes intersecting the AOI from the local index
+    aoi = None
+    scene_ids = None
+    if aoi_path:
+        aoi_geojson = json.load(open(aoi_path, 'r'))
+        if aoi_geojson['type'] not in ['Feature', 'FeatureCollection']:
+            aoi_geojson = {'type': 'Feature', 'geometry': aoi_geojson,
+                           'properties': {}}
+        if aoi_geojson['type'] == 'Feature':
+            aoi_geojson = {'type': 'FeatureCollection',
+                           'features': [aoi_geojson]}
+        # The cache of a collection and date range serves any AOI
+        scene_index = SceneIndex.from_collection(
+            params['collections']['multispectral'], scene_index_path,
+            start_date=start_date, end_date=end_date)
+        scene_ids = scene_index.query_geometries(aoi_geojson['features'],
+                                                 date_to_millis(start_date),
+                                                 date_to_millis(end_date))
+        print("%i scenes intersect the AOI" % len(scene_ids))
+        aoi = ee.FeatureCollection([ee.Feature(f) for f in
+                                    aoi_geojson['features']]).geometry()
     # Initializing imagery classes
     multispectral = MultiSpectralImagery(params['collections']['multispectral'],
                                          start_date, end_date,
                                          bands=params['bands']['multispectral'],
-                                         scale=scale)
+                                         scale=scale, aoi=aoi,
+                                         scene_ids=scene_ids)
     tropomi = TropomiImagery(params['collections']['tropomi'],
                              bands=params['bands']['tropomi'])
     # Wind imagery adds wind bands from the previous 12 hours
@@ -116,13 +220,30 @@ if __name__ == "__main__":
 
     print("Stacking bands for %i multispectral images" % len(multispectral))
     # We loop through Multispectral Images
-    # First 2 images already exported
-    for j in range(2, len(multispectral)):
+    for j in range(first_image, len(multispectral)):
 
         multispectral_image = multispectral[j]
         image_info = multispectral_image.getInfo()
         image_id = image_info['properties']['productionID']
         print("Exporting for Multispectral N:%i, %s" % (j, image_id))
+        if static_index_path:
+            # Static layers are exported once per grid cell of the scene
+            scene_bounds = geometry_bounds(
+                multispectral_image.geometry().bounds().getInfo())
+            cells = grid_cells(scene_bounds, static_cell_size)
+            for region_id, bounds in cells.items():
+                if region_id in static_index:
+                    continue
+                # DSM is the most recent prior to the multispectral date
+                geometry = ee.Geometry.Rectangle(bounds)
+                date = ee.Date(multispectral_image.get('collectionStartTime'))
+                static_image = road.get_bands(geometry).addBands(
+                    dsm.get_bands(date, geometry))
+                static_image = static_image.select(
+                    static_bands, ["patch_%s" % b for b in static_bands])
+                static_index[region_id] = sampler.export_static_layers(
+                    static_image, region_id, bounds)
+                json.dump(static_index, open(static_index_path, 'w'))
         # ImageCollection of images that contain all_bands
         # ImageCollection is pre-filtered so that alll images have at least
         # num_samples valid pixels
@@ -139,7 +260,36 @@ if __name__ == "__main__":
         # We loop through the images with stacked bands
         for i in range(min(size, 2)):
             export_id = image_id + "_%i" % i
-            sampler.export_patches(ee.Image(listed.get(i)),
-                                   bands=all_bands,
-                                   patch_bands=patch_bands,
-                                   export_id=export_id)
+            if scene_catalog_path and export_id not in scene_catalog:
+                # Patch bands of the whole scene, static ones included
+                scene_image = ee.Image(listed.get(i))
+                scene_time = ee.Date(scene_image.get('system:time_start'))
+                scene_image = scene_image.select(
+                    patch_bands, ["patch_%s" % b for b in patch_bands])
+                if static_index_path:
+                    geometry = multispectral_image.geometry()
+                    scene_image = scene_image.addBands(
+                        road.get_bands(geometry).addBands(
+                            dsm.get_bands(scene_time, geometry)).select(
+                                static_bands,
+                                ["patch_%s" % b for b in static_bands]))
+                scene = sampler.export_static_layers(
+                    scene_image, export_id, geometry_bounds(
+                        multispectral_image.geometry().bounds().getInfo()),
+                    folder='scenes')
+                scene['time'] = scene_time.format(
+                    "YYYY-MM-dd'T'HH:mm:ss").getInfo()
+                scene_catalog[export_id] = scene
+                json.dump(scene_catalog, open(scene_catalog_path, 'w'))
+            if export_format == 'tiles':
+                sampler.export_tiles(ee.Image(listed.get(i)),
+                                     bands=all_bands,
+                                     patch_bands=patch_bands,
+                                     export_id=export_id)
+            else:
+                sampler.export_patches(ee.Image(listed.get(i)),
+                                       bands=all_bands,
+                                       patch_bands=patch_bands,
+                                       export_id=export_id)
+    # Strata of the last exports are requested together
+    sampler.flush_manifest()
@@ -0,0 +1,172 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 export_model.py --params_path=candid.json --model_type=CNN
+#     --model_path=checkpoints/CNN_99.ckp --tfrecords_path=samples
+#     --output_path=CNN_int8.tflite --mode=int8
+
+import argparse
+import json
+import os
+import numpy as np
+import training
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export a model to TFLite')
+    parser.add_argument('--params_path', type=str,
+                        help="json parameters file location")
+    parser.add_argument('--model_type', type=str, default='CNN',
+                        choices=training.SINGLE_INPUT_MODELS,
+                        help="type of the trained model")
+    parser.add_argument('--model_path', type=str,
+                        help="SavedModel written by train_models.py or "
+                        "folder of its checkpoints")
+    parser.add_argument('--bands', type=str,
+                        default='spectral,tropo,dsm,wind,road',
+                        help="comma separated band groups of the model")
+    parser.add_argument('--tfrecords_path', type=str,
+                        help="folder of the GZIP TFRecords")
+    parser.add_argument('--split_path', type=str, default=None,
+                        help="split.json written by train_models.py, the "
+                        "drift is measured on its evaluation records and "
+                        "int8 activations calibrated on its training ones, "
+                        "defaults to the one next to model_path")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of the train/eval split of train_models.py "
+                        "without split.json")
+    parser.add_argument('--output_path', type=str,
+                        help=".tflite file to write")
+    parser.add_argument('--mode', type=str, default='dynamic',
+                        choices=training.QUANTIZATION_MODES,
+                        help="post-training quantization")
+    parser.add_argument('--calibration_records', type=int, default=200,
+                        help="number of records calibrating int8 "
+                        "activations")
+    parser.add_argument('--eval_batches', type=int, default=20,
+                        help="number of batches of 32 records comparing "
+                        "the predictions")
+    parser.add_argument('--batch_sizes', type=str, default='1,8,32',
+                        help="comma separated batch sizes of the latency "
+                        "benchmark")
+    parser.add_argument('--num_threads', type=int, default=None,
+                        help="CPU threads of the TFLite interpreter")
+    parser.add_argument('--static_cache', type=str, default=None,
+                        help="static layer cache built by "
+                        "build_static_cache.py")
+    parser.add_argument('--band_stats', type=str, default=None,
+                        help="band_stats.json the model was trained with")
+    parser.add_argument('--global_pooling', action='store_true',
+                        help="CNN trained with --crop_schedule")
+    parser.add_argument('--report_path', type=str, default=None,
+                        help="json file of the report")
+
+    args = parser.parse_args()
+    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+    params = json.load(open(args.params_path, 'r'))
+    kernel_radius = params['kernel_radius']
+    patch_size = 2 * kernel_radius + 1
+    input_bands = [training.select_bands(args.bands.split(','))]
+    output = training.OUTPUT_BANDS
+    features_dict = training.get_features_dict(kernel_radius)
+    static_cache = None
+    if args.static_cache:
+        static_cache = training.StaticLayerCache(args.static_cache,
+                                                 kernel_radius)
+        for band in static_cache.bands:
+            features_dict.pop(band, None)
+    quantization = training.load_quantization(args.tfrecords_path)
+    band_stats = None
+    # Predictions and outputs are compared in NO2 units
+    output_scale = 10000.0
+    if args.band_stats:
+        band_stats = training.load_band_stats(args.band_stats)
+        output_scale = float(training.normalization_constants(
+            band_stats, output, center=False)[1][0])
+    split_path = args.split_path
+    if split_path is None:
+        # Checkpoint folder, or the folder of a saved model
+        split_path = os.path.join(args.model_path, training.SPLIT_FILE)
+        if not os.path.exists(split_path):
+            split_path = os.path.join(os.path.dirname(os.path.normpath(
+                args.model_path)), training.SPLIT_FILE)
+    if os.path.exists(split_path):
+        split = training.load_split(split_path)
+    else:
+        print("No %s, splitting the files with seed %i" % (split_path,
+                                                          args.seed))
+        train_files, eval_files = training.split_tfrecords(
+            training.list_tfrecords(args.tfrecords_path), args.seed)
+        split = {'split': 'file', 'train_files': train_files,
+                 'eval_files': eval_files}
+
+    if split['split'] == 'file':
+        def load(files, shuffle_buffer=0):
+            dataset = training.load_batched_tfrecords(
+                files, features_dict, input_bands, output, 32,
+                shuffle_buffer=shuffle_buffer, static_cache=static_cache,
+                quantization=quantization, band_stats=band_stats)
+            if band_stats is None:
+                dataset = dataset.map(training.scale_no2)
+            return dataset
+
+        calibration_dataset = load(split['train_files'], shuffle_buffer=1000)
+        eval_dataset = load(split['eval_files'])
+    else:
+        # Blocks of records held out by a spatial or temporal split
+        index = training.load_record_index(
+            sorted(split['train_files'] + split['eval_files']),
+            split['index_path'])
+        is_eval = training.eval_records(index, split['split'],
+                                        split['eval_fold'])
+
+        def load(record_ids, shuffle):
+            dataset = training.load_indexed_tfrecords(
+                index, features_dict, input_bands, output, 32,
+                record_ids=record_ids, shuffle=shuffle,
+                static_cache=static_cache, quantization=quantization,
+                band_stats=band_stats)
+            if band_stats is None:
+                dataset = dataset.map(training.scale_no2)
+            return dataset
+
+        calibration_dataset = load(np.flatnonzero(~is_eval), True)
+        eval_dataset = load(np.flatnonzero(is_eval), False)
+
+    model = training.load_inference_model(
+        args.model_path, args.model_type, len(input_bands[0]),
+        band_stats is None, args.global_pooling)
+    calibration = training.representative_dataset(
+        calibration_dataset, args.calibration_records)
+    content = training.convert_tflite(model, patch_size, args.mode,
+                                      calibration)
+    with open(args.output_path, 'wb') as file:
+        file.write(content)
+
+    tflite_model = training.TFLiteModel(content, args.num_threads)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    input_shape = [patch_size, patch_size, len(input_bands[0])]
+    report = {'mode': args.mode, 'bytes': len(content),
+              'drift': training.prediction_drift(
+                  model, tflite_model, eval_dataset, args.eval_batches,
+                  output_scale),
+              'float': training.benchmark_batch_sizes(
+                  model.predict_on_batch, input_shape, batch_sizes),
+              'tflite': training.benchmark_batch_sizes(
+                  tflite_model.predict_on_batch, input_shape, batch_sizes)}
+    print(json.dumps(report, indent=2))
+    if args.report_path:
+        json.dump(report, open(args.report_path, 'w'), indent=2)
@@ -0,0 +1,81 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 predict_raster.py --params_path=candid.json --model_type=CNN
+#     --model_path=checkpoints/CNN_99.ckp --raster_path=scene.npy
+#     --output_path=no2_map.npy --stride=32 --processes=4
+
+import argparse
+import json
+import os
+import training
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Predict a NO2 map')
+    parser.add_argument('--params_path', type=str,
+                        help="json parameters file location")
+    parser.add_argument('--model_type', type=str, default='CNN',
+                        choices=training.SINGLE_INPUT_MODELS,
+                        help="type of the trained model")
+    parser.add_argument('--model_path', type=str,
+                        help="SavedModel written by train_models.py or "
+                        "folder of its checkpoints")
+    parser.add_argument('--bands', type=str,
+                        default='spectral,tropo,dsm,wind,road',
+                        help="comma separated band groups of the model")
+    parser.add_argument('--raster_path', type=str,
+                        help="HxWxC float32 .npy of the bands of the groups, "
+                        "in training.select_bands order")
+    parser.add_argument('--output_path', type=str,
+                        help=".npy of the predictions, the one at (i, j) is "
+                        "centered on pixel (i*stride+r, j*stride+r)")
+    parser.add_argument('--stride', type=int, default=None,
+                        help="pixels between predictions, dividing the "
+                        "output stride of the model, defaults to it")
+    parser.add_argument('--tile_size', type=int, default=64,
+                        help="predictions per side of a tile")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument('--band_stats', type=str, default=None,
+                        help="band_stats.json the model was trained with")
+    parser.add_argument('--global_pooling', action='store_true',
+                        help="CNN trained with --crop_schedule")
+    parser.add_argument('--exact', action='store_true',
+                        help="predicts the patches of zero padded models, "
+                        "e.g. CNN, one by one instead of with a dense pass")
+
+    args = parser.parse_args()
+    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+    params = json.load(open(args.params_path, 'r'))
+    patch_size = 2 * params['kernel_radius'] + 1
+    bands = training.select_bands(args.bands.split(','))
+    offsets = scales = None
+    # Predictions are multiplied back to NO2 units
+    output_scale = 10000.0
+    if args.band_stats:
+        stats = training.load_band_stats(args.band_stats)
+        offsets, scales = training.normalization_constants(stats, bands)
+        output_scale = float(training.normalization_constants(
+            stats, training.OUTPUT_BANDS, center=False)[1][0])
+    model_args = (args.model_path, args.model_type, len(bands),
+                  args.band_stats is None, args.global_pooling)
+    report = training.predict_raster(
+        model_args, args.raster_path, args.output_path, patch_size,
+        stride=args.stride, tile_size=args.tile_size,
+        processes=args.processes, offsets=offsets, scales=scales,
+        output_scale=output_scale, exact=args.exact)
+    print(json.dumps(report, indent=2))
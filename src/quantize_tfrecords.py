@@ -0,0 +1,66 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 quantize_tfrecords.py --params_path=candid.json
+#     --tfrecords_path=samples --output_path=samples_int16 --benchmark
+
+import argparse
+import json
+import training
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Quantize TFRecords')
+    parser.add_argument('--params_path', type=str,
+                        help="json parameters file location")
+    parser.add_argument('--tfrecords_path', type=str,
+                        help="folder of the float32 TFRecords")
+    parser.add_argument('--output_path', type=str,
+                        help="folder of the quantized TFRecords")
+    parser.add_argument('--encoding', type=str, default='int16',
+                        choices=['int16', 'float16'])
+    parser.add_argument('--max_records', type=int, default=10000,
+                        help="number of records used to compute band ranges")
+    parser.add_argument('--static_cache', type=str, default=None,
+                        help="static layer cache built by "
+                        "build_static_cache.py, for shards exported with "
+                        "--static_index")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="report bytes per record and decode throughput")
+
+    args = parser.parse_args()
+    params = json.load(open(args.params_path, 'r'))
+    features_dict = training.get_features_dict(params['kernel_radius'])
+    if args.static_cache:
+        # Static bands are not in the records, they are in the cache
+        for band in training.StaticLayerCache(
+                args.static_cache, params['kernel_radius']).bands:
+            features_dict.pop(band, None)
+    tfrecord_files = training.list_tfrecords(args.tfrecords_path)
+
+    spec = training.compute_quantization(tfrecord_files, features_dict,
+                                         args.encoding, args.max_records)
+    training.quantize_tfrecords(tfrecord_files, args.output_path,
+                                features_dict, spec)
+
+    if args.benchmark:
+        report = {
+            'float32': training.benchmark_decoding(tfrecord_files,
+                                                   features_dict),
+            args.encoding: training.benchmark_decoding(
+                training.list_tfrecords(args.output_path), features_dict,
+                spec)}
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,128 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 run_sweep.py --params_path=candid.json --tfrecords_path=samples
+#     --sweep_path=sweeps/CNN --space=space.json --parallel_trials=4
+# where space.json lists the values of each hyperparameter, e.g.
+# {"learning_rate": [1e-5, 1e-4], "optimizer": ["RMSprop", "Adam"],
+#  "batch_size": [32, 64], "loss": ["MeanSquaredError", "Huber"]}
+
+import argparse
+import json
+import os
+import training
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a hyperparameter sweep')
+    parser.add_argument('--params_path', type=str,
+                        help="json parameters file location")
+    parser.add_argument('--tfrecords_path', type=str,
+                        help="folder of the GZIP TFRecords")
+    parser.add_argument('--split_path', type=str, default=None,
+                        help="split.json written by train_models.py, the "
+                        "files of the trials are split with --seed as in "
+                        "train_models.py by default")
+    parser.add_argument('--sweep_path', type=str,
+                        help="folder of the decoded arrays, trial histories "
+                        "and results")
+    parser.add_argument('--space', type=str,
+                        help="json file of the values of each "
+                        "hyperparameter among %s" %
+                        ', '.join(training.DEFAULT_HPARAMS))
+    parser.add_argument('--model_type', type=str, default='CNN',
+                        choices=training.SINGLE_INPUT_MODELS,
+                        help="type of the trained model")
+    parser.add_argument('--bands', type=str,
+                        default='spectral,tropo,dsm,wind,road',
+                        help="comma separated band groups of the model")
+    parser.add_argument('--num_trials', type=int, default=None,
+                        help="number of trials sampled from the grid, all "
+                        "by default")
+    parser.add_argument('--parallel_trials', type=int, default=2,
+                        help="number of trials run at once")
+    parser.add_argument('--cpus_per_trial', type=int, default=None,
+                        help="CPU threads of a trial, the CPUs are shared "
+                        "by default")
+    parser.add_argument('--epochs', type=int, default=20,
+                        help="maximum number of epochs of a trial")
+    parser.add_argument('--steps_per_epoch', type=int, default=100)
+    parser.add_argument('--patience', type=int, default=3,
+                        help="epochs without improvement before a trial "
+                        "stops early")
+    parser.add_argument('--grace_epochs', type=int, default=2,
+                        help="epochs before a trial worse than the median "
+                        "is pruned")
+    parser.add_argument('--max_records', type=int, default=None,
+                        help="maximum number of decoded training records")
+    parser.add_argument('--static_cache', type=str, default=None,
+                        help="static layer cache built by "
+                        "build_static_cache.py")
+    parser.add_argument('--band_stats', type=str, default=None,
+                        help="band_stats.json normalizing the bands")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of the train/eval split of the files and "
+                        "of the trials")
+
+    args = parser.parse_args()
+    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+    params = json.load(open(args.params_path, 'r'))
+    kernel_radius = params['kernel_radius']
+    bands = training.select_bands(args.bands.split(','))
+    features_dict = training.get_features_dict(kernel_radius)
+    static_cache = None
+    if args.static_cache:
+        static_cache = training.StaticLayerCache(args.static_cache,
+                                                 kernel_radius)
+        for band in static_cache.bands:
+            features_dict.pop(band, None)
+    quantization = training.load_quantization(args.tfrecords_path)
+    band_stats = None
+    if args.band_stats:
+        band_stats = training.load_band_stats(args.band_stats)
+    if args.split_path:
+        split = training.load_split(args.split_path)
+        assert split.get('split', 'file') == 'file', \
+            "Only file splits are supported, not %s" % split['split']
+        train_files, eval_files = split['train_files'], split['eval_files']
+    else:
+        # The files held out by train_models.py with the same seed
+        train_files, eval_files = training.split_tfrecords(
+            training.list_tfrecords(args.tfrecords_path), args.seed)
+    assert train_files and eval_files, "Empty train or eval split"
+    cache_path = os.path.join(args.sweep_path, 'arrays')
+    # Records are decoded once, every trial reads the same arrays
+    train_path, eval_path = [training.decode_arrays(
+        split_files, features_dict, bands, training.OUTPUT_BANDS,
+        cache_path, static_cache=static_cache, quantization=quantization,
+        band_stats=band_stats, max_records=max_records)
+        for split_files, max_records in [(train_files, args.max_records),
+                                         (eval_files, None)]]
+
+    space = json.load(open(args.space, 'r'))
+    trials = training.grid_trials(space, args.num_trials, args.seed)
+    print("Running %i trials, %i at once" % (len(trials),
+                                             args.parallel_trials))
+    results = training.run_sweep(
+        trials, train_path, eval_path, args.sweep_path, args.model_type,
+        args.parallel_trials, args.cpus_per_trial, band_stats is None,
+        args.epochs, args.steps_per_epoch, args.patience, args.grace_epochs,
+        args.seed)
+    results_path = os.path.join(args.sweep_path, 'sweep_results.csv')
+    training.save_results(results, results_path)
+    for result in results:
+        print(result)
+    print("Results written to %s" % results_path)
@@ -0,0 +1,123 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 serve_model.py --params_path=candid.json --model_type=CNN
+#     --model_path=checkpoints/CNN_99.ckp --port=8080 --max_batch_size=32
+#     --max_delay_ms=10 --num_workers=2
+# curl -X POST localhost:8080/predict -d '{"instances": [{"latitude": 40.4,
+#     "longitude": -3.7, "time": "2020-06-01T13:00"}]}'
+# curl localhost:8080/stats
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+import training
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve NO2 predictions')
+    parser.add_argument('--params_path', type=str,
+                        help="json parameters file location")
+    parser.add_argument('--model_type', type=str, default='CNN',
+                        choices=training.SINGLE_INPUT_MODELS,
+                        help="type of the trained model")
+    parser.add_argument('--model_path', type=str,
+                        help="SavedModel written by train_models.py, folder "
+                        "of its checkpoints or .tflite of export_model.py")
+    parser.add_argument('--bands', type=str,
+                        default='spectral,tropo,dsm,wind,road',
+                        help="comma separated band groups of the model")
+    parser.add_argument('--scenes_path', type=str, default=None,
+                        help="folder of the scenes.json catalog of location "
+                        "and time requests, built by build_static_cache.py "
+                        "with --scene_catalog")
+    parser.add_argument('--host', type=str, default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max_batch_size', type=int, default=32,
+                        help="maximum number of records per batch")
+    parser.add_argument('--max_delay_ms', type=float, default=10,
+                        help="milliseconds a request waits for others")
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help="number of batches predicted concurrently")
+    parser.add_argument('--num_threads', type=int, default=None,
+                        help="CPU threads of each TFLite interpreter")
+    parser.add_argument('--band_stats', type=str, default=None,
+                        help="band_stats.json the model was trained with")
+    parser.add_argument('--global_pooling', action='store_true',
+                        help="CNN trained with --crop_schedule")
+
+    args = parser.parse_args()
+    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+    import tensorflow as tf
+
+    params = json.load(open(args.params_path, 'r'))
+    kernel_radius = params['kernel_radius']
+    bands = training.select_bands(args.bands.split(','))
+    patch_shape = [2 * kernel_radius + 1, 2 * kernel_radius + 1, len(bands)]
+    offsets = scales = None
+    # Predictions are returned in NO2 units
+    output_scale = 10000.0
+    if args.band_stats:
+        stats = training.load_band_stats(args.band_stats)
+        offsets, scales = training.normalization_constants(stats, bands)
+        output_scale = float(training.normalization_constants(
+            stats, training.OUTPUT_BANDS, center=False)[1][0])
+
+    if args.model_path.endswith('.tflite'):
+        content = open(args.model_path, 'rb').read()
+
+        def predict_factory():
+            # Interpreters are not thread safe, one per worker
+            return training.serving_predict(
+                training.TFLiteModel(content, args.num_threads)
+                .predict_on_batch, offsets, scales, output_scale)
+    else:
+        model = training.load_inference_model(
+            args.model_path, args.model_type, len(bands),
+            args.band_stats is None, args.global_pooling)
+        predict = tf.function(
+            lambda patches: model(patches, training=False),
+            input_signature=[tf.TensorSpec([None] + patch_shape,
+                                           tf.float32)])
+        predict_batch = training.serving_predict(
+            lambda patches: predict(patches).numpy(), offsets, scales,
+            output_scale)
+
+        def predict_factory():
+            return predict_batch
+
+    catalog = None
+    if args.scenes_path:
+        catalog = training.SceneCatalog(args.scenes_path, bands,
+                                        kernel_radius)
+    batching_queue = training.BatchingQueue(
+        predict_factory, args.max_batch_size, args.max_delay_ms / 1000,
+        args.num_workers)
+    # Traces the model before the first request
+    batching_queue.submit(np.zeros(patch_shape, np.float32)).result()
+    batching_queue.stats = training.LatencyStats()
+    server = training.start_server(batching_queue, patch_shape, args.host,
+                                   args.port, catalog)
+    print("Serving on %s:%i" % server.server_address)
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(batching_queue.stats.summary()))
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,93 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import unittest
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from tensorflow.keras import layers, models
+from training import (build_model, count_flops, EFFICIENT_VARIANTS,
+                      center_crop_groups, mutlicnn)
+
+
+# run : python -m unittest architectures_test.py
+class TestArchitectures(unittest.TestCase):
+    """Unittests the shapes and costs of the model architectures."""
+
+    def test_count_flops(self):
+        """Asserts the FLOPs of each counted layer type."""
+        inputs = layers.Input(shape=[8, 8, 3])
+        conv = layers.Conv2D(4, (3, 3), strides=2, padding='same')(inputs)
+        depthwise = layers.DepthwiseConv2D((3, 3))(conv)
+        pooled = layers.GlobalAveragePooling2D()(depthwise)
+        output = layers.Dense(2)(pooled)
+        model = models.Model(inputs, output)
+        expected = (2 * 4 * 4 * 3 * 3 * 3 * 4 +  # 4x4x4 strided conv
+                    2 * 2 * 2 * 3 * 3 * 4 +      # 2x2x4 depthwise
+                    2 * 4 * 2)                   # dense
+        self.assertEqual(count_flops(model), expected)
+
+    def test_efficient_shapes(self):
+        """Asserts the 1x1x1 output of the variants at any patch size."""
+        for variant in EFFICIENT_VARIANTS:
+            for patch_size in [33, 64, 65]:
+                model = build_model(variant,
+                                    layers.Input(shape=[patch_size,
+                                                        patch_size, 5]))
+                self.assertEqual(model.output_shape, (None, 1, 1, 1))
+                predictions = model.predict_on_batch(
+                    np.zeros([2, patch_size, patch_size, 5], np.float32))
+                self.assertEqual(predictions.shape, (2, 1, 1, 1))
+            self.assertLess(count_flops(build_model(
+                variant, layers.Input(shape=[65, 65, 5]))), count_flops(
+                    build_model('CNN', layers.Input(shape=[65, 65, 5]),
+                                global_pooling=True)))
+
+    def test_multicnn_shapes(self):
+        """Asserts the output of branches of different sizes and crops."""
+        inputs = [layers.Input(shape=[33, 33, 5]),
+                  layers.Input(shape=[9, 9, 2]),
+                  layers.Input(shape=[33, 33, 1]),
+                  layers.Input(shape=[1, 1, 6])]
+        model = mutlicnn.get_model(inputs, resolutions=[1, 1, 4, 1])
+        self.assertEqual(model.output_shape, (None, 1, 1, 1))
+        batch = [np.zeros([2] + list(inp.shape[1:]), np.float32)
+                 for inp in inputs]
+        self.assertEqual(model.predict_on_batch(batch).shape, (2, 1, 1, 1))
+        with self.assertRaises(ValueError):
+            mutlicnn.get_model([layers.Input(shape=[5, 5, 1])])
+
+    def test_center_crop_groups(self):
+        """Asserts that groups are cropped around their center pixel."""
+        patches = np.arange(2 * 9 * 9).reshape([2, 9, 9, 1])
+        output = np.ones([2, 1, 1, 1])
+        cropped = center_crop_groups([3, None])(patches, patches, output)
+        self.assertEqual(cropped[0].shape, (2, 3, 3, 1))
+        np.testing.assert_array_equal(cropped[0][:, 1, 1],
+                                      patches[:, 4, 4])
+        self.assertIs(cropped[1], patches)
+        self.assertIs(cropped[2], output)
+
+    def test_unknown_model(self):
+        """Asserts that an unknown model type raises ValueError."""
+        with self.assertRaises(ValueError):
+            build_model('UNKNOWN', layers.Input(shape=[33, 33, 5]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import tempfile
+import unittest
+import numpy as np
+import tensorflow as tf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from training import (BandAccumulator, compute_band_stats,
+                      normalization_constants, vector_transforms, wind_pairs)
+from training.load_data import dihedral_step
+
+
+def write_records(file, patches):
+    """Writes a GZIP TFRecord file with a patch band per record."""
+    with tf.io.TFRecordWriter(file, options='GZIP') as writer:
+        for patch in patches:
+            feature = {'patch_B': tf.train.Feature(
+                float_list=tf.train.FloatList(value=patch.ravel()))}
+            example = tf.train.Example(
+                features=tf.train.Features(feature=feature))
+            writer.write(example.SerializeToString())
+
+
+# run : python -m unittest band_stats_test.py
+class TestBandStats(unittest.TestCase):
+    """Unittests the mergeable band statistics."""
+
+    def test_merge(self):
+        """Asserts that merged accumulators match the statistics of all."""
+        rng = np.random.default_rng(0)
+        parts = [rng.normal(i, i + 1, size=1000 * (i + 1)) for i in range(4)]
+        merged = BandAccumulator(seed=0)
+        for part in parts:
+            merged.merge(BandAccumulator(seed=1).update(part))
+        values = np.concatenate(parts)
+        summary = merged.summary()
+        self.assertEqual(summary['count'], values.size)
+        self.assertAlmostEqual(summary['mean'], values.mean())
+        self.assertAlmostEqual(summary['std'], values.std())
+        self.assertEqual(summary['min'], values.min())
+        self.assertEqual(summary['max'], values.max())
+
+    def test_merge_large_counts(self):
+        """Asserts that accumulators of more than 1e9 values merge."""
+        def large(value, count):
+            accumulator = BandAccumulator(sample_size=10000, seed=0)
+            accumulator.count = count
+            accumulator.mean = value
+            accumulator.minimum = accumulator.maximum = value
+            accumulator.sample = np.full(10000, value, dtype=np.float32)
+            return accumulator
+
+        merged = large(0.0, 2 * 10 ** 9)
+        merged.merge(BandAccumulator().update(np.ones([257, 257])))
+        self.assertEqual(merged.count, 2 * 10 ** 9 + 257 * 257)
+        merged.merge(large(1.0, 4 * 10 ** 9))
+        self.assertEqual(len(merged.sample), 10000)
+        # Values are sampled in proportion to the counts of both sides
+        self.assertAlmostEqual(merged.sample.mean(), 2 / 3, delta=0.03)
+        self.assertAlmostEqual(merged.summary()['mean'], 2 / 3, places=4)
+
+    def test_sampled_quantiles(self):
+        """Asserts the quantiles estimated from a bounded sample."""
+        accumulator = BandAccumulator(sample_size=20000, seed=0)
+        for start in range(0, 100000, 10000):
+            accumulator.update(np.arange(start, start + 10000,
+                                         dtype=np.float64))
+        accumulator.update([np.nan, np.inf])
+        summary = accumulator.summary(quantiles=[0.5])
+        self.assertEqual(summary['nonfinite'], 2)
+        self.assertAlmostEqual(summary['quantiles']['0.5'], 50000, delta=2000)
+
+    def test_compute_band_stats(self):
+        """Asserts the statistics computed over files by worker processes."""
+        rng = np.random.default_rng(0)
+        patches = rng.uniform(0, 10, size=(30, 3, 3))
+        with tempfile.TemporaryDirectory() as folder:
+            files = []
+            for i in range(3):
+                file = os.path.join(folder, 'export_%i.tfrecord.gz' % i)
+                write_records(file, patches[10 * i:10 * (i + 1)])
+                files.append(file)
+            stats = compute_band_stats(files, ['patch_B', 'missing'],
+                                       processes=2)
+        self.assertEqual(list(stats), ['patch_B'])
+        self.assertEqual(stats['patch_B']['count'], patches.size)
+        self.assertAlmostEqual(stats['patch_B']['mean'], patches.mean(),
+                               places=5)
+        self.assertAlmostEqual(stats['patch_B']['std'], patches.std(),
+                               places=5)
+
+    def test_wind_normalization(self):
+        """Asserts that wind normalization commutes with the dihedral group."""
+        bands = ['patch_B', 'patch_0_u_component_of_wind_10m',
+                 'patch_0_v_component_of_wind_10m']
+        stats = {'patch_B': {'mean': 5.0, 'std': 2.0},
+                 bands[1]: {'mean': 3.0, 'std': 1.0},
+                 bands[2]: {'mean': -1.0, 'std': 4.0}}
+        offsets, scales = normalization_constants(stats, bands)
+        self.assertEqual(offsets[0], 5.0)
+        self.assertEqual(list(offsets[1:]), [0, 0])
+        self.assertEqual(scales[1], scales[2])
+
+        def normalize(patches):
+            return (patches - offsets) * scales
+
+        steps = vector_transforms(len(bands), wind_pairs(bands))
+        spatials = [lambda x: tf.transpose(x, [0, 2, 1, 3]),
+                    lambda x: tf.reverse(x, [1]),
+                    lambda x: tf.reverse(x, [2])]
+        patches = tf.constant(np.random.default_rng(0).normal(
+            size=[8, 5, 5, 3]), tf.float32)
+        # Every element of the group is a composition of the three steps
+        for element in range(8):
+            rotated = patches
+            normalized = normalize(patches)
+            for i, (spatial, (permutation, signs)) in enumerate(
+                    zip(spatials, steps)):
+                mask = tf.fill([8], bool(element >> i & 1))
+                rotated = dihedral_step(rotated, mask, spatial, permutation,
+                                        signs)
+                normalized = dihedral_step(normalized, mask, spatial,
+                                           permutation, signs)
+            np.testing.assert_allclose(normalize(rotated), normalized,
+                                       rtol=1e-5, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import tempfile
+import unittest
+import numpy as np
+import tensorflow as tf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from tensorflow.keras import layers, models, optimizers
+from training import TrainingCheckpoint
+
+
+def get_model():
+    inputs = layers.Input(shape=[4])
+    return models.Model(inputs, layers.Dense(1)(inputs))
+
+
+# run : python -m unittest checkpoints_test.py
+class TestCheckpoints(unittest.TestCase):
+    """Unittests the saving and resuming of a training."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        inputs = rng.normal(size=[32, 4]).astype(np.float32)
+        self.dataset = tf.data.Dataset.from_tensor_slices(
+            (inputs, inputs.sum(axis=1, keepdims=True))).batch(8)
+
+    def fit(self, path, epochs):
+        model = get_model()
+        optimizer = optimizers.Adam(0.01)
+        model.compile(optimizer=optimizer, loss='mse')
+        checkpoint = TrainingCheckpoint(path, model, optimizer,
+                                        max_to_keep=2, save_every=2)
+        initial_epoch = checkpoint.restore()
+        model.fit(self.dataset, epochs=epochs, initial_epoch=initial_epoch,
+                  callbacks=[checkpoint.callback()], verbose=0)
+        return model, optimizer, initial_epoch
+
+    def test_resume(self):
+        """Asserts that a training resumes where its checkpoint left off."""
+        with tempfile.TemporaryDirectory() as path:
+            model, optimizer, initial_epoch = self.fit(path, 4)
+            self.assertEqual(initial_epoch, 0)
+            self.assertEqual(int(optimizer.iterations), 16)
+            self.assertEqual(sorted(os.path.basename(checkpoint) for
+                                    checkpoint in tf.train.get_checkpoint_state(
+                                        path).all_model_checkpoint_paths),
+                             ['ckpt-2', 'ckpt-4'])
+            resumed, resumed_optimizer, initial_epoch = self.fit(path, 6)
+            self.assertEqual(initial_epoch, 4)
+            # Only the 2 remaining epochs of 4 steps are trained
+            self.assertEqual(int(resumed_optimizer.iterations), 24)
+            continued, continued_optimizer, _ = self.fit(path, 6)
+            self.assertEqual(int(continued_optimizer.iterations), 24)
+            for weights, expected in zip(continued.get_weights(),
+                                         resumed.get_weights()):
+                np.testing.assert_allclose(weights, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import tempfile
+import time
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from training import (split_tfrecords, dataset_fingerprint,
+                      evict_stale_caches)
+
+
+# run : python -m unittest dataset_cache_test.py
+class TestDatasetCache(unittest.TestCase):
+    """Unittests the reuse and eviction of the dataset caches."""
+
+    def test_split_fingerprint(self):
+        """Asserts that a seeded split keeps the cache fingerprint."""
+        with tempfile.TemporaryDirectory() as path:
+            files = []
+            for i in range(30):
+                files.append(os.path.join(path, '%02d.tfrecord.gz' % i))
+                open(files[-1], 'w').close()
+            train_files, eval_files = split_tfrecords(files, seed=3)
+            self.assertEqual(len(eval_files), 10)
+            self.assertEqual(sorted(train_files + eval_files), files)
+            self.assertEqual(split_tfrecords(files[::-1], seed=3),
+                             (train_files, eval_files))
+            self.assertNotEqual(split_tfrecords(files, seed=4)[1],
+                                eval_files)
+            fingerprint = dataset_fingerprint(train_files, {}, [['a']], ['b'])
+            self.assertEqual(dataset_fingerprint(
+                split_tfrecords(files, seed=3)[0], {}, [['a']], ['b']),
+                fingerprint)
+
+    def test_evict_stale_caches(self):
+        """Asserts that only the old caches are removed."""
+        with tempfile.TemporaryDirectory() as path:
+            for name in ['old', 'kept', 'recent']:
+                os.makedirs(os.path.join(path, name))
+            old = time.time() - 10 * 24 * 3600
+            for name in ['old', 'kept']:
+                os.utime(os.path.join(path, name), (old, old))
+            removed = evict_stale_caches(path, keep=['kept'], max_age_days=7)
+            self.assertEqual(removed, [os.path.join(path, 'old')])
+            self.assertEqual(sorted(os.listdir(path)), ['kept', 'recent'])
+
+
+if __name__ == '__main__':
+    unittest.main()
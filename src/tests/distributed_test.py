@@ -0,0 +1,71 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import unittest
+from unittest import mock
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from training import worker_config, worker_files, worker_path
+from training.distributed import local_cluster
+
+
+# run : python -m unittest distributed_test.py
+class TestDistributed(unittest.TestCase):
+    """Unittests the sharding of the data parallel workers."""
+
+    def test_worker_config(self):
+        """Asserts the workers read from TF_CONFIG."""
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(worker_config(), (1, 0))
+        for index, config in enumerate(local_cluster(3)):
+            with mock.patch.dict(os.environ, {'TF_CONFIG': config}):
+                self.assertEqual(worker_config(), (3, index))
+
+    def test_worker_files(self):
+        """Asserts that the workers share the files without overlap."""
+        files = ['file_%i' % i for i in range(7)]
+        shards = [worker_files(files, 3, i) for i in range(3)]
+        self.assertEqual(sorted(sum(shards, [])), files)
+        self.assertEqual([len(shard) for shard in shards], [3, 2, 2])
+        self.assertEqual(worker_files(files, 1, 0), files)
+
+    def test_balanced_files(self):
+        """Asserts that a manifest balances the records of the workers."""
+        records = {'a': 100, 'b': 60, 'c': 50, 'd': 10, 'e': 5}
+        manifest = {'shards': [
+            {'file': os.path.abspath(file), 'records': count, 'status': 'ok'}
+            for file, count in records.items()] + [
+            {'file': os.path.abspath('f'), 'records': 0, 'status': 'empty'}]}
+        shards = [worker_files(list(records) + ['f'], 2, i, manifest)
+                  for i in range(2)]
+        counts = [sum(records[os.path.basename(file)] for file in shard)
+                  for shard in shards]
+        self.assertEqual(sorted(counts), [110, 115])
+        # Files of the manifest which are not training files are skipped
+        shards = [worker_files(['a', 'b'], 2, i, manifest) for i in range(2)]
+        self.assertEqual(sorted(map(len, shards)), [1, 1])
+
+    def test_worker_path(self):
+        """Asserts that only the chief writes to the checkpoint path."""
+        self.assertEqual(worker_path('ckp', 0), 'ckp')
+        self.assertEqual(worker_path('ckp', 2),
+                         os.path.join('ckp', 'workers', 'worker_2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import tempfile
+import unittest
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from tensorflow.keras import layers, models
+from training import (DATE_BANDS, SlicedErrors, compare_reports,
+                      evaluate_model, eval_records, get_features_dict,
+                      build_record_index, PATCH_BANDS)
+from training.benchmark import write_synthetic_tfrecords
+from training.evaluation import slice_labels
+
+
+def get_dates(hours, months, latitudes):
+    """Returns the Bx6 date values of records."""
+    dates = np.zeros([len(hours), len(DATE_BANDS)])
+    dates[:, DATE_BANDS.index('HOD')] = hours
+    dates[:, DATE_BANDS.index('MOY')] = months
+    dates[:, DATE_BANDS.index('latitude')] = latitudes
+    return dates
+
+
+# run : python -m unittest evaluation_test.py
+class TestEvaluation(unittest.TestCase):
+    """Unittests the streaming sliced errors."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.errors = rng.normal(size=100)
+        self.dates = get_dates(rng.integers(0, 24, 100),
+                               rng.integers(1, 13, 100),
+                               rng.uniform(-20, 60, 100))
+        self.road = rng.uniform(0, 10, 100)
+
+    def test_merged_batches(self):
+        """Asserts that batches merged in any order give the full errors."""
+        full = SlicedErrors().update(
+            self.errors, slice_labels(self.dates, self.road, 10.0, [2, 5]))
+        merged = SlicedErrors()
+        for batch in [slice(50, 100), slice(0, 20), slice(20, 50)]:
+            merged.merge(SlicedErrors().update(
+                self.errors[batch], slice_labels(self.dates[batch],
+                                                 self.road[batch], 10.0,
+                                                 [2, 5])))
+        full, merged = full.report(), merged.report()
+        self.assertEqual(full['overall']['count'], 100)
+        self.assertAlmostEqual(full['overall']['rmse'],
+                               np.sqrt(np.mean(self.errors ** 2)))
+        self.assertAlmostEqual(full['overall']['bias'], self.errors.mean())
+        for name in ['hour', 'month', 'latitude', 'road_density']:
+            self.assertEqual(sorted(full['slices'][name]),
+                             sorted(merged['slices'][name]))
+            for label, summary in full['slices'][name].items():
+                for metric, value in summary.items():
+                    self.assertAlmostEqual(
+                        merged['slices'][name][label][metric], value)
+        self.assertEqual(sum(summary['count'] for summary
+                             in full['slices']['road_density'].values()), 100)
+        low = self.errors[self.road < 2]
+        self.assertAlmostEqual(
+            full['slices']['road_density']['[-inf, 2)']['mae'],
+            np.abs(low).mean())
+
+    def test_compare_reports(self):
+        """Asserts the rows of compared reports."""
+        first = SlicedErrors().update([1.0, 3.0], slice_labels(
+            get_dates([1, 2], [6, 6], [40, 40]), np.zeros(2))).report()
+        second = SlicedErrors().update([2.0], slice_labels(
+            get_dates([1], [6], [40]), np.zeros(1))).report()
+        rows = compare_reports({'a': first, 'b': second}, 'mae')
+        self.assertEqual(rows[0], ['slice', 'bin', 'a', 'b'])
+        self.assertIn(['overall', '', 2.0, 2.0], rows)
+        self.assertIn(['hour', '02', 3.0, None], rows)
+
+    def test_indexed_records(self):
+        """Asserts that records read through an index evaluate like files."""
+        features_dict = get_features_dict(2)
+        inputs = layers.Input(shape=[5, 5, len(PATCH_BANDS)])
+        model = models.Model(inputs, layers.Conv2D(1, (5, 5))(inputs))
+        with tempfile.TemporaryDirectory() as path:
+            files = write_synthetic_tfrecords(
+                os.path.join(path, 'records'), features_dict, num_files=3,
+                records_per_file=4)
+            index = build_record_index(files, os.path.join(path, 'index'))
+            record_ids = np.flatnonzero(eval_records(
+                index, eval_files=files[1:2]))
+            self.assertEqual(len(record_ids), 4)
+            expected, _ = evaluate_model(model, files[1:2], features_dict,
+                                         PATCH_BANDS, batch_size=3)
+            indexed, _ = evaluate_model(model, files, features_dict,
+                                        PATCH_BANDS, batch_size=3,
+                                        index=index, record_ids=record_ids)
+        expected, indexed = expected.report(), indexed.report()
+        self.assertEqual(indexed['overall']['count'], 4)
+        for metric, value in expected['overall'].items():
+            self.assertAlmostEqual(indexed['overall'][metric], value,
+                                   places=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
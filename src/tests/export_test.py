@@ -0,0 +1,62 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import unittest
+import numpy as np
+import tensorflow as tf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from tensorflow.keras import layers
+from training import (build_model, convert_tflite, representative_dataset,
+                      TFLiteModel, prediction_drift)
+
+
+# run : python -m unittest export_test.py
+class TestExport(unittest.TestCase):
+    """Unittests the quantized TFLite export."""
+
+    def setUp(self):
+        self.model = build_model('EFFICIENT_TINY',
+                                 layers.Input(shape=[None, None, 3]))
+        rng = np.random.default_rng(0)
+        self.inputs = rng.normal(size=[16, 33, 33, 3]).astype(np.float32)
+        self.dataset = tf.data.Dataset.from_tensor_slices(
+            (self.inputs, np.ones([16, 1, 1, 1], np.float32))).batch(4)
+
+    def test_modes(self):
+        """Asserts that converted models predict like the float model."""
+        expected = self.model.predict_on_batch(self.inputs)
+        for mode in ['none', 'dynamic', 'int8']:
+            content = convert_tflite(
+                self.model, 33, mode,
+                representative_dataset(self.dataset, 8))
+            tflite_model = TFLiteModel(content)
+            for batch_size in [1, 16]:
+                predictions = tflite_model.predict_on_batch(
+                    self.inputs[:batch_size])
+                self.assertEqual(predictions.shape, (batch_size, 1, 1, 1))
+                np.testing.assert_allclose(predictions,
+                                           expected[:batch_size], atol=0.1)
+            drift = prediction_drift(self.model, tflite_model, self.dataset,
+                                     num_batches=2)
+            self.assertEqual(drift['records'], 8)
+            self.assertLess(drift['max_abs_drift'], 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import unittest
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from tensorflow.keras import layers
+from tensorflow.keras import models
+from training import RasterPredictor, build_model
+
+PATCH_SIZE = 10
+
+
+def get_model(global_pooling):
+    """Returns a small model giving a 1x1 output for 10x10 patches."""
+    inputs = layers.Input(shape=[None, None, 2])
+    conv = layers.Conv2D(4, (3, 3), activation='tanh')(inputs)  # 8x8x4
+    pooled = layers.MaxPooling2D((2, 2))(conv)  # 4x4x4
+    if global_pooling:
+        pooled = layers.GlobalAveragePooling2D()(pooled)
+        pooled = layers.Reshape((1, 1, 4))(pooled)
+    else:
+        pooled = layers.Conv2D(4, (4, 4), activation='tanh')(pooled)
+    output = layers.Conv2D(1, (1, 1))(pooled)
+    return models.Model(inputs=[inputs], outputs=[output])
+
+
+def predict_patches(model, raster, stride, patch_size=PATCH_SIZE):
+    """Predicts the patches of a raster one by one."""
+    rows = range(0, raster.shape[0] - patch_size + 1, stride)
+    cols = range(0, raster.shape[1] - patch_size + 1, stride)
+    patches = np.stack([raster[row:row + patch_size, col:col + patch_size]
+                        for row in rows for col in cols])
+    return np.reshape(model.predict_on_batch(patches), [len(rows), len(cols)])
+
+
+# run : python -m unittest inference_test.py
+class TestRasterPredictor(unittest.TestCase):
+    """Unittests the fully convolutional predictions of rasters."""
+
+    def setUp(self):
+        self.raster = np.random.default_rng(0).normal(
+            size=[37, 29, 2]).astype(np.float32)
+
+    def test_dense_predictions(self):
+        """Asserts that dense predictions match the ones of the patches."""
+        for global_pooling in [False, True]:
+            model = get_model(global_pooling)
+            predictor = RasterPredictor(model, PATCH_SIZE, stride=1)
+            self.assertTrue(predictor.dense)
+            self.assertEqual(predictor.output_stride, 2)
+            predictions = predictor.predict_window(self.raster)
+            self.assertEqual(predictions.shape, (28, 20))
+            np.testing.assert_allclose(
+                predictions, predict_patches(model, self.raster, 1),
+                rtol=1e-4, atol=1e-5)
+
+    def test_zero_padded_models(self):
+        """Asserts the dense and exact predictions of the repo models."""
+        patch_size = 33
+        raster = np.random.default_rng(1).normal(
+            size=[45, 41, 3]).astype(np.float32)
+        for model_type, global_pooling in [('CNN', True),
+                                           ('EFFICIENT_TINY', False)]:
+            model = build_model(model_type,
+                                layers.Input(shape=[None, None, 3]),
+                                global_pooling=global_pooling)
+            # Scaled weights give predictions that vary with the patches
+            rng = np.random.default_rng(2)
+            model.set_weights([weights * rng.uniform(0.5, 2.0, weights.shape)
+                               for weights in model.get_weights()])
+            predictor = RasterPredictor(model, patch_size)
+            self.assertTrue(predictor.dense)
+            window = np.random.default_rng(3).normal(
+                size=[patch_size + predictor.output_stride] * 2 + [3]).astype(
+                    np.float32)
+            calls = []
+            predict_batch = predictor.predict_batch
+            predictor.predict_batch = lambda batch: calls.append(
+                batch.shape) or predict_batch(batch)
+            predictions = predictor.predict_window(window)
+            # A single pass predicts the 2x2 patches of the window
+            self.assertEqual(predictions.shape, (2, 2))
+            self.assertEqual(len(calls), 1)
+            self.assertTrue(np.isfinite(predictions).all())
+            # A window of a single patch has the zero padding of the patch
+            patch = window[:patch_size, :patch_size]
+            np.testing.assert_allclose(
+                predictor.predict_window(patch),
+                np.reshape(model.predict_on_batch(patch[np.newaxis]), [1, 1]),
+                rtol=1e-4)
+            exact = RasterPredictor(model, patch_size, stride=3,
+                                    batch_size=5, exact=True)
+            self.assertFalse(exact.dense)
+            predictions = exact.predict_window(raster)
+            self.assertEqual(predictions.shape, (5, 3))
+            np.testing.assert_allclose(
+                predictions, predict_patches(model, raster, 3, patch_size),
+                rtol=1e-4, atol=1e-5)
+
+    def test_tiles(self):
+        """Asserts that tiles with their halo give the predictions."""
+        model = get_model(False)
+        predictor = RasterPredictor(model, PATCH_SIZE)
+        predictions = np.zeros(predictor.output_shape(*self.raster.shape[:2]))
+        for tile in predictor.tiles(*self.raster.shape[:2], tile_size=3):
+            top, bottom, left, right = predictor.window_bounds(tile)
+            first_row, last_row, first_col, last_col = tile
+            predictions[first_row:last_row, first_col:last_col] = \
+                predictor.predict_window(self.raster[top:bottom, left:right])
+        np.testing.assert_allclose(
+            predictions, predict_patches(model, self.raster, 2),
+            rtol=1e-4, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import tempfile
+import threading
+import unittest
+import numpy as np
+import tensorflow as tf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from training import (ShardWatcher, IncrementalNormalization,
+                      load_incremental_tfrecords, load_band_stats)
+
+FEATURES = {'latitude': tf.io.FixedLenFeature([1, 1], tf.float32),
+            'patch_B': tf.io.FixedLenFeature([3, 3], tf.float32)}
+
+
+def write_records(file, num_records):
+    """Writes a GZIP TFRecord file with a latitude and a patch per record."""
+    with tf.io.TFRecordWriter(file, options='GZIP') as writer:
+        for i in range(num_records):
+            feature = {
+                'latitude': tf.train.Feature(
+                    float_list=tf.train.FloatList(value=[float(i)])),
+                'patch_B': tf.train.Feature(
+                    float_list=tf.train.FloatList(value=np.arange(9.0)))}
+            example = tf.train.Example(
+                features=tf.train.Features(feature=feature))
+            writer.write(example.SerializeToString())
+
+
+# run : python -m unittest ingestion_test.py
+class TestShardWatcher(unittest.TestCase):
+    """Unittests the incremental admission of exported shards."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'samples')
+        os.makedirs(self.path)
+        self.watcher = ShardWatcher(
+            self.path, FEATURES, settle_seconds=0, processes=2, seed=0,
+            stats_path=os.path.join(self.folder.name, 'stats'))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write_shard(self, name, num_records=4):
+        file = os.path.join(self.path, name + '.tfrecord.gz')
+        write_records(file, num_records)
+        return file
+
+    def test_poll(self):
+        """Asserts that valid shards are admitted and summarized."""
+        self.assertEqual(self.watcher.poll(), [])
+        first = self.write_shard('export_0')
+        self.assertEqual(self.watcher.poll(), [first])
+        second = self.write_shard('export_1')
+        with open(os.path.join(self.path, 'export_2.tfrecord.gz'),
+                  'wb') as corrupt:
+            corrupt.write(open(first, 'rb').read()[:40])
+        self.assertEqual(self.watcher.poll(), [second])
+        self.assertEqual(self.watcher.poll(), [])
+        stats = load_band_stats(os.path.join(self.folder.name, 'stats'))
+        self.assertEqual(stats['patch_B']['count'], 72)
+
+    def test_fresh_weight(self):
+        """Asserts the fraction of fresh shards of an epoch."""
+        for i in range(6):
+            self.write_shard('export_%i' % i, 1)
+        self.watcher.poll()
+        # Every shard is fresh during the first epoch
+        self.assertEqual(len(self.watcher.epoch_files(fresh_weight=0.5)), 6)
+        new = self.write_shard('export_new', 1)
+        self.watcher.poll()
+        files = self.watcher.epoch_files(fresh_weight=0.5)
+        self.assertEqual(len(files), 12)
+        self.assertEqual(files.count(new), 6)
+        self.assertEqual(len(self.watcher.epoch_files()), 7)
+
+    def test_eval_shards(self):
+        """Asserts that at most half of the admitted shards are held out."""
+        watcher = ShardWatcher(self.path, settle_seconds=0, num_eval=2)
+        files = []
+        for i in range(6):
+            files.append(self.write_shard('export_%i' % i, 1))
+            watcher.poll()
+        self.assertEqual(watcher.eval_files(), [files[1], files[3]])
+        self.assertEqual(sorted(watcher.epoch_files()),
+                         [files[0], files[2], files[4], files[5]])
+
+    def test_background_poll(self):
+        """Asserts that the stats followed by the loader are updated."""
+        normalization = IncrementalNormalization(self.watcher,
+                                                 [['patch_B']], ['latitude'])
+        np.testing.assert_array_equal(normalization.variables[0][0], [0])
+        # The dataset is built before the first shard is admitted
+        dataset = load_incremental_tfrecords(
+            self.watcher, FEATURES, [['patch_B']], ['latitude'], 4,
+            poll_seconds=0.1, band_stats=normalization)
+        updated = threading.Event()
+        self.write_shard('export_0')
+        self.watcher.start(poll_seconds=0.1, callbacks=[
+            normalization.update, updated.set])
+        # The shard is read once the normalization follows its stats
+        patches, latitudes = next(iter(dataset))
+        self.assertTrue(updated.is_set())
+        self.watcher.stop()
+        stats = self.watcher.band_stats()
+        np.testing.assert_allclose(
+            patches[..., 0], (np.arange(9.0).reshape(3, 3) -
+                              stats['patch_B']['mean']) /
+            stats['patch_B']['std'] * np.ones([4, 1, 1]), rtol=1e-5)
+        # Outputs are only scaled, epochs of the shard are interleaved
+        latitudes = latitudes[:, 0, 0, 0] * stats['latitude']['std']
+        np.testing.assert_allclose(latitudes, np.round(latitudes), atol=1e-5)
+        self.assertTrue(set(np.round(latitudes)) <= {0, 1, 2, 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import tempfile
+import unittest
+import numpy as np
+import tensorflow as tf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from training import (load_tiled_tfrecords, load_tfrecords, project_features,
+                      vector_transforms, dihedral_step, wind_pairs)
+
+
+def float_feature(values):
+    return tf.train.Feature(float_list=tf.train.FloatList(
+        value=np.ravel(values)))
+
+
+def write_records(file, features):
+    with tf.io.TFRecordWriter(file, 'GZIP') as writer:
+        for feature in features:
+            writer.write(tf.train.Example(features=tf.train.Features(
+                feature={key: float_feature(value) for key, value in
+                         feature.items()})).SerializeToString())
+
+
+# run : python -m unittest load_data_test.py
+class TestLoadData(unittest.TestCase):
+    """Unittests the loading of the exported samples."""
+
+    def test_project_features(self):
+        """Asserts that bands missing from the records are not parsed."""
+        features_dict = {'patch_x': tf.io.FixedLenFeature([3, 3], tf.float32),
+                         'unused': tf.io.FixedLenFeature([3, 3], tf.float32),
+                         'no2': tf.io.FixedLenFeature([1, 1], tf.float32)}
+        projected = project_features(features_dict, [['patch_x']], ['no2'])
+        self.assertEqual(sorted(projected), ['no2', 'patch_x'])
+        with tempfile.TemporaryDirectory() as path:
+            file = os.path.join(path, 'a.tfrecord.gz')
+            write_records(file, [{'patch_x': np.arange(9), 'no2': 1}])
+            patch, no2 = next(load_tfrecords(
+                [file], features_dict, [['patch_x']],
+                ['no2']).as_numpy_iterator())
+        np.testing.assert_array_equal(patch[..., 0],
+                                      np.arange(9).reshape(3, 3))
+        self.assertEqual(no2.shape, (1, 1, 1))
+
+    def test_vector_transforms(self):
+        """Asserts that winds follow each of the 8 dihedral transforms.
+
+        The wind of each sample is the (east, north) gradient of a linear
+        scalar band, so after any transform of the patch the transformed
+        wind must still be the gradient of the transformed band.
+        """
+        bands = ['patch_B', 'patch_0_u_component_of_wind_10m',
+                 'patch_0_v_component_of_wind_10m']
+        steps = vector_transforms(len(bands), wind_pairs(bands))
+        spatials = [lambda x: tf.transpose(x, [0, 2, 1, 3]),
+                    lambda x: tf.reverse(x, [1]),
+                    lambda x: tf.reverse(x, [2])]
+        gradients = np.random.default_rng(0).normal(size=[4, 2])
+        # Rows go from north to south and columns from west to east
+        rows, cols = np.meshgrid(np.arange(5), np.arange(5), indexing='ij')
+        patches = np.stack([np.stack([east * cols - north * rows,
+                                      np.full([5, 5], east),
+                                      np.full([5, 5], north)], axis=-1)
+                            for east, north in gradients])
+        patches = tf.constant(patches, tf.float32)
+        results = set()
+        for element in range(8):
+            transformed = patches
+            for i, (spatial, (permutation, signs)) in enumerate(
+                    zip(spatials, steps)):
+                mask = tf.fill([4], bool(element >> i & 1))
+                transformed = dihedral_step(transformed, mask, spatial,
+                                            permutation, signs)
+            transformed = transformed.numpy()
+            scalar = transformed[..., 0]
+            np.testing.assert_allclose(
+                transformed[:, :, :-1, 1], np.diff(scalar, axis=2),
+                atol=1e-5)
+            np.testing.assert_allclose(
+                transformed[:, :-1, :, 2], -np.diff(scalar, axis=1),
+                atol=1e-5)
+            results.add(transformed.tobytes())
+        self.assertEqual(len(results), 8)
+
+    def test_tiled_patches(self):
+        """Asserts that edge patches are zero padded crops of the tile."""
+        radius = 2
+        rng = np.random.default_rng(0)
+        tile = rng.normal(size=[2, 7, 9]).astype(np.float32)
+        locations = [(3, 4), (0, 0), (6, 8), (1, 7)]
+        with tempfile.TemporaryDirectory() as path:
+            for folder in ['tiles', 'offsets']:
+                os.makedirs(os.path.join(path, folder))
+            write_records(os.path.join(path, 'tiles', 'a.tfrecord.gz'),
+                          [{'patch_x': tile[0], 'patch_y': tile[1]}])
+            write_records(os.path.join(path, 'offsets', 'a_0.tfrecord.gz'),
+                          [{'tile_row': row, 'tile_col': col,
+                            'tile_height': 7, 'tile_width': 9,
+                            'no2': 10 * row + col}
+                           for row, col in locations])
+            features_dict = {band: tf.io.FixedLenFeature(
+                [2 * radius + 1, 2 * radius + 1], tf.float32)
+                for band in ['patch_x', 'patch_y']}
+            features_dict['no2'] = tf.io.FixedLenFeature([1, 1], tf.float32)
+            dataset = load_tiled_tfrecords(
+                os.path.join(path, 'tiles'), os.path.join(path, 'offsets'),
+                features_dict, [['patch_x', 'patch_y']], ['no2'], radius)
+            elements = list(dataset.as_numpy_iterator())
+        self.assertEqual(len(elements), len(locations))
+        padded = np.pad(tile.transpose(1, 2, 0),
+                        [[radius, radius], [radius, radius], [0, 0]])
+        for patch, no2 in elements:
+            row, col = divmod(int(no2[0, 0, 0]), 10)
+            self.assertEqual(patch.shape, (5, 5, 2))
+            np.testing.assert_array_equal(
+                patch, padded[row:row + 2 * radius + 1,
+                              col:col + 2 * radius + 1])
+
+    def test_split_tiles(self):
+        """Asserts that a tile split in several files raises ValueError."""
+        features_dict = {'patch_x': tf.io.FixedLenFeature([3, 3], tf.float32),
+                         'no2': tf.io.FixedLenFeature([1, 1], tf.float32)}
+        with tempfile.TemporaryDirectory() as path:
+            for folder in ['tiles', 'offsets']:
+                os.makedirs(os.path.join(path, folder))
+            for part in ['a-00000', 'a-00001']:
+                write_records(os.path.join(path, 'tiles',
+                                           part + '.tfrecord.gz'),
+                              [{'patch_x': np.zeros([2, 2])}])
+            write_records(os.path.join(path, 'offsets', 'a_0.tfrecord.gz'),
+                          [{'tile_row': 0, 'tile_col': 0, 'tile_height': 2,
+                            'tile_width': 2, 'no2': 1}])
+            with self.assertRaises(ValueError):
+                load_tiled_tfrecords(
+                    os.path.join(path, 'tiles'), os.path.join(path, 'offsets'),
+                    features_dict, [['patch_x']], ['no2'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
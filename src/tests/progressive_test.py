@@ -0,0 +1,71 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import unittest
+import numpy as np
+import tensorflow as tf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from tensorflow.keras import layers
+from training import build_model, parse_crop_schedule, ProgressiveCrop
+
+
+# run : python -m unittest progressive_test.py
+class TestProgressive(unittest.TestCase):
+    """Unittests the progressive center crops of the training patches."""
+
+    def test_parse_crop_schedule(self):
+        """Asserts that the schedule is sorted and starts at epoch 0."""
+        self.assertEqual(parse_crop_schedule("20:129,0:65,50:257"),
+                         [(0, 65), (20, 129), (50, 257)])
+        with self.assertRaises(AssertionError):
+            parse_crop_schedule("5:65")
+
+    def test_crop_callback(self):
+        """Asserts the crop size of the batches of each epoch."""
+        crop = ProgressiveCrop(parse_crop_schedule("0:3,2:5,3:9"))
+        patches = np.arange(2 * 7 * 7).reshape([2, 7, 7, 1])
+        dataset = tf.data.Dataset.from_tensors(
+            (patches, np.ones([2, 1, 1, 1]))).map(crop.crop)
+        callback = crop.callback()
+        sizes = []
+        for epoch in range(4):
+            callback.on_epoch_begin(epoch)
+            cropped, _ = next(iter(dataset))
+            sizes.append(cropped.shape[1])
+            center = cropped.shape[1] // 2
+            np.testing.assert_array_equal(cropped[:, center, center],
+                                          patches[:, 3, 3])
+            logs = {}
+            callback.on_epoch_end(epoch, logs)
+            self.assertEqual(logs['crop_size'], [3, 3, 5, 9][epoch])
+        # Crops larger than the patches keep the whole patches
+        self.assertEqual(sizes, [3, 3, 5, 7])
+
+    def test_global_pooling_shapes(self):
+        """Asserts that the pooled CNN outputs 1x1x1 at every crop size."""
+        model = build_model('CNN', layers.Input(shape=[None, None, 4]),
+                            global_pooling=True)
+        for size in [33, 65, 129]:
+            predictions = model.predict_on_batch(
+                np.zeros([2, size, size, 4], np.float32))
+            self.assertEqual(predictions.shape, (2, 1, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import tempfile
+import unittest
+import numpy as np
+import tensorflow as tf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from training import (compute_quantization, quantize_tfrecords,
+                      load_quantization, load_tfrecords,
+                      load_batched_tfrecords)
+
+
+# run : python -m unittest quantization_test.py
+class TestQuantization(unittest.TestCase):
+    """Unittests the round trip of the quantized TFRecords."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.features_dict = {
+            'patch_a': tf.io.FixedLenFeature([5, 5], tf.float32),
+            'patch_b': tf.io.FixedLenFeature([5, 5], tf.float32),
+            'no2': tf.io.FixedLenFeature([1, 1], tf.float32)}
+        self.input_bands = [['patch_a', 'patch_b']]
+        self.output_bands = ['no2']
+        rng = np.random.default_rng(0)
+        self.file = os.path.join(self.path, 'samples.tfrecord.gz')
+        with tf.io.TFRecordWriter(self.file, 'GZIP') as writer:
+            for _ in range(20):
+                values = {'patch_a': rng.normal(3, 2, 25),
+                          'patch_b': rng.uniform(-1e4, 1e3, 25),
+                          'no2': rng.normal(size=1)}
+                writer.write(tf.train.Example(features=tf.train.Features(
+                    feature={band: tf.train.Feature(
+                        float_list=tf.train.FloatList(value=value))
+                        for band, value in values.items()}))
+                    .SerializeToString())
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def load(self, files, quantization=None):
+        dataset = load_tfrecords(files, self.features_dict, self.input_bands,
+                                 self.output_bands, quantization=quantization)
+        return [np.stack(arrays) for arrays in
+                zip(*dataset.as_numpy_iterator())]
+
+    def test_round_trip(self):
+        """Asserts the decoding error bound of each encoding."""
+        inputs, outputs = self.load([self.file])
+        for encoding in ['int16', 'float16']:
+            output_path = os.path.join(self.path, encoding)
+            spec = compute_quantization([self.file], self.features_dict,
+                                        encoding)
+            self.assertEqual(sorted(spec), ['patch_a', 'patch_b'])
+            quantize_tfrecords([self.file], output_path, self.features_dict,
+                               spec)
+            self.assertEqual(load_quantization(output_path), spec)
+            decoded_inputs, decoded_outputs = self.load(
+                [os.path.join(output_path, 'samples.tfrecord.gz')], spec)
+            # Scalar bands are kept as float32
+            np.testing.assert_array_equal(decoded_outputs, outputs)
+            errors = np.abs(decoded_inputs - inputs)
+            for i, band in enumerate(self.input_bands[0]):
+                if encoding == 'int16':
+                    # Half a quantization step, with float32 rounding
+                    bound = spec[band]['scale'] / 2 + \
+                        1e-6 * np.abs(inputs[..., i])
+                else:
+                    # Half an ulp of float16, 11 significant bits
+                    bound = np.abs(inputs[..., i]) * 2.0 ** -11
+                self.assertTrue(np.all(errors[..., i] <= bound), band)
+
+    def test_batched_decoding(self):
+        """Asserts that batched parsing decodes like load_tfrecords."""
+        spec = compute_quantization([self.file], self.features_dict)
+        output_path = os.path.join(self.path, 'int16')
+        quantize_tfrecords([self.file], output_path, self.features_dict, spec)
+        files = [os.path.join(output_path, 'samples.tfrecord.gz')]
+        expected = self.load(files, spec)
+        batches = list(load_batched_tfrecords(
+            files, self.features_dict, self.input_bands, self.output_bands,
+            batch_size=6, quantization=spec).as_numpy_iterator())
+        self.assertEqual([len(batch[0]) for batch in batches], [6, 6, 6, 2])
+        for i, arrays in enumerate(zip(*batches)):
+            np.testing.assert_array_equal(np.concatenate(arrays), expected[i])
+
+
+if __name__ == '__main__':
+    unittest.main()
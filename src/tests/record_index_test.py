@@ -0,0 +1,146 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import gzip
+import struct
+import tempfile
+import unittest
+import numpy as np
+import tensorflow as tf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from training import (build_record_index, load_record_index, spatial_folds,
+                      RecordIndex)
+
+
+def write_records(file, latitudes):
+    """Writes a GZIP TFRecord file with a latitude and a patch per record."""
+    with tf.io.TFRecordWriter(file, options='GZIP') as writer:
+        for latitude in latitudes:
+            feature = {
+                'latitude': tf.train.Feature(
+                    float_list=tf.train.FloatList(value=[latitude])),
+                'patch_B': tf.train.Feature(
+                    float_list=tf.train.FloatList(value=[latitude] * 9))}
+            example = tf.train.Example(
+                features=tf.train.Features(feature=feature))
+            writer.write(example.SerializeToString())
+
+
+# run : python -m unittest record_index_test.py
+class TestRecordIndex(unittest.TestCase):
+    """Unittests the RecordIndex on small GZIP TFRecord files."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.files = []
+        for i in range(3):
+            file = os.path.join(self.folder.name, 'export_%i.tfrecord.gz' % i)
+            write_records(file, [10.0 * i + j for j in range(5)])
+            self.files.append(file)
+        self.index = build_record_index(
+            self.files, os.path.join(self.folder.name, 'index'), processes=2)
+
+    def tearDown(self):
+        self.index.close()
+        self.folder.cleanup()
+
+    def test_random_access(self):
+        """Asserts that every record is read back at its offset."""
+        self.assertEqual(len(self.index), 15)
+        features = {'latitude': tf.io.FixedLenFeature([1], tf.float32)}
+        for record_id in np.random.permutation(len(self.index)):
+            parsed = tf.io.parse_single_example(self.index.read(record_id),
+                                                features)
+            self.assertEqual(float(parsed['latitude'][0]),
+                             self.index.keys['latitude'][record_id])
+
+    def test_offsets(self):
+        """Asserts the offsets of uncompressed copies against the files."""
+        uncompressed = build_record_index(
+            self.files, os.path.join(self.folder.name, 'uncompressed'),
+            processes=1, compress=False)
+        self.assertFalse(uncompressed.compressed)
+        record_id = 0
+        for file in self.files:
+            content = gzip.open(file, 'rb').read()
+            for record in tf.data.TFRecordDataset(file,
+                                                  compression_type='GZIP'):
+                record = record.numpy()
+                offset = int(uncompressed.offsets[record_id])
+                length = int(uncompressed.lengths[record_id])
+                # Length header of the TFRecord framing before the data
+                self.assertEqual(
+                    struct.unpack('<Q', content[offset - 12:offset - 4])[0],
+                    len(record))
+                self.assertEqual(content[offset:offset + length], record)
+                self.assertEqual(uncompressed.read(record_id), record)
+                self.assertEqual(self.index.read(record_id), record)
+                record_id += 1
+        self.assertEqual(record_id, len(self.index))
+        uncompressed.close()
+
+    def test_keys(self):
+        """Asserts the keys and export ids stored in the index."""
+        self.assertEqual(self.index.export_ids, ['export'])
+        np.testing.assert_array_equal(self.index.keys['export_id'], 0)
+        self.assertTrue(np.isnan(self.index.keys['HOD']).all())
+        reloaded = RecordIndex(self.index.index_path)
+        np.testing.assert_array_equal(reloaded.offsets, self.index.offsets)
+
+    def test_stale_index(self):
+        """Asserts that rewritten or removed files rebuild the index."""
+        index_path = self.index.index_path
+        with load_record_index(self.files, index_path) as index:
+            np.testing.assert_array_equal(index.offsets, self.index.offsets)
+            self.assertEqual(len(index), 15)
+        write_records(self.files[1], [1.0, 2.0])
+        with load_record_index(self.files, index_path) as index:
+            self.assertEqual(len(index), 12)
+            self.assertEqual(float(index.keys['latitude'][5]), 1.0)
+        removed = index.files[2]
+        with load_record_index(self.files[:2], index_path) as index:
+            self.assertEqual(len(index), 7)
+        self.assertFalse(os.path.exists(removed))
+
+    def test_close(self):
+        """Asserts that close releases the files and reads reopen them."""
+        record = self.index.read(0)
+        self.assertEqual(len(self.index.descriptors), 1)
+        self.index.close()
+        self.assertEqual(self.index.descriptors, {})
+        self.assertEqual(self.index.read(0), record)
+
+    def test_select_and_shard(self):
+        """Asserts predicate selection and balanced shards."""
+        selected = self.index.select(lambda keys: keys['latitude'] >= 10)
+        self.assertEqual(len(selected), 10)
+        shards = [RecordIndex.shard(selected, 3, i) for i in range(3)]
+        self.assertEqual(sorted(len(shard) for shard in shards), [3, 3, 4])
+        np.testing.assert_array_equal(np.concatenate(shards), selected)
+
+    def test_spatial_folds(self):
+        """Asserts that records of the same block are in the same fold."""
+        keys = {'latitude': np.array([0.1, 0.2, 5.5]),
+                'longitude': np.array([0.1, 0.9, 0.5])}
+        folds = spatial_folds(keys, block_degrees=1.0, num_folds=5)
+        self.assertEqual(folds[0], folds[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import unittest
+import random
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from utils import SceneIndex, geometry_bounds, grid_cells, date_to_millis
+
+
+# run : python -m unittest scene_index_test.py
+class TestSceneIndex(unittest.TestCase):
+    """Unittests the SceneIndex against a brute force scan."""
+
+    def setUp(self):
+        self.scenes = []
+        for i in range(500):
+            west = random.uniform(-180, 179)
+            south = random.uniform(-90, 89)
+            self.scenes.append({'id': 'scene_%i' % i,
+                                'time': random.randint(0, 1000),
+                                'bbox': [west, south,
+                                         west + random.uniform(0, 1),
+                                         south + random.uniform(0, 1)]})
+        self.index = SceneIndex(self.scenes)
+
+    def brute_force(self, bbox, start_time, end_time):
+        matches = [s for s in self.scenes
+                   if start_time <= s['time'] < end_time and
+                   s['bbox'][0] <= bbox[2] and bbox[0] <= s['bbox'][2] and
+                   s['bbox'][1] <= bbox[3] and bbox[1] <= s['bbox'][3]]
+        return sorted(s['id'] for s in matches)
+
+    def test_query(self):
+        """Asserts that the index returns the same scenes as a full scan."""
+        for _ in range(20):
+            west = random.uniform(-180, 150)
+            south = random.uniform(-90, 60)
+            bbox = [west, south, west + 30, south + 30]
+            start_time = random.randint(0, 500)
+            end_time = start_time + random.randint(0, 500)
+            self.assertEqual(sorted(self.index.query(bbox, start_time,
+                                                     end_time)),
+                             self.brute_force(bbox, start_time, end_time))
+
+    def test_query_geometries(self):
+        """Asserts that geometries are queried with their own bounds."""
+        index = SceneIndex([
+            {'id': 'west', 'time': 2, 'bbox': [0, 0, 1, 1]},
+            {'id': 'middle', 'time': 0, 'bbox': [4, 0, 5, 1]},
+            {'id': 'east', 'time': 1, 'bbox': [9, 0, 10, 1]}])
+
+        def point(x):
+            return {'type': 'Point', 'coordinates': [x, 0.5]}
+
+        self.assertEqual(index.query_geometries([point(0.5), point(9.5)]),
+                         ['east', 'west'])
+        self.assertEqual(index.query_geometries([point(0.5), point(9.5)],
+                                                start_time=2), ['west'])
+
+    def test_empty(self):
+        """Asserts that an empty index returns no scenes."""
+        self.assertEqual(SceneIndex([]).query([-180, -90, 180, 90]), [])
+
+    def test_save_filters(self):
+        """Asserts that the filters of the index are saved with it."""
+        filters = {'start_date': '2019-01-01', 'end_date': '2019-02-01'}
+        index = SceneIndex(self.scenes, 'collection', filters)
+        with tempfile.TemporaryDirectory() as path:
+            index.save(os.path.join(path, 'index.json'))
+            loaded = SceneIndex.load(os.path.join(path, 'index.json'))
+        self.assertEqual((loaded.link, loaded.filters),
+                         ('collection', filters))
+        self.assertEqual(loaded.scenes, self.scenes)
+
+    def test_geometry_bounds(self):
+        """Asserts the bounds of a GeoJSON polygon."""
+        polygon = {'type': 'Polygon',
+                   'coordinates': [[[0, 1], [2, 1], [2, 3], [0, 3], [0, 1]]]}
+        self.assertEqual(geometry_bounds(polygon), [0, 1, 2, 3])
+
+    def test_grid_cells(self):
+        """Asserts the grid cells intersecting a box across the meridian."""
+        cells = grid_cells([-0.5, 44.2, 1.5, 44.8], cell_size=1.0)
+        self.assertEqual(cells, {'cell_-1_44': [-1, 44, 0, 45],
+                                 'cell_0_44': [0, 44, 1, 45],
+                                 'cell_1_44': [1, 44, 2, 45]})
+
+    def test_date_to_millis(self):
+        """Asserts the conversion of a date to milliseconds."""
+        self.assertEqual(date_to_millis("1970-01-02"), 86400000)
+
+
+if __name__ == '__main__':
+    unittest.main()
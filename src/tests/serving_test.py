@@ -0,0 +1,167 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import json
+import tempfile
+import unittest
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import tensorflow as tf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from training import (BatchingQueue, NoSceneError, SceneCatalog,
+                      build_scene_catalog, serving_predict, start_server)
+
+
+def sum_factory(batch_sizes):
+    """Returns a factory of predictions summing the patches."""
+    def factory():
+        def predict(patches):
+            batch_sizes.append(len(patches))
+            return patches.sum(axis=(1, 2, 3))
+        return predict
+    return factory
+
+
+def write_scene(folder, west, value):
+    """Writes a one region scene of 1x1 degrees north of the equator."""
+    os.makedirs(folder)
+    grid = {'bands': ['patch_B'], 'height': 10, 'width': 10,
+            'transform': [0.1, 0, west, 0, -0.1, 1.0]}
+    np.save(os.path.join(folder, 'region.npy'),
+            np.full([10, 10, 1], value, dtype=np.float32))
+    with open(os.path.join(folder, 'index.json'), 'w') as file:
+        json.dump({'region': grid}, file)
+
+
+# run : python -m unittest serving_test.py
+class TestServing(unittest.TestCase):
+    """Unittests the dynamic batching of the prediction server."""
+
+    def test_batching(self):
+        """Asserts that concurrent records are batched up to the maximum."""
+        batch_sizes = []
+        batching_queue = BatchingQueue(sum_factory(batch_sizes),
+                                       max_batch_size=8, max_delay=0.2)
+        futures = [batching_queue.submit(np.full([2, 2, 1], i))
+                   for i in range(20)]
+        self.assertEqual([future.result(5) for future in futures],
+                         [4 * i for i in range(20)])
+        self.assertEqual(batch_sizes, [8, 8, 4])
+        summary = batching_queue.stats.summary()
+        self.assertEqual(summary['records'], 20)
+        self.assertLessEqual(summary['p50_ms'], summary['p99_ms'])
+
+    def test_server(self):
+        """Asserts the predictions and statistics served over HTTP."""
+        batching_queue = BatchingQueue(
+            lambda: serving_predict(sum_factory([])(), output_scale=2.0),
+            max_batch_size=4, max_delay=0.05, num_workers=2)
+        server = start_server(batching_queue, [2, 2, 1], port=0)
+        url = 'http://localhost:%i' % server.server_address[1]
+
+        def post(value):
+            body = json.dumps({'instances': [
+                {'patch': np.full([2, 2, 1], value).tolist()}]}).encode()
+            with urllib.request.urlopen(url + '/predict', body) as response:
+                return json.load(response)['predictions']
+
+        with ThreadPoolExecutor(8) as executor:
+            predictions = list(executor.map(post, range(16)))
+        self.assertEqual(predictions, [[2.0 * i] for i in range(16)])
+        with urllib.request.urlopen(url + '/stats') as response:
+            self.assertEqual(json.load(response)['records'], 16)
+        body = json.dumps({'instances': [{'patch': [[1.0]]}]}).encode()
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(url + '/predict', body)
+        self.assertEqual(context.exception.code, 400)
+        server.shutdown()
+        server.server_close()
+
+    def test_scene_catalog(self):
+        """Asserts that locations are looked up in the scenes covering them."""
+        with tempfile.TemporaryDirectory() as path:
+            write_scene(os.path.join(path, 'january'), 0.0, 1.0)
+            write_scene(os.path.join(path, 'february'), 10.0, 2.0)
+            with open(os.path.join(path, 'scenes.json'), 'w') as file:
+                json.dump({'2020-01-01T00:00:00': 'january',
+                           '2020-02-01T00:00:00': 'february'}, file)
+            catalog = SceneCatalog(path, ['patch_B'], kernel_radius=1)
+            self.assertEqual(catalog.lookup(0.5, 10.5, '2020-03-01')[1, 1, 0],
+                             2.0)
+            # The latest scene does not cover the location
+            self.assertEqual(catalog.lookup(0.5, 0.5, '2020-03-01')[1, 1, 0],
+                             1.0)
+            with self.assertRaises(NoSceneError):
+                catalog.lookup(0.5, 10.5, '2020-01-15')
+            with self.assertRaises(NoSceneError):
+                catalog.lookup(0.5, 20.5, '2020-03-01')
+
+            batching_queue = BatchingQueue(sum_factory([]), max_delay=0.01)
+            server = start_server(batching_queue, [3, 3, 1], port=0,
+                                  catalog=catalog)
+            url = 'http://localhost:%i/predict' % server.server_address[1]
+            instance = {'latitude': 0.5, 'longitude': 0.5,
+                        'time': '2020-03-01T00:00:00'}
+            body = json.dumps({'instances': [instance]}).encode()
+            with urllib.request.urlopen(url, body) as response:
+                self.assertEqual(json.load(response)['predictions'], [9.0])
+            body = json.dumps({'instances': [
+                dict(instance, longitude=20.5)]}).encode()
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(url, body)
+            self.assertEqual(context.exception.code, 422)
+            server.shutdown()
+            server.server_close()
+
+    def test_build_scene_catalog(self):
+        """Asserts that exported scene tiles are cataloged by time."""
+        scenes = {}
+        with tempfile.TemporaryDirectory() as path:
+            os.makedirs(os.path.join(path, 'tiles'))
+            for export_id, west, value in [('a_0', 0.0, 1.0),
+                                           ('b_0', 10.0, 2.0)]:
+                file = os.path.join(path, 'tiles', export_id + '.tfrecord.gz')
+                with tf.io.TFRecordWriter(file, 'GZIP') as writer:
+                    writer.write(tf.train.Example(features=tf.train.Features(
+                        feature={'patch_B': tf.train.Feature(
+                            float_list=tf.train.FloatList(
+                                value=[value] * 100))})).SerializeToString())
+                scenes[export_id] = {
+                    'crs': 'EPSG:4326', 'bands': ['patch_B'], 'height': 10,
+                    'width': 10, 'transform': [0.1, 0, west, 0, -0.1, 1.0],
+                    'time': '2020-0%i-01T00:00:00' % value}
+            # The tile of the last scene is missing
+            scenes['c_0'] = dict(scenes['b_0'], time='2020-03-01T00:00:00')
+            with open(os.path.join(path, 'scene_catalog.json'), 'w') as file:
+                json.dump(scenes, file)
+            catalog_path = os.path.join(path, 'catalog')
+            self.assertEqual(build_scene_catalog(
+                os.path.join(path, 'tiles'),
+                os.path.join(path, 'scene_catalog.json'), catalog_path),
+                {'2020-01-01T00:00:00': 'a_0', '2020-02-01T00:00:00': 'b_0'})
+            catalog = SceneCatalog(catalog_path, ['patch_B'], kernel_radius=1)
+            self.assertEqual(catalog.lookup(0.5, 10.5, '2020-03-01')[1, 1, 0],
+                             2.0)
+            self.assertEqual(catalog.lookup(0.5, 0.5, '2020-03-01')[1, 1, 0],
+                             1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
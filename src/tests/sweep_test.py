@@ -0,0 +1,113 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import json
+import tempfile
+import unittest
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from training import (DEFAULT_HPARAMS, grid_trials, load_array_dataset,
+                      decode_arrays, get_features_dict, MedianStopping,
+                      SPECTRAL_BANDS, OUTPUT_BANDS)
+from training.benchmark import write_synthetic_tfrecords
+
+
+# run : python -m unittest sweep_test.py
+class TestSweep(unittest.TestCase):
+    """Unittests the search space, shared arrays and pruning of sweeps."""
+
+    def test_grid_trials(self):
+        """Asserts that the grid covers the space with default values."""
+        space = {'learning_rate': [1e-5, 1e-4], 'optimizer': ['RMSprop',
+                                                              'Adam']}
+        trials = grid_trials(space)
+        self.assertEqual(len(trials), 4)
+        self.assertEqual(len(set(tuple(sorted(trial.items()))
+                                 for trial in trials)), 4)
+        for trial in trials:
+            self.assertEqual(trial['batch_size'],
+                             DEFAULT_HPARAMS['batch_size'])
+        sampled = grid_trials(space, num_trials=2, seed=1)
+        self.assertEqual(len(sampled), 2)
+        self.assertTrue(all(trial in trials for trial in sampled))
+        self.assertEqual(sampled, grid_trials(space, num_trials=2, seed=1))
+
+    def test_load_array_dataset(self):
+        """Asserts that every record is read once per pass."""
+        with tempfile.TemporaryDirectory() as path:
+            inputs = np.random.normal(size=[10, 3, 3, 2]).astype(np.float32)
+            outputs = np.arange(10, dtype=np.float32).reshape([10, 1])
+            np.save(os.path.join(path, 'inputs.npy'), inputs)
+            np.save(os.path.join(path, 'outputs.npy'), outputs)
+            read = list(load_array_dataset(path, 4, seed=0))
+            self.assertEqual([len(batch[0]) for batch in read], [4, 4, 2])
+            read_outputs = np.concatenate([batch[1] for batch in read])
+            self.assertEqual(sorted(read_outputs.ravel()), list(range(10)))
+            for batch_inputs, batch_outputs in read:
+                ids = batch_outputs.numpy().ravel().astype(int)
+                np.testing.assert_array_equal(batch_inputs, inputs[ids])
+
+    def test_decode_arrays(self):
+        """Asserts that arrays are decoded again for other band stats."""
+        features_dict = get_features_dict(2)
+        stats = {band: {'mean': 0.0, 'std': 2.0} for band in SPECTRAL_BANDS}
+        with tempfile.TemporaryDirectory() as path:
+            files = write_synthetic_tfrecords(
+                os.path.join(path, 'records'), features_dict, num_files=1,
+                records_per_file=4)
+            cache_path = os.path.join(path, 'arrays')
+            decoded = [decode_arrays(files, features_dict, SPECTRAL_BANDS,
+                                     OUTPUT_BANDS, cache_path,
+                                     band_stats=band_stats)
+                       for band_stats in [stats, dict(stats, patch_B={
+                           'mean': 0.0, 'std': 4.0}), stats]]
+            self.assertNotEqual(decoded[0], decoded[1])
+            self.assertEqual(decoded[0], decoded[2])
+            inputs = [np.load(os.path.join(folder, 'inputs.npy'))
+                      for folder in decoded[:2]]
+            np.testing.assert_allclose(inputs[0][..., 0],
+                                       2 * inputs[1][..., 0], rtol=1e-6)
+            with self.assertRaises(ValueError):
+                decode_arrays([], features_dict, SPECTRAL_BANDS,
+                              OUTPUT_BANDS, cache_path)
+
+    def test_median_stopping(self):
+        """Asserts that a trial worse than the median is pruned."""
+        class FakeModel:
+            stop_training = False
+
+        with tempfile.TemporaryDirectory() as path:
+            for trial_id, history in enumerate([[1.0, 0.5], [1.0, 0.6]]):
+                json.dump(history, open(os.path.join(
+                    path, 'trial_%i.json' % trial_id), 'w'))
+            for losses, pruned in [([0.4, 0.3], False), ([2.0, 1.0], True)]:
+                callback = MedianStopping(path, 2, grace_epochs=2)
+                callback.model = FakeModel()
+                callback.on_epoch_end(0, {'val_root_mean_squared_error':
+                                          losses[0]})
+                self.assertFalse(callback.model.stop_training)
+                callback.on_epoch_end(1, {'val_root_mean_squared_error':
+                                          losses[1]})
+                self.assertEqual(callback.model.stop_training, pruned)
+                self.assertEqual(json.load(open(os.path.join(
+                    path, 'trial_2.json'), 'r')), losses)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+import os
+import tempfile
+import unittest
+import numpy as np
+import tensorflow as tf
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# these are relative imports
+from training import validate_tfrecords, quarantine_shards, balance_shards
+
+FEATURES = {'latitude': tf.io.FixedLenFeature([1, 1], tf.float32),
+            'patch_B': tf.io.FixedLenFeature([3, 3], tf.float32)}
+
+
+def write_records(file, patches):
+    """Writes a GZIP TFRecord file with a latitude and a patch per record."""
+    with tf.io.TFRecordWriter(file, options='GZIP') as writer:
+        for patch in patches:
+            feature = {
+                'latitude': tf.train.Feature(
+                    float_list=tf.train.FloatList(value=[1.0])),
+                'patch_B': tf.train.Feature(
+                    float_list=tf.train.FloatList(value=patch.ravel()))}
+            example = tf.train.Example(
+                features=tf.train.Features(feature=feature))
+            writer.write(example.SerializeToString())
+
+
+# run : python -m unittest validation_test.py
+class TestValidation(unittest.TestCase):
+    """Unittests the validation of exported shards."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.files = {}
+        for name, patches in [('good', rng.normal(size=(6, 3, 3))),
+                              ('small', rng.normal(size=(2, 3, 3))),
+                              ('shape', rng.normal(size=(2, 2, 2))),
+                              ('nan', np.full((2, 3, 3), np.nan)),
+                              ('constant', np.zeros((3, 3, 3)))]:
+            self.files[name] = os.path.join(self.folder.name,
+                                            name + '_0.tfrecord.gz')
+            write_records(self.files[name], patches)
+        # Truncated copy of the good shard
+        data = open(self.files['good'], 'rb').read()
+        self.files['truncated'] = os.path.join(self.folder.name,
+                                               'truncated_0.tfrecord.gz')
+        open(self.files['truncated'], 'wb').write(data[:len(data) // 2])
+        self.manifest = validate_tfrecords(sorted(self.files.values()),
+                                           FEATURES, processes=2)
+        self.entries = {os.path.basename(entry['file']).split('_')[0]: entry
+                        for entry in self.manifest['shards']}
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_status(self):
+        """Asserts the status and counts of every shard."""
+        status = {name: entry['status']
+                  for name, entry in self.entries.items()}
+        self.assertEqual(status, {'good': 'ok', 'small': 'ok',
+                                  'constant': 'ok', 'shape': 'invalid',
+                                  'nan': 'nonfinite',
+                                  'truncated': 'corrupt'})
+        self.assertEqual(self.entries['good']['records'], 6)
+        self.assertEqual(self.entries['constant']['constant_patches'],
+                         {'patch_B': 3})
+        self.assertEqual(self.manifest['records'], 11)
+
+    def test_quarantine_and_balance(self):
+        """Asserts that bad shards are moved and good ones balanced."""
+        moved = quarantine_shards(self.manifest,
+                                  os.path.join(self.folder.name, 'bad'))
+        self.assertEqual(len(moved), 3)
+        self.assertFalse(os.path.exists(self.files['nan']))
+        workers = balance_shards(self.manifest, 2)
+        self.assertEqual(workers, [[self.files['good']],
+                                   sorted([self.files['constant'],
+                                           self.files['small']])])
+
+
+if __name__ == '__main__':
+    unittest.main()
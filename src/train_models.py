@@ -16,22 +16,88 @@ limitations under the License.
 
 import json
 import os
+import sys
 import argparse
+import functools
 import training
-import random
-from tensorflow.python.keras import layers
-from tensorflow.python.keras import losses
-from tensorflow.python.keras import metrics
-from tensorflow.python.keras import optimizers
+from training import mutlicnn
+import numpy as np
+from tensorflow.keras import callbacks
+from tensorflow.keras import layers
+from tensorflow.keras import losses
+from tensorflow.keras import metrics
+from tensorflow.keras import optimizers
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Train model')
     parser.add_argument('--params_path', type=str)
     parser.add_argument('--model_type', type=str)
-    parser.add_argument('--gpu_index', type=int, default=0)
+    parser.add_argument('--gpu_index', type=int, default=0,
+                        help="GPU used by the training, -1 for the CPU")
     parser.add_argument('--tfrecords_path', type=str)
     parser.add_argument('--checkpoint_path', type=str)
+    parser.add_argument('--init_model', type=str, default=None,
+                        help="saved model whose weights start the training "
+                        "when there is no checkpoint to resume")
+    parser.add_argument('--keep_checkpoints', type=int, default=3,
+                        help="number of most recent checkpoints kept")
+    parser.add_argument('--static_cache', type=str, default=None,
+                        help="static layer cache built by build_static_cache.py")
+    parser.add_argument('--bands', type=str,
+                        default="spectral,tropo,dsm,wind,road",
+                        help="comma separated band groups used by the model")
+    parser.add_argument('--branch_crops', type=str, default="",
+                        help="MULTICNN center crop of band groups, e.g. "
+                        "wind=9,tropo=65")
+    parser.add_argument('--branch_resolutions', type=str, default="",
+                        help="MULTICNN downsampling of band groups, e.g. "
+                        "tropo=4")
+    parser.add_argument('--cache_path', type=str, default=None,
+                        help="local folder caching the decoded records")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of the train/eval split of the files")
+    parser.add_argument('--shuffle_mode', type=str, default='buffer',
+                        choices=['buffer', 'index'],
+                        help="shuffle decoded records in a buffer, or "
+                        "record ids through a record index")
+    parser.add_argument('--index_path', type=str, default=None,
+                        help="folder of the record index, defaults to "
+                        "tfrecords_path/index")
+    parser.add_argument('--split', type=str, default='file',
+                        choices=['file', 'spatial', 'temporal'],
+                        help="train/eval split of the record index: last 10 "
+                        "files, lat/lon blocks or month blocks")
+    parser.add_argument('--eval_fold', type=int, default=0,
+                        help="fold of the blocks used for evaluation")
+    parser.add_argument('--band_stats', type=str, default=None,
+                        help="band_stats.json written by "
+                        "compute_band_stats.py, normalizes the bands in the "
+                        "loader instead of the input BatchNormalization")
+    parser.add_argument('--watch', action='store_true',
+                        help="admit shards exported to tfrecords_path "
+                        "between epochs, updating the band statistics of "
+                        "--band_stats, or of tfrecords_path without it")
+    parser.add_argument('--fresh_weight', type=float, default=None,
+                        help="fraction of newly admitted shards in an epoch "
+                        "with --watch")
+    parser.add_argument('--crop_schedule', type=str, default=None,
+                        help="center crop sizes of the training patches of "
+                        "single input models by first epoch, e.g. "
+                        "0:65,20:129,50:257, evaluation stays full size")
+    parser.add_argument('--local_workers', type=int, default=1,
+                        help="data parallel CPU workers launched on this "
+                        "host, hosts of a cluster are set by TF_CONFIG")
+    parser.add_argument('--base_port', type=int, default=12345,
+                        help="port of the first local worker")
+    parser.add_argument('--shard_manifest', type=str, default=None,
+                        help="shard_manifest.json of validate_tfrecords.py "
+                        "balancing the files of the workers by records")
+    parser.add_argument('--scale_learning_rate', action='store_true',
+                        help="multiply the learning rate by the number of "
+                        "workers like the global batch size")
+    parser.add_argument('--profile_input', action='store_true',
+                        help="report the throughput of the input pipeline")
 
     args = parser.parse_args()
 
@@ -40,87 +106,280 @@ if __name__ == "__main__":
     gpu_index = args.gpu_index
     tfrecords_path = args.tfrecords_path
     checkpoint_path = args.checkpoint_path
+    init_model = args.init_model
+    keep_checkpoints = args.keep_checkpoints
+    static_cache_path = args.static_cache
+    profile_input = args.profile_input
+    band_groups = args.bands.split(',')
+    branch_crops = {group: int(size) for group, size in
+                    (item.split('=') for item in args.branch_crops.split(',')
+                     if item)}
+    branch_resolutions = {group: int(factor) for group, factor in
+                          (item.split('=') for item
+                           in args.branch_resolutions.split(',') if item)}
+    cache_path = args.cache_path
+    shuffle_mode = args.shuffle_mode
+    index_path = args.index_path or os.path.join(args.tfrecords_path, 'index')
+    split = args.split
+    eval_fold = args.eval_fold
+    band_stats_path = args.band_stats
+    watch = args.watch
+    fresh_weight = args.fresh_weight
+    crop_schedule = args.crop_schedule
 
-    assert gpu_index in [0, 1], "Index should be either 0 or 1"
-    os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_index)
+    if args.local_workers > 1 and 'TF_CONFIG' not in os.environ:
+        # Each worker runs this script with its TF_CONFIG
+        sys.exit(max(training.launch_local_workers(
+            sys.argv, args.local_workers, args.base_port)))
+    num_workers, worker_index = training.worker_config()
+
+    assert gpu_index in [-1, 0, 1], "Index should be either -1, 0 or 1"
+    assert not (watch and shuffle_mode == 'index'), \
+        "--watch is only supported with --shuffle_mode buffer"
+    assert not crop_schedule or model_type.upper() in \
+        training.SINGLE_INPUT_MODELS, \
+        "--crop_schedule is only supported by single input models"
+    assert not (watch and num_workers > 1), \
+        "--watch is not supported by data parallel training"
+    assert not (watch and profile_input), \
+        "--profile_input is not supported with --watch"
+    # Data parallel workers train on the CPUs
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_index) \
+        if num_workers == 1 else "-1"
 
     import tensorflow as tf
 
+    if num_workers > 1:
+        # Gradients are all-reduced between the workers of TF_CONFIG
+        strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    else:
+        strategy = tf.distribute.get_strategy()
+
     kernel_radius = params['kernel_radius']
-    tfrecord_files = [os.path.join(tfrecords_path, f) for f in
-                      os.listdir(tfrecords_path)]
-    random.shuffle(tfrecord_files)
-
-    patch_size = [2 * kernel_radius + 1] * 2
-    spectral_bands = ["patch_%s" % b for b in ['B', 'G', 'R', 'N', 'P']]
-    tropo_bands = ['patch_cloud_fraction']
-    wind_bands =["patch_%s"%b for b in ['11_u_component_of_wind_10m', '11_v_component_of_wind_10m', '10_u_component_of_wind_10m', '10_v_component_of_wind_10m',
-             '9_u_component_of_wind_10m', '9_v_component_of_wind_10m', '8_u_component_of_wind_10m', '8_v_component_of_wind_10m',
-             '7_u_component_of_wind_10m', '7_v_component_of_wind_10m', '6_u_component_of_wind_10m', '6_v_component_of_wind_10m',
-             '5_u_component_of_wind_10m', '5_v_component_of_wind_10m', '4_u_component_of_wind_10m', '4_v_component_of_wind_10m', 
-             '3_u_component_of_wind_10m', '3_v_component_of_wind_10m', '2_u_component_of_wind_10m', '2_v_component_of_wind_10m',
-             '1_u_component_of_wind_10m', '1_v_component_of_wind_10m', '0_u_component_of_wind_10m', '0_v_component_of_wind_10m']]
-    dsm_bands = ['patch_dsm']
-    road_bands = ['patch_num_observations']
-    patch_bands = (spectral_bands + tropo_bands + dsm_bands + wind_bands +
-                   road_bands)
-
-    date_bands = ['longitude', 'latitude', 'HOD', 'DOW', 'DOM', 'MOY']
-    output = ['tropospheric_NO2_column_number_density']
-
-    columns = [tf.io.FixedLenFeature(shape=patch_size, dtype=tf.float32)
-               for k in patch_bands] + [
-               tf.io.FixedLenFeature(shape=[1, 1], dtype=tf.float32)
-               for k in date_bands] + [
-               tf.io.FixedLenFeature(shape=[1, 1], dtype=tf.float32)]
-    features = patch_bands + date_bands + output
-    features_dict = dict(zip(features, columns))
+    if watch:
+        # Evaluation shards are held out as they are admitted
+        all_train_files, eval_files = [], []
+    else:
+        # Every run and worker with the same seed holds out the same files
+        all_train_files, eval_files = training.split_tfrecords(
+            training.list_tfrecords(tfrecords_path), args.seed)
+    manifest = None
+    if args.shard_manifest:
+        manifest = training.load_manifest(args.shard_manifest)
+    train_files = training.worker_files(all_train_files, num_workers,
+                                        worker_index, manifest)
+
+    spectral_bands = training.SPECTRAL_BANDS
+    tropo_bands = training.TROPO_BANDS
+    wind_bands = training.WIND_BANDS
+    dsm_bands = training.DSM_BANDS
+    road_bands = training.ROAD_BANDS
+    date_bands = training.DATE_BANDS
+    output = training.OUTPUT_BANDS
+
+    features_dict = training.get_features_dict(kernel_radius)
+    static_cache = None
+    if static_cache_path:
+        # Static bands are joined from the cache instead of being parsed
+        static_cache = training.StaticLayerCache(static_cache_path,
+                                                 kernel_radius)
+        for band in static_cache.bands:
+            features_dict.pop(band, None)
+    # Quantized TFRecords are decoded transparently by load_tfrecords
+    quantization = training.load_quantization(tfrecords_path)
+    band_stats = None
+    if band_stats_path and not watch:
+        band_stats = training.load_band_stats(band_stats_path)
+        assert band_stats, "No band statistics in %s" % band_stats_path
     input_bands = [spectral_bands, tropo_bands, dsm_bands, wind_bands,
                    road_bands, date_bands]
+    if model_type.upper() in training.SINGLE_INPUT_MODELS:
+        # Only the model bands are parsed, stacked at once in a single input
+        input_bands = [training.select_bands(band_groups)]
+    elif model_type.upper() == "MULTICNN":
+        # One input per band group, in BAND_GROUPS order
+        branch_groups = [group for group in training.BAND_GROUPS
+                         if group in band_groups]
+        input_bands = [training.BAND_GROUPS[group] for group in branch_groups]
 
-    train_dataset = training.load_tfrecords(tfrecord_files[:-10], features_dict,
-                                       input_bands, output)
-    eval_dataset = training.load_tfrecords(tfrecord_files[-10:], features_dict,
-                                      input_bands, output)
-
-    if model_type.upper() == "CNN":
-        number_of_bands = sum([len(bands) for bands in input_bands]) - len(date_bands)
-        inputs = layers.Input(shape=[None, None, number_of_bands])
-        train_dataset = train_dataset.map(training.merge_features_without_date)
-        train_dataset = train_dataset.map(training.augment_after_merge).map(training.scale_no2)
-        eval_dataset = eval_dataset.map(training.merge_features_without_date).map(training.scale_no2)
-        eval_dataset = eval_dataset.map(training.augment_after_merge)
-        #model = training.get_cnn_model(inputs)
-    #model.summary()
     EPOCHS = 100
     BUFFER_SIZE = 200
     BATCH_SIZE = 32
     CKP_EPOCH = 5
     OPTIMIZER = 'RMSprop'
+    LEARNING_RATE = 1e-5
     LOSS = 'MeanSquaredError'
     METRICS = ['RootMeanSquaredError']
-    optimizer = optimizers.get(OPTIMIZER)
-    optimizer.learning_rate = 1e-5    
-    train_dataset = train_dataset.shuffle(BUFFER_SIZE).batch(BATCH_SIZE).repeat()
-    eval_dataset = eval_dataset.batch(1).repeat()
-    
-    model = tf.keras.models.load_model(os.path.join(checkpoint_path,"CNN_19.ckp"))
-    model.compile(optimizer=optimizer, loss=losses.get(LOSS),
-                  metrics=[metrics.get(metric) for metric in METRICS])
-
-    try:
-        os.mkdir(checkpoint_path)
-    except FileExistsError:
-        print('folder checkpoints already exists')
-
-    for i in range(EPOCHS):
-        history = model.fit(x=train_dataset, steps_per_epoch=500,
-                            epochs=1, validation_data = eval_dataset,
-                            validation_steps = 50)
-        if (i+1)%CKP_EPOCH == 0:
-            tf.keras.models.save_model(model,
-                                       os.path.join(checkpoint_path,
-                                                    model_type+"_%i.ckp" % i))
-            json.dump(history.history,
-                      open(os.path.join(checkpoint_path, model_type +
-                                        "_%i.json" % i), 'w'))
+    # Every worker trains on batches of BATCH_SIZE records of its shard
+    global_batch_size = BATCH_SIZE * num_workers
+    if args.scale_learning_rate:
+        LEARNING_RATE *= num_workers
+
+    if shuffle_mode == 'index':
+        # Record ids are shuffled, records are read by random access
+        index = training.load_record_index(
+            sorted(all_train_files + eval_files), index_path)
+        is_eval = training.eval_records(index, split, eval_fold, eval_files)
+        train_dataset = training.load_indexed_tfrecords(
+            index, features_dict, input_bands, output, BATCH_SIZE,
+            record_ids=training.RecordIndex.shard(
+                np.flatnonzero(~is_eval), num_workers, worker_index),
+            local_buffer=BUFFER_SIZE,
+            static_cache=static_cache, quantization=quantization,
+            band_stats=band_stats)
+        eval_dataset = training.load_indexed_tfrecords(
+            index, features_dict, input_bands, output, 1,
+            record_ids=np.flatnonzero(is_eval), shuffle=False,
+            static_cache=static_cache, quantization=quantization,
+            band_stats=band_stats)
+    elif watch:
+        # Shards are admitted as they are exported by a background thread,
+        # which holds out the evaluation shards and updates the statistics
+        watcher = training.ShardWatcher(
+            tfrecords_path, features_dict, quantization,
+            stats_path=band_stats_path or tfrecords_path, seed=args.seed,
+            num_eval=10)
+        poll_callbacks = []
+        if band_stats_path:
+            # The loader normalization follows the updated statistics
+            band_stats = training.IncrementalNormalization(
+                watcher, input_bands, output)
+            poll_callbacks.append(band_stats.update)
+        watcher.start(callbacks=poll_callbacks)
+        train_dataset = training.load_incremental_tfrecords(
+            watcher, features_dict, input_bands, output, BATCH_SIZE,
+            fresh_weight=fresh_weight, shuffle_buffer=BUFFER_SIZE,
+            static_cache=static_cache, quantization=quantization,
+            band_stats=band_stats)
+        # Validation waits until a shard is held out, the second admitted
+        eval_dataset = training.load_incremental_tfrecords(
+            watcher, features_dict, input_bands, output, 1,
+            static_cache=static_cache, quantization=quantization,
+            band_stats=band_stats, eval_shards=True)
+    else:
+        # Records are shuffled serialized, then parsed and stacked by batch
+        train_dataset = training.load_batched_tfrecords(
+            train_files, features_dict, input_bands, output,
+            BATCH_SIZE, shuffle_buffer=BUFFER_SIZE, static_cache=static_cache,
+            quantization=quantization, cache_path=cache_path,
+            band_stats=band_stats)
+        eval_dataset = training.load_batched_tfrecords(
+            eval_files, features_dict, input_bands, output, 1,
+            static_cache=static_cache, quantization=quantization,
+            cache_path=cache_path, band_stats=band_stats)
+    if profile_input:
+        print(training.profile_input_pipeline(
+            all_train_files, features_dict, input_bands, output,
+            BATCH_SIZE, static_cache=static_cache,
+            quantization=quantization, band_stats=band_stats))
+
+    if model_type.upper() in training.SINGLE_INPUT_MODELS:
+        number_of_bands = len(input_bands[0])
+        inputs = layers.Input(shape=[None, None, number_of_bands])
+        if crop_schedule:
+            # Small crops first, the size grows at the epochs of the schedule
+            progressive_crop = training.ProgressiveCrop(
+                training.parse_crop_schedule(crop_schedule))
+            train_dataset = train_dataset.map(progressive_crop.crop)
+        # Independent random rotations and flips for every sample of a batch
+        train_dataset = train_dataset.map(
+            training.batch_augmentation(input_bands),
+            num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        if band_stats is None:
+            # Outputs are divided by their deviation by the loader otherwise
+            train_dataset = train_dataset.map(training.scale_no2)
+            eval_dataset = eval_dataset.map(training.scale_no2)
+        # CNN or an EFFICIENT_* variant of training.EFFICIENT_VARIANTS
+        build_model = functools.partial(
+            training.build_model, model_type, inputs,
+            normalize_input=band_stats is None,
+            global_pooling=bool(crop_schedule))
+    elif model_type.upper() == "MULTICNN":
+        # Groups are fed to their branch without being concatenated, each
+        # branch has its own crop and resolution
+        crop_sizes = [branch_crops.get(group) for group in branch_groups]
+        # Date bands are scalars, tiled by the model
+        sizes = [1 if group == 'date' else size or 2 * kernel_radius + 1
+                 for group, size in zip(branch_groups, crop_sizes)]
+        inputs = [layers.Input(shape=[size, size, len(bands)])
+                  for size, bands in zip(sizes, input_bands)]
+        crop = training.center_crop_groups(crop_sizes)
+        train_dataset = train_dataset.map(
+            crop, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        train_dataset = train_dataset.map(
+            training.batch_augmentation(input_bands),
+            num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        train_dataset = train_dataset.map(training.group_inputs)
+        eval_dataset = eval_dataset.map(crop).map(training.group_inputs)
+        if band_stats is None:
+            train_dataset = train_dataset.map(training.scale_no2)
+            eval_dataset = eval_dataset.map(training.scale_no2)
+        build_model = functools.partial(
+            mutlicnn.get_model, inputs, normalize_input=band_stats is None,
+            resolutions=[branch_resolutions.get(group, 1)
+                         for group in branch_groups])
+    else:
+        raise ValueError("Unsupported model type %s" % model_type)
+    train_dataset = train_dataset.repeat()
+    eval_dataset = eval_dataset.repeat()
+    if num_workers > 1:
+        # Each worker feeds its own shard, batches are not split again
+        train_source, eval_source = train_dataset, eval_dataset
+        train_dataset = strategy.distribute_datasets_from_function(
+            lambda _: train_source)
+        eval_dataset = strategy.distribute_datasets_from_function(
+            lambda _: eval_source)
+
+    with strategy.scope():
+        model = build_model()
+        optimizer = optimizers.get(OPTIMIZER)
+        optimizer.learning_rate = LEARNING_RATE
+        model.compile(optimizer=optimizer, loss=losses.get(LOSS),
+                      metrics=[metrics.get(metric) for metric in METRICS])
+    model.summary()
+
+    # Non chief workers write their checkpoints to their own folder
+    checkpoint_path = training.worker_path(checkpoint_path, worker_index)
+    os.makedirs(checkpoint_path, exist_ok=True)
+    split_path = os.path.join(checkpoint_path, training.SPLIT_FILE)
+    if worker_index == 0 and not watch:
+        # Scripts evaluating the model hold out the same records
+        training.save_split(
+            split_path, all_train_files, eval_files, seed=args.seed,
+            split=split if shuffle_mode == 'index' else 'file',
+            eval_fold=eval_fold, index_path=index_path)
+    if init_model:
+        # Starts from the weights of a saved model of the same architecture
+        model.set_weights(
+            tf.keras.models.load_model(init_model, compile=False).get_weights())
+
+    # Weights, optimizer state and epoch are saved in the background and
+    # the latest checkpoint of checkpoint_path is resumed
+    checkpoint = training.TrainingCheckpoint(
+        os.path.join(checkpoint_path, model_type), model, optimizer,
+        max_to_keep=keep_checkpoints, save_every=CKP_EPOCH)
+    initial_epoch = checkpoint.restore()
+    # Crop size and records per second are logged before the history
+    epoch_callbacks = [checkpoint.callback()]
+    if watch:
+        # The shards admitted so far, rewritten after every epoch
+        epoch_callbacks.append(callbacks.LambdaCallback(
+            on_epoch_end=lambda epoch, logs: training.save_split(
+                split_path, watcher.train_files(), watcher.eval_files(),
+                seed=args.seed, split='file')))
+    if crop_schedule:
+        epoch_callbacks.append(progressive_crop.callback())
+    epoch_callbacks.append(training.ThroughputCallback(global_batch_size))
+    epoch_callbacks.append(training.StepTimeCallback(worker_index))
+    history_logger = callbacks.CSVLogger(
+        os.path.join(checkpoint_path, model_type + "_history.csv"),
+        append=initial_epoch > 0)
+
+    model.fit(x=train_dataset, steps_per_epoch=500, epochs=EPOCHS,
+              initial_epoch=initial_epoch, validation_data=eval_dataset,
+              validation_steps=50,
+              callbacks=epoch_callbacks + [history_logger])
+    if watch:
+        watcher.stop()
+    tf.keras.models.save_model(model, os.path.join(
+        checkpoint_path, model_type + "_%i.ckp" % (EPOCHS - 1)))
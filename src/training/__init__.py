@@ -1,2 +1,36 @@
 from .cnn import get_cnn_model
+from .architectures import (get_efficient_cnn_model, build_model,
+                            count_flops, measure_latency, model_report,
+                            EFFICIENT_VARIANTS, SINGLE_INPUT_MODELS)
 from .load_data import *
+from .static_cache import StaticLayerCache, build_static_cache
+from .schema import *
+from .quantization import (compute_quantization, quantize_tfrecords,
+                           load_quantization, benchmark_decoding)
+from .dataset_cache import (dataset_fingerprint, cache_dataset,
+                            evict_stale_caches)
+from .record_index import (RecordIndex, build_record_index, load_record_index,
+                           spatial_folds, temporal_folds, eval_records)
+from .band_stats import (BandAccumulator, compute_band_stats, save_band_stats,
+                         load_band_stats, normalization_constants)
+from .validation import (validate_tfrecords, save_manifest, load_manifest,
+                         quarantine_shards, balance_shards)
+from .ingestion import (ShardWatcher, IncrementalNormalization,
+                        load_incremental_tfrecords)
+from .checkpoints import TrainingCheckpoint
+from .progressive import (parse_crop_schedule, ProgressiveCrop,
+                          ThroughputCallback)
+from .inference import (load_inference_model, fully_convolutional,
+                        RasterPredictor, predict_raster)
+from .export import (QUANTIZATION_MODES, representative_dataset,
+                     convert_tflite, TFLiteModel, prediction_drift,
+                     benchmark_batch_sizes)
+from .serving import (LatencyStats, BatchingQueue, NoSceneError,
+                      build_scene_catalog, SceneCatalog, serving_predict,
+                      start_server)
+from .evaluation import (ErrorAccumulator, SlicedErrors, evaluate_model,
+                         road_edges_from_stats, compare_reports)
+from .distributed import (worker_config, launch_local_workers, worker_files,
+                          worker_path, StepTimeCallback)
+from .sweep import (DEFAULT_HPARAMS, decode_arrays, load_array_dataset,
+                    grid_trials, MedianStopping, run_sweep, save_results)
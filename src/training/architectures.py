@@ -0,0 +1,200 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import time
+import numpy as np
+from tensorflow.keras import layers
+from tensorflow.keras import models
+
+from training.cnn import get_cnn_model
+
+# Strided stem convolutions, then (filters, stride) of the separable blocks
+EFFICIENT_VARIANTS = {
+    'EFFICIENT_TINY': {'stem': [(16, 2), (32, 2)],
+                       'blocks': [(64, 2), (64, 1), (128, 2), (128, 2)]},
+    'EFFICIENT_SMALL': {'stem': [(32, 2), (32, 2)],
+                        'blocks': [(64, 2), (64, 1), (128, 2), (128, 1),
+                                   (256, 2), (256, 2)]},
+    'EFFICIENT_BASE': {'stem': [(32, 2)],
+                       'blocks': [(64, 2), (64, 1), (128, 2), (128, 1),
+                                  (256, 2), (256, 1), (256, 2), (256, 2)]}}
+# Models taking all the bands stacked in a single input
+SINGLE_INPUT_MODELS = ['CNN'] + sorted(EFFICIENT_VARIANTS)
+
+
+def separable_block(input_tensor, num_filters, strides=1,
+                    activation='softplus'):
+    """Depthwise 3x3 convolution followed by a pointwise 1x1 convolution."""
+    depthwise = layers.DepthwiseConv2D((3, 3), strides=strides,
+                                       padding='same',
+                                       use_bias=False)(input_tensor)
+    depthwise = layers.BatchNormalization()(depthwise)
+    depthwise = layers.Activation(activation)(depthwise)
+    pointwise = layers.Conv2D(num_filters, (1, 1), use_bias=False)(depthwise)
+    pointwise = layers.BatchNormalization()(pointwise)
+    return layers.Activation(activation)(pointwise)
+
+
+def get_efficient_cnn_model(inputs, variant='EFFICIENT_SMALL',
+                            normalize_input=True, activation='softplus'):
+    """Returns a fully convolutional model of a variant of EFFICIENT_VARIANTS.
+
+    The input is downsampled by strided convolutions before any wide layer,
+    the features are averaged over the remaining positions so any patch
+    size works, and the output is 1x1x1 like the one of get_cnn_model.
+
+    Parameters
+    ----------
+    inputs : Input
+        Stacked bands, HxWxC
+    variant : str, optional
+        Key of EFFICIENT_VARIANTS. The default is 'EFFICIENT_SMALL'.
+    normalize_input : bool, optional
+        Adds a BatchNormalization on the inputs. The default is True.
+    activation : str, optional
+        Activation of the hidden layers. The default is 'softplus'.
+
+    Returns
+    -------
+    Model
+
+    """
+    spec = EFFICIENT_VARIANTS[variant]
+    encoder = inputs
+    if normalize_input:
+        encoder = layers.BatchNormalization()(encoder)
+    for num_filters, strides in spec['stem']:
+        encoder = layers.Conv2D(num_filters, (3, 3), strides=strides,
+                                padding='same', use_bias=False)(encoder)
+        encoder = layers.BatchNormalization()(encoder)
+        encoder = layers.Activation(activation)(encoder)
+    for num_filters, strides in spec['blocks']:
+        encoder = separable_block(encoder, num_filters, strides, activation)
+    pooled = layers.GlobalAveragePooling2D()(encoder)
+    pooled = layers.Reshape((1, 1, spec['blocks'][-1][0]))(pooled)
+    output = layers.Conv2D(1, (1, 1), activation='softplus')(pooled)
+    return models.Model(inputs=[inputs], outputs=[output])
+
+
+def build_model(model_type, inputs, normalize_input=True,
+                global_pooling=False):
+    """Returns the single input model of a type of SINGLE_INPUT_MODELS.
+
+    EFFICIENT_* variants always pool globally, global_pooling only changes
+    the CNN, see get_cnn_model.
+    """
+    model_type = model_type.upper()
+    if model_type == 'CNN':
+        return get_cnn_model(inputs, normalize_input, global_pooling)
+    if model_type in EFFICIENT_VARIANTS:
+        return get_efficient_cnn_model(inputs, model_type, normalize_input)
+    raise ValueError("Unknown model type %s, should be in %s" %
+                     (model_type, SINGLE_INPUT_MODELS))
+
+
+def count_flops(model):
+    """Returns the floating point operations of a forward pass of a record.
+
+    Convolutions and dense layers are counted as 2 operations per
+    multiply-add, other layers are neglected. The spatial shapes of the
+    model inputs must be defined.
+
+    Parameters
+    ----------
+    model : Model
+
+    Returns
+    -------
+    int
+
+    """
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, layers.DepthwiseConv2D):
+            _, height, width, channels = layer.output_shape
+            kernel_height, kernel_width = layer.kernel_size
+            flops += 2 * height * width * kernel_height * kernel_width * \
+                channels
+        elif isinstance(layer, layers.Conv2D):
+            _, height, width, channels = layer.output_shape
+            kernel_height, kernel_width = layer.kernel_size
+            flops += 2 * height * width * kernel_height * kernel_width * \
+                layer.input_shape[-1] * channels
+        elif isinstance(layer, layers.Dense):
+            flops += 2 * layer.input_shape[-1] * layer.units
+    return int(flops)
+
+
+def measure_latency(model, batch_size=1, num_runs=10):
+    """Returns the mean seconds of an inference on a random batch.
+
+    Parameters
+    ----------
+    model : Model
+        Model whose input shapes are defined
+    batch_size : int, optional
+        Number of records per inference. The default is 1.
+    num_runs : int, optional
+        Number of inferences measured after a warm up one.
+        The default is 10.
+
+    Returns
+    -------
+    float
+
+    """
+    shapes = model.input_shape
+    if not isinstance(shapes, list):
+        shapes = [shapes]
+    batch = [np.random.normal(size=[batch_size] + list(shape[1:])).astype(
+        np.float32) for shape in shapes]
+    if len(batch) == 1:
+        batch = batch[0]
+    model.predict_on_batch(batch)
+    start = time.time()
+    for _ in range(num_runs):
+        model.predict_on_batch(batch)
+    return (time.time() - start) / num_runs
+
+
+def model_report(model_type, patch_size, num_bands, batch_size=1,
+                 num_runs=10):
+    """Returns the parameters, FLOPs and CPU latency of a model type.
+
+    Parameters
+    ----------
+    model_type : str
+        Type of SINGLE_INPUT_MODELS
+    patch_size : int
+        Height and width of the patches
+    num_bands : int
+        Number of stacked bands
+    batch_size : int, optional
+        Number of records per measured inference. The default is 1.
+    num_runs : int, optional
+        Number of measured inferences. The default is 10.
+
+    Returns
+    -------
+    dict
+        "params", "flops" per record and "latency_seconds" per batch
+
+    """
+    model = build_model(model_type, layers.Input(
+        shape=[patch_size, patch_size, num_bands]))
+    return {'params': int(model.count_params()),
+            'flops': count_flops(model),
+            'latency_seconds': measure_latency(model, batch_size, num_runs)}
@@ -0,0 +1,367 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import json
+import os
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.example import example_pb2
+
+from training.record_index import iter_records
+from training.quantization import ENCODINGS
+from training.schema import wind_pairs
+
+STATS_FILE = 'band_stats.json'
+QUANTILES = [0.001, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 0.999]
+# Values kept per band to estimate the quantiles
+SAMPLE_SIZE = 100000
+# Records accumulated before updating the statistics
+RECORDS_PER_UPDATE = 64
+
+
+class BandAccumulator:
+    """Mergeable running statistics of the values of a band.
+
+    The count, mean and sum of squared deviations are merged exactly, and
+    quantiles are estimated from a uniform sample of at most sample_size
+    values, so accumulators computed on separate files by separate
+    processes can be merged in any order.
+    """
+
+    def __init__(self, sample_size=SAMPLE_SIZE, seed=None):
+        """Initializes an empty BandAccumulator.
+
+        Parameters
+        ----------
+        sample_size : int, optional
+            Number of values kept to estimate the quantiles.
+            The default is SAMPLE_SIZE.
+        seed : int, optional
+            Seed of the sampling. The default is None.
+
+        """
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.nonfinite = 0
+        self.sample = np.zeros(0, dtype=np.float32)
+
+    def update(self, values):
+        """Adds an array of values, NaN and Inf are only counted."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        finite = np.isfinite(values)
+        batch = BandAccumulator(self.sample_size)
+        batch.nonfinite = int(values.size - finite.sum())
+        values = values[finite]
+        if values.size:
+            batch.count = values.size
+            batch.mean = float(values.mean())
+            batch.m2 = float(((values - batch.mean) ** 2).sum())
+            batch.minimum = float(values.min())
+            batch.maximum = float(values.max())
+            if values.size > self.sample_size:
+                values = values[self.rng.integers(0, values.size,
+                                                  self.sample_size)]
+            batch.sample = values.astype(np.float32)
+        return self.merge(batch)
+
+    def merge(self, other):
+        """Merges the statistics of another accumulator into this one."""
+        self.nonfinite += other.nonfinite
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        size = min(self.sample_size, len(self.sample) + len(other.sample))
+        # Number of sampled values of each side in a uniform sample of both,
+        # binomial since the hypergeometric draw fails above 1e9 values
+        from_self = self.rng.binomial(size, self.count / count)
+        from_self = min(from_self, len(self.sample))
+        from_other = min(size - from_self, len(other.sample))
+        self.sample = np.concatenate([
+            self.rng.choice(self.sample, from_self, replace=False),
+            self.rng.choice(other.sample, from_other, replace=False)])
+        self.count = count
+        return self
+
+    def summary(self, quantiles=QUANTILES):
+        """Returns the json serializable statistics of the band."""
+        variance = self.m2 / self.count if self.count else 0.0
+        values = (np.quantile(self.sample, quantiles) if len(self.sample)
+                  else [np.nan] * len(quantiles))
+        return {'count': int(self.count),
+                'mean': float(self.mean),
+                'std': float(np.sqrt(variance)),
+                'min': float(self.minimum),
+                'max': float(self.maximum),
+                'nonfinite': int(self.nonfinite),
+                'quantiles': {str(q): float(v)
+                              for q, v in zip(quantiles, values)}}
+
+
+def decode_band(feature, shape, band_spec=None):
+    """Returns the float values of a tf.train.Feature as a numpy array."""
+    if band_spec is not None:
+        values = np.frombuffer(feature.bytes_list.value[0],
+                               dtype=ENCODINGS[band_spec['dtype']][0])
+        values = values.astype(np.float32) * band_spec['scale'] + \
+            band_spec['offset']
+    else:
+        values = np.array(feature.float_list.value, dtype=np.float32)
+    return values.reshape(shape)
+
+
+def file_band_stats(file, bands, quantization=None, max_records=None,
+                    sample_size=SAMPLE_SIZE):
+    """Accumulates the statistics of the bands of a GZIP TFRecord file.
+
+    Records are decoded with protobuf, without a TensorFlow graph, so that
+    files can be scanned by forked worker processes.
+
+    Parameters
+    ----------
+    file : str
+        GZIP TFRecord file
+    bands : list[str]
+        Bands to accumulate
+    quantization : dict, optional
+        Quantization of the file. The default is None.
+    max_records : int, optional
+        Number of records read. The default is None for all records.
+    sample_size : int, optional
+        Number of values kept per band for the quantiles.
+        The default is SAMPLE_SIZE.
+
+    Returns
+    -------
+    dict
+        BandAccumulator of each band
+
+    """
+    quantization = quantization or {}
+    accumulators = {band: BandAccumulator(sample_size) for band in bands}
+    pending = {band: [] for band in bands}
+
+    def flush():
+        for band, values in pending.items():
+            if values:
+                accumulators[band].update(np.concatenate(values))
+                values.clear()
+
+    for i, serialized in enumerate(iter_records(file)):
+        if max_records is not None and i >= max_records:
+            break
+        feature = example_pb2.Example.FromString(serialized).features.feature
+        for band in bands:
+            if band in feature:
+                pending[band].append(decode_band(feature[band], -1,
+                                                 quantization.get(band)))
+        if (i + 1) % RECORDS_PER_UPDATE == 0:
+            flush()
+    flush()
+    return accumulators
+
+
+def _file_band_stats(args):
+    return file_band_stats(*args)
+
+
+def accumulate_band_stats(files, bands, quantization=None, processes=None,
+                          max_records=None, sample_size=SAMPLE_SIZE):
+    """Scans files in parallel and returns the merged BandAccumulators.
+
+    Accumulators of the files are merged as soon as their file is done.
+    See compute_band_stats for the parameters.
+    """
+    merged = {band: BandAccumulator(sample_size) for band in bands}
+    processes = max(min(processes or os.cpu_count(), len(files)), 1)
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        for accumulators in pool.imap_unordered(
+                _file_band_stats, [(file, bands, quantization, max_records,
+                                    sample_size) for file in files]):
+            for band, accumulator in accumulators.items():
+                merged[band].merge(accumulator)
+    return merged
+
+
+def compute_band_stats(files, bands, quantization=None, processes=None,
+                       max_records=None, sample_size=SAMPLE_SIZE,
+                       quantiles=QUANTILES):
+    """Computes the per-band statistics of TFRecord files in one pass.
+
+    Parameters
+    ----------
+    files : list[str]
+        GZIP TFRecord files
+    bands : list[str]
+        Bands to compute the statistics of
+    quantization : dict, optional
+        Quantization of the files. The default is None.
+    processes : int, optional
+        Number of files scanned in parallel. The default is None for the
+        number of CPUs.
+    max_records : int, optional
+        Number of records read per file. The default is None for all.
+    sample_size : int, optional
+        Number of values kept per band for the quantiles.
+        The default is SAMPLE_SIZE.
+    quantiles : list[float], optional
+        Quantiles reported. The default is QUANTILES.
+
+    Returns
+    -------
+    dict
+        {"count", "mean", "std", "min", "max", "nonfinite", "quantiles"}
+        of each band found in the files
+
+    """
+    merged = accumulate_band_stats(files, bands, quantization, processes,
+                                   max_records, sample_size)
+    return {band: accumulator.summary(quantiles)
+            for band, accumulator in merged.items() if accumulator.count}
+
+
+def save_accumulators(accumulators, file):
+    """Saves the state of BandAccumulators to a .npz file."""
+    arrays = {}
+    for band, accumulator in accumulators.items():
+        arrays[band + '/moments'] = np.array(
+            [accumulator.count, accumulator.mean, accumulator.m2,
+             accumulator.minimum, accumulator.maximum,
+             accumulator.nonfinite], dtype=np.float64)
+        arrays[band + '/sample'] = accumulator.sample
+    np.savez(file, **arrays)
+
+
+def load_accumulators(file, sample_size=SAMPLE_SIZE):
+    """Loads the BandAccumulators saved by save_accumulators."""
+    arrays = np.load(file)
+    accumulators = {}
+    for key in arrays.files:
+        band, name = key.rsplit('/', 1)
+        if name != 'moments':
+            continue
+        accumulator = BandAccumulator(sample_size)
+        count, mean, m2, minimum, maximum, nonfinite = arrays[key]
+        accumulator.count, accumulator.nonfinite = int(count), int(nonfinite)
+        accumulator.mean, accumulator.m2 = float(mean), float(m2)
+        accumulator.minimum = float(minimum)
+        accumulator.maximum = float(maximum)
+        accumulator.sample = arrays[band + '/sample']
+        accumulators[band] = accumulator
+    return accumulators
+
+
+def save_band_stats(stats, path):
+    """Writes statistics to path/band_stats.json, read by load_band_stats."""
+    os.makedirs(path, exist_ok=True)
+    json.dump(stats, open(os.path.join(path, STATS_FILE), 'w'), indent=2)
+
+
+def load_band_stats(path):
+    """Returns the statistics of a folder or file, None if there are none."""
+    if os.path.isdir(path):
+        path = os.path.join(path, STATS_FILE)
+    if not os.path.exists(path):
+        return None
+    return json.load(open(path, 'r'))
+
+
+def normalization_constants(stats, bands, center=True):
+    """Returns the per-channel offsets and scales of a group of bands.
+
+    Bands without statistics or with a null deviation are left unchanged.
+    The u and v components of a wind are not centered and share the scale
+    of their pooled root mean square, so that normalization commutes with
+    the rotations and flips of batch_augmentation, which swap and negate
+    them.
+
+    Parameters
+    ----------
+    stats : dict
+        Statistics of load_band_stats
+    bands : list[str]
+        Stacked bands
+    center : bool, optional
+        Subtracts the mean if True, only scales otherwise.
+        The default is True.
+
+    Returns
+    -------
+    offsets : np.ndarray
+    scales : np.ndarray
+        float32 arrays such that normalized = (value - offsets) * scales
+
+    """
+    offsets = np.zeros(len(bands), dtype=np.float32)
+    scales = np.ones(len(bands), dtype=np.float32)
+    for i, band in enumerate(bands):
+        if band not in stats:
+            continue
+        if center:
+            offsets[i] = stats[band]['mean']
+        if stats[band]['std'] > 0:
+            scales[i] = 1 / stats[band]['std']
+    for u, v in wind_pairs(bands):
+        if bands[u] not in stats or bands[v] not in stats:
+            continue
+        offsets[[u, v]] = 0
+        mean_square = np.mean([stats[bands[i]]['std'] ** 2 +
+                               stats[bands[i]]['mean'] ** 2 for i in (u, v)])
+        scales[[u, v]] = 1 / np.sqrt(mean_square) if mean_square > 0 else 1
+    return offsets, scales
+
+
+def normalize_stacked(stacked, input_bands, output_bands, stats):
+    """Normalizes the stacked groups of stack_bands, batched or not.
+
+    Inputs are standardized, winds as in normalization_constants. Outputs
+    are only divided by their deviation so that their sign is kept,
+    predictions are multiplied back by the deviation of the outputs.
+
+    Parameters
+    ----------
+    stacked : tuple
+        One tensor per group of input bands, followed by the outputs
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs
+    output_bands : list[str]
+        Bands stacked as outputs
+    stats : dict
+        Statistics of load_band_stats
+
+    Returns
+    -------
+    tuple
+
+    """
+    normalized = []
+    for i, (tensor, bands) in enumerate(zip(stacked,
+                                            input_bands + [output_bands])):
+        offsets, scales = normalization_constants(
+            stats, bands, center=i < len(input_bands))
+        normalized.append((tensor - tf.constant(offsets)) *
+                          tf.constant(scales))
+    return tuple(normalized)
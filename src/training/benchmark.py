@@ -0,0 +1,210 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers
+
+from training.schema import is_patch_feature
+from training.architectures import count_flops, measure_latency
+from training.load_data import (project_features, stack_bands,
+                                measure_throughput, batch_augmentation,
+                                merge_features_without_date)
+
+
+def write_synthetic_tfrecords(path, features_dict, num_files=4,
+                              records_per_file=16, seed=0):
+    """Writes GZIP TFRecord files of random records with the given features.
+
+    Patch values are normal, scalar values are uniform in [0, 24) so that
+    they are valid date bands.
+
+    Parameters
+    ----------
+    path : str
+        Folder of the files
+    features_dict : dict
+        Features of the records
+    num_files : int, optional
+        Number of files. The default is 4.
+    records_per_file : int, optional
+        Number of records per file. The default is 16.
+    seed : int, optional
+        Seed of the values. The default is 0.
+
+    Returns
+    -------
+    list[str]
+        Paths of the files
+
+    """
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    files = []
+    for i in range(num_files):
+        file = os.path.join(path, 'synthetic_%i.tfrecord.gz' % i)
+        with tf.io.TFRecordWriter(file, options='GZIP') as writer:
+            for _ in range(records_per_file):
+                feature = {}
+                for band, band_feature in features_dict.items():
+                    size = int(np.prod(band_feature.shape))
+                    if is_patch_feature(band_feature):
+                        values = rng.normal(size=size)
+                    else:
+                        values = rng.uniform(0, 24, size=size)
+                    feature[band] = tf.train.Feature(
+                        float_list=tf.train.FloatList(value=values))
+                example = tf.train.Example(
+                    features=tf.train.Features(feature=feature))
+                writer.write(example.SerializeToString())
+        files.append(file)
+    return files
+
+
+def pipeline_stages(files, features_dict, input_bands, output_bands,
+                    batch_size):
+    """Returns the datasets of the successive stages of the input pipeline.
+
+    Every stage adds one step to the previous one, in the order of
+    load_batched_tfrecords: records are batched before being parsed. The
+    last group of input_bands is the date group dropped by the merge.
+
+    Parameters
+    ----------
+    files : list[str]
+        GZIP TFRecord files
+    features_dict : dict
+        Features of the TFRecords
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs, date bands last
+    output_bands : list[str]
+        Bands stacked as outputs
+    batch_size : int
+        Number of records per batch
+
+    Returns
+    -------
+    list[tuple]
+        (stage, repeated dataset, records per element) in pipeline order
+
+    """
+    autotune = tf.data.experimental.AUTOTUNE
+    features_dict = project_features(features_dict, input_bands, output_bands)
+    merged_bands = [[band for bands in input_bands[:-1] for band in bands]]
+    records_per_file = int(tf.data.TFRecordDataset(
+        files[:1], compression_type='GZIP').reduce(0, lambda n, _: n + 1))
+
+    read = tf.data.Dataset.from_tensor_slices(files).repeat()
+    read = read.map(tf.io.read_file, num_parallel_calls=autotune)
+    decompressed = tf.data.TFRecordDataset(files, compression_type='GZIP')
+    decompressed = decompressed.repeat()
+    batched = decompressed.batch(batch_size)
+    parsed = batched.map(lambda x: tf.io.parse_example(x, features_dict),
+                         num_parallel_calls=autotune)
+    stacked = parsed.map(lambda inputs: stack_bands(inputs, input_bands,
+                                                    output_bands),
+                         num_parallel_calls=autotune)
+    merged = stacked.map(merge_features_without_date,
+                         num_parallel_calls=autotune)
+    augmented = merged.map(batch_augmentation(merged_bands),
+                           num_parallel_calls=autotune)
+    return [('read', read, records_per_file),
+            ('decompress', decompressed, 1),
+            ('batch', batched, batch_size),
+            ('parse', parsed, batch_size),
+            ('stack', stacked, batch_size),
+            ('merge', merged, batch_size),
+            ('augment', augmented.prefetch(autotune), batch_size)]
+
+
+def benchmark_pipeline(files, features_dict, input_bands, output_bands,
+                       batch_size, num_batches=20):
+    """Measures the records per second after each stage of the pipeline.
+
+    Parameters
+    ----------
+    files : list[str]
+        GZIP TFRecord files
+    features_dict : dict
+        Features of the TFRecords
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs, date bands last
+    output_bands : list[str]
+        Bands stacked as outputs
+    batch_size : int
+        Number of records per batch
+    num_batches : int, optional
+        Number of batches of records measured per stage.
+        The default is 20.
+
+    Returns
+    -------
+    dict
+        Records per second of each stage
+
+    """
+    report = {}
+    num_records = num_batches * batch_size
+    for stage, dataset, records_per_element in pipeline_stages(
+            files, features_dict, input_bands, output_bands, batch_size):
+        num_elements = max(num_records // records_per_element, 1)
+        report[stage] = measure_throughput(dataset, num_elements,
+                                           records_per_element)
+    return report
+
+
+def benchmark_train_step(build_model, inputs, output, num_steps=10):
+    """Measures the time of a training step of a model on a batch.
+
+    Parameters
+    ----------
+    build_model : function
+        Takes the Input layers and returns an uncompiled model
+    inputs : list[tf.Tensor]
+        Batched input groups
+    output : tf.Tensor
+        Batched outputs
+    num_steps : int, optional
+        Number of steps measured after a warm up step. The default is 10.
+
+    Returns
+    -------
+    dict
+        "params", "flops" per record, "seconds_per_step",
+        "records_per_second" and "inference_seconds" per batch, or the
+        "error" raised while building, training or timing the model
+
+    """
+    try:
+        model = build_model([layers.Input(shape=x.shape[1:]) for x in inputs])
+        model.compile(optimizer='RMSprop', loss='MeanSquaredError')
+        model.train_on_batch(inputs, output)
+        start = time.time()
+        for _ in range(num_steps):
+            model.train_on_batch(inputs, output)
+        seconds = (time.time() - start) / num_steps
+        return {'params': int(model.count_params()),
+                'flops': count_flops(model),
+                'seconds_per_step': seconds,
+                'records_per_second': int(output.shape[0]) / seconds,
+                'inference_seconds': measure_latency(
+                    model, int(output.shape[0]), num_steps)}
+    except Exception as error:  # pylint: disable=broad-except
+        # A failing model is reported, the other models are still measured
+        message = (str(error).splitlines() or [''])[0]
+        return {'error': '%s: %s' % (type(error).__name__, message)}
@@ -0,0 +1,107 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import tensorflow as tf
+from tensorflow.keras import callbacks
+
+
+def checkpoint_options():
+    """Returns options writing checkpoints in a background thread.
+
+    Checkpoints are written synchronously by TensorFlow versions without
+    asynchronous checkpoints.
+    """
+    try:
+        return tf.train.CheckpointOptions(enable_async=True)
+    except TypeError:
+        return tf.train.CheckpointOptions()
+
+
+class TrainingCheckpoint:
+    """Weights, optimizer state and epoch of a training, saved and resumed."""
+
+    def __init__(self, checkpoint_path, model, optimizer, max_to_keep=3,
+                 save_every=1, keep_every_hours=None):
+        """Initializes the TrainingCheckpoint.
+
+        Parameters
+        ----------
+        checkpoint_path : str
+            Folder of the checkpoints
+        model : Model
+            Trained model
+        optimizer : Optimizer
+            Optimizer of the model
+        max_to_keep : int, optional
+            Number of most recent checkpoints kept. The default is 3.
+        save_every : int, optional
+            Number of epochs between checkpoints. The default is 1.
+        keep_every_hours : float, optional
+            Also keeps one checkpoint every keep_every_hours hours.
+            The default is None.
+
+        """
+        self.save_every = save_every
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=optimizer,
+                                              epoch=self.epoch)
+        self.manager = tf.train.CheckpointManager(
+            self.checkpoint, checkpoint_path, max_to_keep,
+            keep_checkpoint_every_n_hours=keep_every_hours)
+        self.options = checkpoint_options()
+
+    def restore(self):
+        """Restores the latest checkpoint, if any.
+
+        Optimizer slots are restored when they are created by the first
+        training step.
+
+        Returns
+        -------
+        int
+            Number of epochs already trained, 0 without checkpoint
+
+        """
+        if self.manager.latest_checkpoint:
+            self.checkpoint.restore(self.manager.latest_checkpoint)
+            print("Resuming from %s" % self.manager.latest_checkpoint)
+        return int(self.epoch.numpy())
+
+    def save(self, epoch):
+        """Starts writing a checkpoint after epoch epochs, returns its path."""
+        self.epoch.assign(epoch)
+        return self.manager.save(checkpoint_number=epoch,
+                                 options=self.options)
+
+    def sync(self):
+        """Waits for the checkpoints being written."""
+        if hasattr(self.checkpoint, 'sync'):
+            self.checkpoint.sync()
+
+    def callback(self):
+        """Returns a Keras callback saving every save_every epochs."""
+        checkpoint = self
+
+        class SaveCallback(callbacks.Callback):
+
+            def on_epoch_end(self, epoch, logs=None):
+                if (epoch + 1) % checkpoint.save_every == 0:
+                    checkpoint.save(epoch + 1)
+
+            def on_train_end(self, logs=None):
+                checkpoint.sync()
+
+        return SaveCallback()
@@ -14,14 +14,14 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from tensorflow.python.keras import layers
-from tensorflow.python.keras import models
+from tensorflow.keras import layers
+from tensorflow.keras import models
 
 from training.conv_blocks import conv_block
 
 
 
-def get_cnn_model(inputs):
+def get_cnn_model(inputs, normalize_input=True, global_pooling=False):
     """.
     
 
@@ -29,6 +29,13 @@ def get_cnn_model(inputs):
     ----------
     inputs : TYPE
         DESCRIPTION.
+    normalize_input : bool, optional
+        Adds a BatchNormalization on the inputs, False when the loader
+        normalizes them with band statistics. The default is True.
+    global_pooling : bool, optional
+        Pools with 'same' padding and averages the remaining positions, so
+        that patches of any size, e.g. center crops, give a 1x1 output.
+        The default is False for 257x257 patches only.
 
     Returns
     -------
@@ -36,15 +43,21 @@ def get_cnn_model(inputs):
         DESCRIPTION.
 
     """
-    normalized_input = layers.BatchNormalization()(inputs)  # 257x257x?
-    conv1 = conv_block(normalized_input, 32)  # 128x128x32
-    conv2 = conv_block(conv1, 64)  # 64x64x64
-    conv3 = conv_block(conv2, 128)  # 32x32x128
-    conv4 = conv_block(conv3, 256)  # 16x16x256
-    conv5 = conv_block(conv4, 256)  # 8x8x256
-    conv6 = conv_block(conv5, 64)  # 4x4x64
-    conv7 = conv_block(conv6, 32)  # 2x2x32
-    output = conv_block(conv7, 1)  # 1x1x1
+    normalized_input = inputs
+    if normalize_input:
+        normalized_input = layers.BatchNormalization()(inputs)  # 257x257x?
+    padding = 'same' if global_pooling else 'valid'
+    conv1 = conv_block(normalized_input, 32, pool_padding=padding)  # 128x128x32
+    conv2 = conv_block(conv1, 64, pool_padding=padding)  # 64x64x64
+    conv3 = conv_block(conv2, 128, pool_padding=padding)  # 32x32x128
+    conv4 = conv_block(conv3, 256, pool_padding=padding)  # 16x16x256
+    conv5 = conv_block(conv4, 256, pool_padding=padding)  # 8x8x256
+    conv6 = conv_block(conv5, 64, pool_padding=padding)  # 4x4x64
+    conv7 = conv_block(conv6, 32, pool_padding=padding)  # 2x2x32
+    output = conv_block(conv7, 1, pool_padding=padding)  # 1x1x1
+    if global_pooling:
+        output = layers.GlobalAveragePooling2D()(output)
+        output = layers.Reshape((1, 1, 1))(output)
     model = models.Model(inputs=[inputs], outputs=[output])
 
     return model
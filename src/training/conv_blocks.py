@@ -15,15 +15,15 @@ limitations under the License.
 '''
 
 
-from tensorflow.python.keras import layers
-from tensorflow.python.keras import losses
-from tensorflow.python.keras import models
-from tensorflow.python.keras import metrics
-from tensorflow.python.keras import optimizers
+from tensorflow.keras import layers
+from tensorflow.keras import losses
+from tensorflow.keras import models
+from tensorflow.keras import metrics
+from tensorflow.keras import optimizers
 
 
 def conv_block(input_tensor, num_filters, kernel_size=(3, 3), normalize=True,
-               activation='tanh'):
+               activation='tanh', pool_padding='valid'):
     conv1 = layers.Conv2D(num_filters, kernel_size,
                           padding='same')(input_tensor)
     conv1 = layers.BatchNormalization()(conv1)
@@ -31,18 +31,21 @@ def conv_block(input_tensor, num_filters, kernel_size=(3, 3), normalize=True,
     conv2 = layers.Conv2D(num_filters, kernel_size, padding='same')(conv1)
     conv2 = layers.BatchNormalization()(conv2)
     conv2 = layers.Activation(activation)(conv2)
-    pooled = layers.MaxPooling2D((2, 2), strides=(2, 2))(conv2)
+    pooled = layers.MaxPooling2D((2, 2), strides=(2, 2),
+                                 padding=pool_padding)(conv2)
     return pooled
 
 def spectral_block(spectral_input):
     normalized_input = layers.BatchNormalization()(spectral_input)  # 257x257x5
-    conv1 = conv_block(normalized_input, 32) # 128x128x32
-    conv2 = encoder_pool(conv1, 64) # 64x64x64
-    conv3 = encoder_pool(conv2, 128) # 32x32x128
-    encoder3 = encoder_pool(encoder2, 256) # 16x16x256
-    encoder4 = encoder_pool(encoder3, 256) # 8x8x256
-    encoder5 = encoder_pool(encoder4, 128) # 4x4x128
-    encoder6 = encoder_pool(encoder5, 64) # 2x2x64
-    encoder7 = encoder_pool(encoder6, 32) # 1x1x32
-    conv1 = conv_block(encoder7, 16, (1,1)) # 1x1x16
-    conv2 = conv_block(conv1, 1,(1,1)) # 1x1x1
\ No newline at end of file
+    conv1 = conv_block(normalized_input, 32)  # 128x128x32
+    conv2 = conv_block(conv1, 64)  # 64x64x64
+    conv3 = conv_block(conv2, 128)  # 32x32x128
+    conv4 = conv_block(conv3, 256)  # 16x16x256
+    conv5 = conv_block(conv4, 256)  # 8x8x256
+    conv6 = conv_block(conv5, 128)  # 4x4x128
+    conv7 = conv_block(conv6, 64)  # 2x2x64
+    conv8 = conv_block(conv7, 32)  # 1x1x32
+    # conv_block pools, the 1x1 features are only mixed by 1x1 convolutions
+    conv9 = layers.Conv2D(16, (1, 1), activation='tanh')(conv8)  # 1x1x16
+    output = layers.Conv2D(1, (1, 1))(conv9)  # 1x1x1
+    return output
@@ -0,0 +1,134 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import tensorflow as tf
+
+
+def file_fingerprint(file):
+    """Returns the path, size and modification time of a file."""
+    stat = os.stat(file)
+    return [os.path.abspath(file), stat.st_size, int(stat.st_mtime)]
+
+
+def dataset_fingerprint(files, features_dict, input_bands, output_bands,
+                        **extra):
+    """Returns a fingerprint of the source files and of the decoding.
+
+    The fingerprint changes if a source file is added, removed or rewritten,
+    or if the decoded bands, their shapes or any extra parameter change.
+
+    Parameters
+    ----------
+    files : list[str]
+        Source TFRecord files
+    features_dict : dict
+        Decoded features
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs
+    output_bands : list[str]
+        Bands stacked as outputs
+    **extra :
+        Other json serializable parameters of the decoding
+
+    Returns
+    -------
+    str
+        Hexadecimal fingerprint
+
+    """
+    description = {
+        'files': sorted(file_fingerprint(file) for file in files),
+        'features': {band: [feature.dtype.name, list(feature.shape)]
+                     for band, feature in features_dict.items()},
+        'input_bands': input_bands,
+        'output_bands': output_bands,
+        'extra': extra}
+    encoded = json.dumps(description, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+
+def evict_stale_caches(cache_path, keep=(), max_age_days=7):
+    """Removes the caches of cache_path which were not used recently.
+
+    Parameters
+    ----------
+    cache_path : str
+        Folder of the caches
+    keep : list[str], optional
+        Fingerprints of the caches kept whatever their age.
+        The default is ().
+    max_age_days : float, optional
+        Caches unused for longer are removed. The default is 7.
+
+    Returns
+    -------
+    list[str]
+        Removed folders
+
+    """
+    cutoff = time.time() - max_age_days * 24 * 3600
+    removed = []
+    for name in sorted(os.listdir(cache_path)):
+        folder = os.path.join(cache_path, name)
+        if name in keep or not os.path.isdir(folder):
+            continue
+        if os.path.getmtime(folder) < cutoff:
+            shutil.rmtree(folder, ignore_errors=True)
+            removed.append(folder)
+    return removed
+
+
+def cache_dataset(dataset, cache_path, fingerprint, max_age_days=7):
+    """Caches the decoded elements of a dataset on the local disk.
+
+    The first full pass writes uncompressed shards to
+    cache_path/fingerprint, following passes and later runs with the same
+    fingerprint read the shards instead of running the upstream pipeline.
+    Caches of other fingerprints unused for max_age_days are removed, as
+    they are left behind whenever the files or the decoding change.
+
+    Parameters
+    ----------
+    dataset : tf.data.Dataset
+        Decoded dataset
+    cache_path : str
+        Folder of the caches
+    fingerprint : str
+        Fingerprint of the dataset, see dataset_fingerprint
+    max_age_days : float, optional
+        Age of the stale caches removed, None keeps them.
+        The default is 7.
+
+    Returns
+    -------
+    tf.data.Dataset
+
+    """
+    snapshot_path = os.path.join(cache_path, fingerprint)
+    os.makedirs(snapshot_path, exist_ok=True)
+    # The modification time of a cache is the time it was last used
+    os.utime(snapshot_path)
+    if max_age_days is not None:
+        for folder in evict_stale_caches(cache_path, [fingerprint],
+                                         max_age_days):
+            print("Removed the stale dataset cache %s" % folder)
+    return dataset.apply(tf.data.experimental.snapshot(snapshot_path,
+                                                       compression=None))
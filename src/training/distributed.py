@@ -0,0 +1,157 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from tensorflow.keras import callbacks
+
+from training.validation import balance_shards
+
+
+def worker_config():
+    """Returns the number of workers and the index of this one in TF_CONFIG.
+
+    Returns
+    -------
+    num_workers : int
+        1 without TF_CONFIG
+    worker_index : int
+
+    """
+    config = json.loads(os.environ.get('TF_CONFIG', '{}'))
+    workers = config.get('cluster', {}).get('worker', [])
+    if not workers:
+        return 1, 0
+    task = config.get('task', {})
+    assert task.get('type', 'worker') == 'worker', \
+        "Only worker tasks are supported"
+    return len(workers), int(task.get('index', 0))
+
+
+def local_cluster(num_workers, base_port=12345):
+    """Returns the TF_CONFIG of each worker of a cluster on localhost."""
+    workers = ['localhost:%i' % (base_port + i) for i in range(num_workers)]
+    return [json.dumps({'cluster': {'worker': workers},
+                        'task': {'type': 'worker', 'index': i}})
+            for i in range(num_workers)]
+
+
+def launch_local_workers(argv, num_workers, base_port=12345):
+    """Runs a training script as the workers of a cluster on localhost.
+
+    Each worker runs on the CPU with its share of the threads.
+
+    Parameters
+    ----------
+    argv : list[str]
+        Script and arguments of the workers
+    num_workers : int
+        Number of worker processes
+    base_port : int, optional
+        Port of the first worker, the others follow. The default is 12345.
+
+    Returns
+    -------
+    list[int]
+        Return code of each worker
+
+    """
+    threads = str(max((os.cpu_count() or 1) // num_workers, 1))
+    processes = []
+    for config in local_cluster(num_workers, base_port):
+        env = dict(os.environ, TF_CONFIG=config, CUDA_VISIBLE_DEVICES='-1',
+                   TF_NUM_INTRAOP_THREADS=threads,
+                   TF_NUM_INTEROP_THREADS='2')
+        processes.append(subprocess.Popen([sys.executable] + list(argv),
+                                          env=env))
+    return [process.wait() for process in processes]
+
+
+def worker_files(files, num_workers, worker_index, manifest=None):
+    """Returns the training files of a worker.
+
+    Parameters
+    ----------
+    files : list[str]
+        Training files, in the same order on every worker
+    num_workers : int
+    worker_index : int
+    manifest : dict, optional
+        Manifest of validate_tfrecords, the valid files are then balanced
+        by number of records with balance_shards. The default is None to
+        deal the files in turn.
+
+    Returns
+    -------
+    list[str]
+
+    """
+    if num_workers == 1:
+        return list(files)
+    if manifest is not None:
+        selected = set(os.path.abspath(file) for file in files)
+        manifest = dict(manifest, shards=[
+            entry for entry in manifest['shards']
+            if os.path.abspath(entry['file']) in selected])
+        return balance_shards(manifest, num_workers)[worker_index]
+    assert len(files) >= num_workers, "Fewer files than workers"
+    return list(files[worker_index::num_workers])
+
+
+def worker_path(path, worker_index):
+    """Returns the folder a worker writes to, path for the chief worker.
+
+    Every worker saves the checkpoints and models with the collective
+    operations of the strategy, only the ones of the chief are kept in
+    path.
+    """
+    if worker_index == 0:
+        return path
+    return os.path.join(path, 'workers', 'worker_%i' % worker_index)
+
+
+class StepTimeCallback(callbacks.Callback):
+    """Adds the mean and p90 training step time of the worker to the logs."""
+
+    def __init__(self, worker_index=0):
+        super().__init__()
+        self.worker_index = worker_index
+        self.start = None
+        self.step_seconds = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.step_seconds = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.start = time.time()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step_seconds.append(time.time() - self.start)
+
+    def on_epoch_end(self, epoch, logs=None):
+        if not self.step_seconds:
+            return
+        mean = float(np.mean(self.step_seconds))
+        p90 = float(np.percentile(self.step_seconds, 90))
+        if logs is not None:
+            logs['step_seconds'] = mean
+            logs['p90_step_seconds'] = p90
+        print("Worker %i epoch %i: %.1f ms/step, p90 %.1f ms" % (
+            self.worker_index, epoch + 1, mean * 1000, p90 * 1000))
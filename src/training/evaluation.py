@@ -0,0 +1,257 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import time
+import numpy as np
+import tensorflow as tf
+
+from training.schema import DATE_BANDS, ROAD_BANDS, OUTPUT_BANDS
+from training.load_data import load_batched_tfrecords, load_indexed_tfrecords
+
+# Slices of the errors, in report order
+SLICES = ['hour', 'month', 'latitude', 'road_density']
+
+
+class ErrorAccumulator:
+    """Mergeable sums of the errors of predictions."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.sum_abs = 0.0
+        self.sum_squares = 0.0
+
+    def update(self, errors):
+        """Adds prediction - output errors, returns the accumulator."""
+        errors = np.asarray(errors, dtype=np.float64).ravel()
+        self.count += errors.size
+        self.sum += errors.sum()
+        self.sum_abs += np.abs(errors).sum()
+        self.sum_squares += np.square(errors).sum()
+        return self
+
+    def merge(self, other):
+        """Adds the errors of another accumulator, returns the accumulator."""
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_abs += other.sum_abs
+        self.sum_squares += other.sum_squares
+        return self
+
+    def summary(self):
+        """Returns the count, RMSE, MAE and bias of the errors."""
+        if not self.count:
+            return {'count': 0}
+        return {'count': int(self.count),
+                'rmse': float(np.sqrt(self.sum_squares / self.count)),
+                'mae': float(self.sum_abs / self.count),
+                'bias': float(self.sum / self.count)}
+
+
+def slice_labels(dates, road_density, latitude_band=5.0, road_edges=None):
+    """Returns the bin of every record of a batch in each slice.
+
+    Parameters
+    ----------
+    dates : np.ndarray
+        Bx6 values of DATE_BANDS
+    road_density : np.ndarray
+        Mean of the road band over each patch
+    latitude_band : float, optional
+        Degrees of latitude per bin. The default is 5.0.
+    road_edges : list[float], optional
+        Increasing edges of the road density bins, no road density slice
+        if None. The default is None.
+
+    Returns
+    -------
+    dict
+        Slice name -> list of bin labels
+
+    """
+    labels = {}
+    hours = dates[:, DATE_BANDS.index('HOD')]
+    months = dates[:, DATE_BANDS.index('MOY')]
+    latitudes = dates[:, DATE_BANDS.index('latitude')]
+    labels['hour'] = ['%02d' % hour for hour in hours]
+    labels['month'] = ['%02d' % month for month in months]
+    labels['latitude'] = ['%+.1f' % (np.floor(latitude / latitude_band) *
+                                     latitude_band)
+                          for latitude in latitudes]
+    if road_edges is not None:
+        bins = np.digitize(road_density, road_edges)
+        bounds = [-np.inf] + list(road_edges) + [np.inf]
+        labels['road_density'] = ['[%g, %g)' % (bounds[i], bounds[i + 1])
+                                  for i in bins]
+    return labels
+
+
+class SlicedErrors:
+    """Errors of all the records and of the bins of each slice."""
+
+    def __init__(self):
+        self.overall = ErrorAccumulator()
+        self.slices = {}
+
+    def update(self, errors, labels):
+        """Adds the errors of a batch and the slice labels of its records."""
+        errors = np.ravel(errors)
+        self.overall.update(errors)
+        for name, names in labels.items():
+            bins = self.slices.setdefault(name, {})
+            names = np.asarray(names)
+            for label in np.unique(names):
+                bins.setdefault(label, ErrorAccumulator()).update(
+                    errors[names == label])
+        return self
+
+    def merge(self, other):
+        """Adds the errors of another SlicedErrors."""
+        self.overall.merge(other.overall)
+        for name, bins in other.slices.items():
+            for label, accumulator in bins.items():
+                self.slices.setdefault(name, {}).setdefault(
+                    label, ErrorAccumulator()).merge(accumulator)
+        return self
+
+    def report(self):
+        """Returns the summaries of all the records and of every bin."""
+        return {'overall': self.overall.summary(),
+                'slices': {name: {label: self.slices[name][label].summary()
+                                  for label in sorted(self.slices[name])}
+                           for name in SLICES if name in self.slices}}
+
+
+def road_edges_from_stats(stats, quantiles=('0.25', '0.5', '0.75')):
+    """Returns road density edges at quantiles of load_band_stats."""
+    return [stats[ROAD_BANDS[0]]['quantiles'][q] for q in quantiles]
+
+
+def evaluate_model(model, files, features_dict, model_bands, batch_size=256,
+                   static_cache=None, quantization=None, offsets=None,
+                   scales=None, output_scale=1.0, latitude_band=5.0,
+                   road_edges=None, max_batches=None, index=None,
+                   record_ids=None):
+    """Streams evaluation files once and accumulates the sliced errors.
+
+    Records are parsed in large batches by load_batched_tfrecords with the
+    date and road bands stacked as extra groups, so the predictions and
+    their slices come from the same pass.
+
+    Parameters
+    ----------
+    model : Model
+        Single input model
+    files : list[str]
+        GZIP TFRecord files, unused when index is given
+    features_dict : dict
+        Features of the TFRecords
+    model_bands : list[str]
+        Stacked bands of the model input
+    batch_size : int, optional
+        Number of records per batch. The default is 256.
+    static_cache : StaticLayerCache, optional
+        Cache of the static bands missing from the records.
+        The default is None.
+    quantization : dict, optional
+        Quantization of the records. The default is None.
+    offsets : np.ndarray, optional
+        Band offsets of normalization_constants. The default is None.
+    scales : np.ndarray, optional
+        Band scales of normalization_constants. The default is None.
+    output_scale : float, optional
+        Predictions are divided by it to be in NO2 units, e.g. the 10000
+        of scale_no2. The default is 1.0.
+    latitude_band : float, optional
+        Degrees of latitude per bin. The default is 5.0.
+    road_edges : list[float], optional
+        Edges of the road density bins. The default is None.
+    max_batches : int, optional
+        Stops after max_batches batches. The default is None for all.
+    index : RecordIndex, optional
+        Index the records are read through instead of files, for the
+        blocks of a spatial or temporal split. The default is None.
+    record_ids : np.ndarray, optional
+        Ids of the evaluated records of index. The default is None for all.
+
+    Returns
+    -------
+    sliced : SlicedErrors
+    seconds : float
+
+    """
+    start = time.time()
+    input_bands = [model_bands, DATE_BANDS, ROAD_BANDS]
+    if index is not None:
+        dataset = load_indexed_tfrecords(
+            index, features_dict, input_bands, OUTPUT_BANDS, batch_size,
+            record_ids=record_ids, shuffle=False, static_cache=static_cache,
+            quantization=quantization)
+    else:
+        dataset = load_batched_tfrecords(
+            files, features_dict, input_bands, OUTPUT_BANDS, batch_size,
+            static_cache=static_cache, quantization=quantization)
+    if max_batches:
+        dataset = dataset.take(max_batches)
+    if offsets is None:
+        offsets = np.zeros(len(model_bands), np.float32)
+        scales = np.ones(len(model_bands), np.float32)
+
+    @tf.function(input_signature=[tf.TensorSpec(
+        [None, None, None, len(model_bands)], tf.float32)])
+    def predict(inputs):
+        return model((inputs - offsets) * scales, training=False)
+
+    sliced = SlicedErrors()
+    for inputs, dates, road, output in dataset:
+        predictions = predict(inputs).numpy() / output_scale
+        labels = slice_labels(np.reshape(dates.numpy(), [-1, len(DATE_BANDS)]),
+                              road.numpy().mean(axis=(1, 2, 3)),
+                              latitude_band, road_edges)
+        sliced.update(np.ravel(predictions) - np.ravel(output.numpy()),
+                      labels)
+    return sliced, time.time() - start
+
+
+def compare_reports(reports, metric='rmse'):
+    """Returns a table of a metric of several reports, bin by bin.
+
+    Parameters
+    ----------
+    reports : dict
+        Name of each report -> report of SlicedErrors.report
+    metric : str, optional
+        Compared metric. The default is 'rmse'.
+
+    Returns
+    -------
+    list[list]
+        Header row, then one row per bin: slice, bin and the metric of
+        each report, None if the bin is missing from a report
+
+    """
+    names = list(reports)
+    rows = [['slice', 'bin'] + names,
+            ['overall', ''] + [reports[name]['overall'].get(metric)
+                               for name in names]]
+    for slice_name in SLICES:
+        labels = sorted(set(label for name in names for label in
+                            reports[name]['slices'].get(slice_name, {})))
+        for label in labels:
+            rows.append([slice_name, label] + [
+                reports[name]['slices'].get(slice_name, {}).get(
+                    label, {}).get(metric) for name in names])
+    return rows
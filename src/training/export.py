@@ -0,0 +1,208 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import time
+import numpy as np
+import tensorflow as tf
+
+# Post-training quantization modes of convert_tflite
+QUANTIZATION_MODES = ['none', 'float16', 'dynamic', 'int8']
+
+
+def representative_dataset(dataset, num_records):
+    """Returns a calibration generator of the inputs of a dataset.
+
+    Parameters
+    ----------
+    dataset : tf.data.Dataset
+        Batched (inputs, output) elements of a single input model
+    num_records : int
+        Number of records yielded one at a time
+
+    Returns
+    -------
+    function
+
+    """
+    def generate():
+        count = 0
+        for inputs, _ in dataset:
+            for record in inputs.numpy():
+                if count == num_records:
+                    return
+                count += 1
+                yield [record[np.newaxis].astype(np.float32)]
+    return generate
+
+
+def convert_tflite(model, patch_size, mode='dynamic', calibration=None):
+    """Converts a single input model to TFLite for patches of a size.
+
+    Inputs and outputs stay float32 so the artifact is a drop-in
+    replacement of the Keras model, int8 models quantize and dequantize
+    them in the graph.
+
+    Parameters
+    ----------
+    model : Model
+        Single input model
+    patch_size : int
+        Height and width of the patches
+    mode : str, optional
+        One of QUANTIZATION_MODES: 'dynamic' quantizes the weights to int8,
+        'int8' the weights and the activations, calibrated on calibration.
+        The default is 'dynamic'.
+    calibration : function, optional
+        Generator of representative_dataset, needed by 'int8'.
+        The default is None.
+
+    Returns
+    -------
+    bytes
+        Content of the .tflite file
+
+    """
+    assert mode in QUANTIZATION_MODES, \
+        "The mode should be in %s" % QUANTIZATION_MODES
+    assert mode != 'int8' or calibration is not None, \
+        "int8 quantization needs calibration records"
+    predict = tf.function(
+        lambda inputs: model(inputs, training=False),
+        input_signature=[tf.TensorSpec(
+            [None, patch_size, patch_size, model.input_shape[-1]],
+            tf.float32)])
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [predict.get_concrete_function()], model)
+    if mode != 'none':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        converter.representative_dataset = calibration
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+class TFLiteModel:
+    """Predicts batches of any size with a TFLite interpreter."""
+
+    def __init__(self, model_content, num_threads=None):
+        """Initializes the TFLiteModel.
+
+        Parameters
+        ----------
+        model_content : bytes
+            Content of a .tflite file of convert_tflite
+        num_threads : int, optional
+            Number of CPU threads of the interpreter. The default is None.
+
+        """
+        self.interpreter = tf.lite.Interpreter(model_content=model_content,
+                                               num_threads=num_threads)
+        self.input = self.interpreter.get_input_details()[0]['index']
+        self.output = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+
+    def predict_on_batch(self, inputs):
+        """Returns the predictions of a float32 batch of patches."""
+        inputs = np.asarray(inputs, dtype=np.float32)
+        if inputs.shape[0] != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input, inputs.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = inputs.shape[0]
+        self.interpreter.set_tensor(self.input, inputs)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output)
+
+
+def prediction_drift(model, tflite_model, dataset, num_batches,
+                     output_scale=1.0):
+    """Compares the predictions of a converted model to the float ones.
+
+    Parameters
+    ----------
+    model : Model
+        Float model
+    tflite_model : TFLiteModel
+        Converted model
+    dataset : tf.data.Dataset
+        Batched (inputs, output) elements
+    num_batches : int
+        Number of compared batches
+    output_scale : float, optional
+        Predictions and outputs are divided by it to be reported in NO2
+        units. The default is 1.0.
+
+    Returns
+    -------
+    dict
+        "records", "max_abs_drift", "rmse_drift" between the predictions,
+        "float_rmse" and "tflite_rmse" against the outputs
+
+    """
+    float_predictions, tflite_predictions, outputs = [], [], []
+    for inputs, output in dataset.take(num_batches):
+        float_predictions.append(np.ravel(model.predict_on_batch(inputs)))
+        tflite_predictions.append(np.ravel(
+            tflite_model.predict_on_batch(inputs.numpy())))
+        outputs.append(np.ravel(output.numpy()))
+    float_predictions = np.concatenate(float_predictions) / output_scale
+    tflite_predictions = np.concatenate(tflite_predictions) / output_scale
+    outputs = np.concatenate(outputs) / output_scale
+    drift = tflite_predictions - float_predictions
+    return {'records': int(outputs.size),
+            'max_abs_drift': float(np.abs(drift).max()),
+            'rmse_drift': float(np.sqrt(np.mean(drift ** 2))),
+            'float_rmse': float(np.sqrt(np.mean(
+                (float_predictions - outputs) ** 2))),
+            'tflite_rmse': float(np.sqrt(np.mean(
+                (tflite_predictions - outputs) ** 2)))}
+
+
+def benchmark_batch_sizes(predict, input_shape, batch_sizes=(1, 8, 32),
+                          num_runs=10):
+    """Measures the latency and throughput of a model per batch size.
+
+    Parameters
+    ----------
+    predict : function
+        predict_on_batch of a Keras model or of a TFLiteModel
+    input_shape : list[int]
+        Shape of a record, HxWxC
+    batch_sizes : list[int], optional
+        Measured batch sizes. The default is (1, 8, 32).
+    num_runs : int, optional
+        Number of batches measured after a warm up one. The default is 10.
+
+    Returns
+    -------
+    dict
+        "latency_seconds" and "records_per_second" per batch size
+
+    """
+    report = {}
+    for batch_size in batch_sizes:
+        batch = np.random.normal(size=[batch_size] + list(input_shape)).astype(
+            np.float32)
+        predict(batch)
+        start = time.time()
+        for _ in range(num_runs):
+            predict(batch)
+        seconds = (time.time() - start) / num_runs
+        report[batch_size] = {'latency_seconds': seconds,
+                              'records_per_second': batch_size / seconds}
+    return report
@@ -0,0 +1,425 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import multiprocessing
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers
+from tensorflow.keras import models
+
+from training.architectures import build_model
+
+# Strided layers whose strides make the output stride of a model
+STRIDED_LAYERS = (layers.Conv2D, layers.DepthwiseConv2D,
+                  layers.MaxPooling2D, layers.AveragePooling2D)
+
+
+def model_layers(model):
+    """Returns the layers of a model, those of nested models included."""
+    flat = []
+    for layer in model.layers:
+        if isinstance(layer, models.Model):
+            flat.extend(model_layers(layer))
+        else:
+            flat.append(layer)
+    return flat
+
+
+def output_stride(model):
+    """Returns the product of the strides of the layers of a model."""
+    return int(np.prod([layer.strides[0] for layer in model_layers(model)
+                        if isinstance(layer, STRIDED_LAYERS)]))
+
+
+def zero_padded_layers(model):
+    """Returns the layers of a model padding their inputs with zeros.
+
+    A 'same' convolution or pooling larger than 1x1 pads the border of each
+    patch, so a patch is not predicted exactly like the same window of a
+    larger input: in a dense pass, the pixels near the edges of a patch see
+    their neighbors instead of zeros.
+    """
+    padded = []
+    for layer in model_layers(model):
+        if not isinstance(layer, STRIDED_LAYERS) or layer.padding != 'same':
+            continue
+        size = layer.pool_size if hasattr(layer, 'pool_size') else \
+            layer.kernel_size
+        if max(size) > 1:
+            padded.append(layer)
+    return padded
+
+
+def load_inference_model(model_path, model_type, num_bands,
+                         normalize_input=True, global_pooling=False):
+    """Builds a single input model accepting any input size with weights.
+
+    Parameters
+    ----------
+    model_path : str
+        SavedModel written at the end of train_models.py, or folder of the
+        checkpoints of a TrainingCheckpoint
+    model_type : str
+        Type of SINGLE_INPUT_MODELS
+    num_bands : int
+        Number of stacked input bands
+    normalize_input : bool, optional
+        As in training, False with band statistics. The default is True.
+    global_pooling : bool, optional
+        As in training, True with a crop schedule. The default is False.
+
+    Returns
+    -------
+    Model
+
+    """
+    model = build_model(model_type, layers.Input(shape=[None, None,
+                                                        num_bands]),
+                        normalize_input, global_pooling)
+    if os.path.exists(os.path.join(model_path, 'saved_model.pb')):
+        model.set_weights(tf.keras.models.load_model(
+            model_path, compile=False).get_weights())
+    else:
+        checkpoint = tf.train.latest_checkpoint(model_path)
+        assert checkpoint, "No checkpoint in %s" % model_path
+        tf.train.Checkpoint(model=model).restore(checkpoint).expect_partial()
+    return model
+
+
+def fully_convolutional(model, patch_size):
+    """Returns the model applied to every patch of a larger input at once.
+
+    The predictions equal the ones of the patches if the model has no
+    zero_padded_layers, and approximate them otherwise, see
+    RasterPredictor. Models without global pooling already slide over
+    larger inputs. The global average of the others is replaced by an average over windows
+    of the size of the features of a patch, followed by the layers after
+    the pooling, e.g. 1x1 convolutions, without the reshapes.
+
+    Parameters
+    ----------
+    model : Model
+        Single input model taking patch_size x patch_size patches
+    patch_size : int
+        Height and width of the patches the model was trained on
+
+    Returns
+    -------
+    fcn : Model
+        Model whose outputs are the predictions of the patches at
+        output_stride from each other
+    output_stride : int
+        Pixels between the patches of two successive outputs
+
+    """
+    pooling = [i for i, layer in enumerate(model.layers)
+               if isinstance(layer, layers.GlobalAveragePooling2D)]
+    inputs = layers.Input(shape=[None, None, model.input_shape[-1]])
+    if pooling:
+        encoder = models.Model(model.inputs,
+                               model.layers[pooling[0]].input)
+        num_bands = model.input_shape[-1]
+        feature_size = encoder.compute_output_shape(
+            (1, patch_size, patch_size, num_bands))[1]
+        output = layers.AveragePooling2D(feature_size, strides=1)(
+            encoder(inputs))
+        for layer in model.layers[pooling[0] + 1:]:
+            if not isinstance(layer, layers.Reshape):
+                output = layer(output)
+        fcn = models.Model(inputs=[inputs], outputs=[output])
+    else:
+        encoder = model
+        fcn = models.Model(inputs=[inputs], outputs=[model(inputs)])
+    stride = output_stride(encoder)
+    for num_outputs in [1, 2]:
+        size = patch_size + (num_outputs - 1) * stride
+        shape = fcn.compute_output_shape((1, size, size, inputs.shape[-1]))
+        assert shape[1] == num_outputs, \
+            "The model does not give one output per patch of size %i" % \
+            patch_size
+    return fcn, stride
+
+
+class RasterPredictor:
+    """Predicts the patches of a raster at a stride, tile by tile.
+
+    Models run once over a window per shift of the stride, see
+    fully_convolutional. For models with zero_padded_layers, e.g. the CNN
+    and EFFICIENT_* models, this dense pass is an approximation: features
+    near the edges of a patch are computed from the neighboring pixels
+    instead of the zero padding seen in training. The difference grows with
+    the share of the receptive field that falls outside of a patch, e.g.
+    for CNN crops much smaller than 257x257. With exact, the patches of
+    these models are extracted at the stride and predicted in batches,
+    which gives the predictions of the patches at the cost of computing
+    their overlaps once per patch.
+    """
+
+    def __init__(self, model, patch_size, stride=None, offsets=None,
+                 scales=None, output_scale=1.0, batch_size=16, exact=False):
+        """Initializes the RasterPredictor.
+
+        Parameters
+        ----------
+        model : Model
+            Single input model
+        patch_size : int
+            Height and width of the patches of the model
+        stride : int, optional
+            Pixels between two predicted patches, dividing the output
+            stride of the model for a dense pass. The default is None for
+            the output stride.
+        offsets : np.ndarray, optional
+            Per band offsets of normalization_constants. The default is None.
+        scales : np.ndarray, optional
+            Per band scales of normalization_constants. The default is None.
+        output_scale : float, optional
+            Predictions are divided by it, e.g. the 10000 of scale_no2.
+            The default is 1.0.
+        batch_size : int, optional
+            Number of patches predicted at once without a dense pass.
+            The default is 16.
+        exact : bool, optional
+            Predicts the patches of models with zero_padded_layers batch by
+            batch instead of with a dense pass. The default is False.
+
+        """
+        self.dense = not (exact and zero_padded_layers(model))
+        if self.dense:
+            self.fcn, self.output_stride = fully_convolutional(model,
+                                                               patch_size)
+        else:
+            self.fcn, self.output_stride = model, output_stride(model)
+        # Traced once for windows of any size
+        self.predict_batch = tf.function(
+            lambda batch: self.fcn(batch, training=False),
+            input_signature=[tf.TensorSpec(
+                [None, None, None, model.input_shape[-1]], tf.float32)])
+        self.patch_size = patch_size
+        self.stride = stride or self.output_stride
+        assert not self.dense or self.output_stride % self.stride == 0, \
+            "The stride should divide the output stride %i" % \
+            self.output_stride
+        self.batch_size = batch_size
+        self.offsets = offsets
+        self.scales = scales
+        self.output_scale = output_scale
+
+    def output_shape(self, height, width):
+        """Returns the shape of the predictions of a height x width raster."""
+        return ((height - self.patch_size) // self.stride + 1,
+                (width - self.patch_size) // self.stride + 1)
+
+    def predict_window(self, window):
+        """Predicts every patch of a window at the stride.
+
+        In a dense pass, the model runs once per shift of the window by the
+        stride within the output stride, and the shifted outputs are
+        interleaved.
+
+        Parameters
+        ----------
+        window : np.ndarray
+            HxWxC input bands
+
+        Returns
+        -------
+        np.ndarray
+            float32 predictions of output_shape(H, W), the one at (i, j) is
+            the one of the patch whose top left pixel is
+            (i * stride, j * stride)
+
+        """
+        window = np.asarray(window, dtype=np.float32)
+        if self.offsets is not None:
+            window = (window - self.offsets) * self.scales
+        predictions = np.zeros(self.output_shape(*window.shape[:2]),
+                               dtype=np.float32)
+        if not self.dense:
+            return self._predict_patches(window, predictions)
+        shifts = self.output_stride // self.stride
+        for row_shift in range(min(shifts, predictions.shape[0])):
+            for col_shift in range(min(shifts, predictions.shape[1])):
+                num_rows = len(range(row_shift, predictions.shape[0], shifts))
+                num_cols = len(range(col_shift, predictions.shape[1], shifts))
+                top, left = row_shift * self.stride, col_shift * self.stride
+                shifted = window[
+                    top:top + (num_rows - 1) * self.output_stride +
+                    self.patch_size,
+                    left:left + (num_cols - 1) * self.output_stride +
+                    self.patch_size]
+                output = self.predict_batch(shifted[np.newaxis]).numpy()
+                predictions[row_shift::shifts, col_shift::shifts] = np.reshape(
+                    output, [num_rows, num_cols])
+        return predictions / self.output_scale
+
+    def _predict_patches(self, window, predictions):
+        """Predicts the patches of a normalized window batch by batch."""
+        # num_rows x num_cols x C x patch_size x patch_size views
+        patches = np.lib.stride_tricks.sliding_window_view(
+            window, (self.patch_size, self.patch_size), axis=(0, 1))[
+                ::self.stride, ::self.stride][:predictions.shape[0],
+                                              :predictions.shape[1]]
+        num_cols = predictions.shape[1]
+        flat = predictions.reshape(-1)
+        # Only the patches of a batch are copied out of the window
+        for start in range(0, flat.size, self.batch_size):
+            ids = np.arange(start, min(start + self.batch_size, flat.size))
+            batch = np.transpose(patches[ids // num_cols, ids % num_cols],
+                                 [0, 2, 3, 1])
+            flat[ids] = np.reshape(self.predict_batch(batch).numpy(),
+                                   [len(ids)])
+        return predictions / self.output_scale
+
+    def tiles(self, height, width, tile_size):
+        """Returns the tiles of the predictions of a raster.
+
+        Parameters
+        ----------
+        height : int
+        width : int
+        tile_size : int
+            Number of predictions per side of a tile
+
+        Returns
+        -------
+        list[tuple]
+            (first row, last row, first column, last column) of the
+            predictions of each tile, last excluded
+
+        """
+        num_rows, num_cols = self.output_shape(height, width)
+        return [(row, min(row + tile_size, num_rows),
+                 col, min(col + tile_size, num_cols))
+                for row in range(0, num_rows, tile_size)
+                for col in range(0, num_cols, tile_size)]
+
+    def window_bounds(self, tile):
+        """Returns the input pixels of a tile, including its halo.
+
+        Neighboring windows overlap by patch_size - stride pixels.
+        """
+        first_row, last_row, first_col, last_col = tile
+        return (first_row * self.stride,
+                (last_row - 1) * self.stride + self.patch_size,
+                first_col * self.stride,
+                (last_col - 1) * self.stride + self.patch_size)
+
+
+# Predictor and rasters of a worker process of predict_raster
+_WORKER = {}
+
+
+def _init_worker(model_args, predictor_args, raster_path, output_path,
+                 threads):
+    """Loads the model and memory maps the rasters once per process."""
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    model = load_inference_model(*model_args)
+    _WORKER['predictor'] = RasterPredictor(model, **predictor_args)
+    _WORKER['raster'] = np.load(raster_path, mmap_mode='r')
+    _WORKER['output'] = np.load(output_path, mmap_mode='r+')
+
+
+def _predict_tile(tile):
+    """Predicts a tile and writes it to the output raster."""
+    start = time.time()
+    predictor = _WORKER['predictor']
+    top, bottom, left, right = predictor.window_bounds(tile)
+    first_row, last_row, first_col, last_col = tile
+    output = _WORKER['output']
+    output[first_row:last_row, first_col:last_col] = \
+        predictor.predict_window(_WORKER['raster'][top:bottom, left:right])
+    output.flush()
+    return tile, time.time() - start
+
+
+def predict_raster(model_args, raster_path, output_path, patch_size,
+                   stride=None, tile_size=64, processes=1, offsets=None,
+                   scales=None, output_scale=1.0, exact=False):
+    """Predicts a raster tile by tile into a memory mapped .npy raster.
+
+    Tiles are spread over processes that each load the model and share
+    the CPUs, and each tile is written as soon as it is predicted.
+
+    Parameters
+    ----------
+    model_args : tuple
+        Arguments of load_inference_model
+    raster_path : str
+        HxWxC float32 .npy of the input bands in the stacking order
+    output_path : str
+        .npy of the predictions, see RasterPredictor.predict_window
+    patch_size : int
+        Height and width of the patches of the model
+    stride : int, optional
+        Pixels between predicted patches. The default is None for the
+        output stride of the model.
+    tile_size : int, optional
+        Number of predictions per side of a tile. The default is 64.
+    processes : int, optional
+        Number of worker processes. The default is 1.
+    offsets : np.ndarray, optional
+        Band offsets of normalization_constants. The default is None.
+    scales : np.ndarray, optional
+        Band scales of normalization_constants. The default is None.
+    output_scale : float, optional
+        Predictions are divided by it. The default is 1.0.
+    exact : bool, optional
+        Predicts zero padded models patch by patch, see RasterPredictor.
+        The default is False.
+
+    Returns
+    -------
+    dict
+        "shape" of the predictions, "stride", whether the pass is
+        "dense", "tiles", "seconds",
+        mean "tile_seconds" and "predictions_per_second"
+
+    """
+    start = time.time()
+    predictor_args = {'patch_size': patch_size, 'stride': stride,
+                      'offsets': offsets, 'scales': scales,
+                      'output_scale': output_scale, 'exact': exact}
+    raster = np.load(raster_path, mmap_mode='r')
+    predictor = RasterPredictor(load_inference_model(*model_args),
+                                **predictor_args)
+    shape = predictor.output_shape(*raster.shape[:2])
+    assert min(shape) > 0, "The raster is smaller than a patch"
+    np.lib.format.open_memmap(output_path, mode='w+', dtype=np.float32,
+                              shape=shape).flush()
+    tiles = predictor.tiles(raster.shape[0], raster.shape[1], tile_size)
+    if processes > 1:
+        # TensorFlow runtimes are not fork safe, workers are spawned
+        threads = max((os.cpu_count() or 1) // processes, 1)
+        pool = multiprocessing.get_context('spawn').Pool(
+            processes, _init_worker, (model_args, predictor_args, raster_path,
+                                      output_path, threads))
+        with pool:
+            results = list(pool.imap_unordered(_predict_tile, tiles))
+    else:
+        _WORKER.update(predictor=predictor, raster=raster,
+                       output=np.load(output_path, mmap_mode='r+'))
+        results = [_predict_tile(tile) for tile in tiles]
+    seconds = time.time() - start
+    return {'shape': list(shape), 'stride': predictor.stride,
+            'dense': predictor.dense, 'tiles': len(tiles), 'seconds': seconds,
+            'tile_seconds': float(np.mean([tile_seconds for _, tile_seconds
+                                           in results])),
+            'predictions_per_second': int(np.prod(shape)) / seconds}
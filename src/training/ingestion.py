@@ -0,0 +1,408 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import json
+import os
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+
+from training.schema import list_tfrecords
+from training.load_data import project_features, batch_parser
+from training.validation import validate_tfrecords
+from training.band_stats import (BandAccumulator, accumulate_band_stats,
+                                 save_accumulators, load_accumulators,
+                                 save_band_stats, normalization_constants)
+
+# Shards merged in the accumulators of a stats folder
+INGESTED_FILE = 'ingested.json'
+ACCUMULATORS_FILE = 'band_stats.npz'
+
+
+class ShardWatcher:
+    """Admits the shards of a folder as they are exported.
+
+    Shards are admitted by poll, usually in the background thread of start
+    so that their validation and statistics do not stall the input
+    pipeline. They are validated and scanned by spawned processes rather
+    than forked ones, as the thread runs next to the tf.data threads.
+    """
+
+    def __init__(self, path, features_dict=None, quantization=None,
+                 exclude=(), settle_seconds=60, fresh_epochs=1,
+                 stats_path=None, processes=None, seed=None, num_eval=0):
+        """Initializes the ShardWatcher, no shard is admitted before poll.
+
+        Parameters
+        ----------
+        path : str
+            Folder where the GZIP TFRecords are written
+        features_dict : dict, optional
+            Features of the TFRecords, new shards are validated against
+            them if given. The default is None.
+        quantization : dict, optional
+            Quantization of the TFRecords. The default is None.
+        exclude : list[str], optional
+            Files never admitted. The default is ().
+        settle_seconds : float, optional
+            Time since the last modification of a shard before it is
+            considered complete. The default is 60.
+        fresh_epochs : int, optional
+            Number of epochs during which an admitted shard is fresh.
+            The default is 1.
+        stats_path : str, optional
+            Folder of the band statistics updated with the admitted training
+            shards, needs features_dict. The default is None.
+        processes : int, optional
+            Number of shards validated and scanned in parallel.
+            The default is None for the number of CPUs.
+        seed : int, optional
+            Seed of the order of the shards. The default is None.
+        num_eval : int, optional
+            Maximum number of admitted shards held out for evaluation. As
+            in split_tfrecords at most half of the admitted shards are held
+            out, so the first shard is always a training shard.
+            The default is 0.
+
+        """
+        assert stats_path is None or features_dict is not None, \
+            "features_dict is needed to update the band statistics"
+        self.path = path
+        self.features_dict = features_dict
+        self.quantization = quantization
+        self.exclude = set(os.path.abspath(file) for file in exclude)
+        self.settle_seconds = settle_seconds
+        self.fresh_epochs = fresh_epochs
+        self.stats_path = stats_path
+        self.processes = processes
+        self.num_eval = num_eval
+        self.rng = np.random.default_rng(seed)
+        self.epoch = 0
+        # Epoch during which each training shard was admitted
+        self.shards = {}
+        self.eval_shards = []
+        # (size, mtime) of the rejected shards, retried if they change
+        self.rejected = {}
+        self.accumulators, self.ingested = {}, []
+        if stats_path and os.path.exists(os.path.join(stats_path,
+                                                      INGESTED_FILE)):
+            self.ingested = json.load(open(os.path.join(stats_path,
+                                                        INGESTED_FILE), 'r'))
+            self.accumulators = load_accumulators(
+                os.path.join(stats_path, ACCUMULATORS_FILE))
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.callbacks = []
+
+    def poll(self):
+        """Admits the complete and valid shards written since the last poll.
+
+        The statistics are updated and the callbacks of start are called
+        before the new shards are returned by epoch_files and eval_files.
+
+        Returns
+        -------
+        list[str]
+            Newly admitted shards, training and evaluation ones
+
+        """
+        now = time.time()
+        candidates = []
+        for file in list_tfrecords(self.path):
+            file = os.path.abspath(file)
+            if file in self.shards or file in self.eval_shards or \
+                    file in self.exclude:
+                continue
+            stat = os.stat(file)
+            if now - stat.st_mtime < self.settle_seconds:
+                continue
+            if self.rejected.get(file) == (stat.st_size, stat.st_mtime):
+                continue
+            candidates.append(file)
+        if candidates and self.features_dict is not None:
+            manifest = validate_tfrecords(candidates, self.features_dict,
+                                          self.quantization, self.processes)
+            for entry in manifest['shards']:
+                if entry['status'] != 'ok':
+                    stat = os.stat(entry['file'])
+                    self.rejected[entry['file']] = (stat.st_size,
+                                                    stat.st_mtime)
+                    print("Rejected %s shard %s" % (entry['status'],
+                                                    entry['file']))
+                    candidates.remove(entry['file'])
+        train_files, eval_files = [], []
+        num_eval = len(self.eval_shards)
+        admitted = len(self.shards) + num_eval
+        for file in candidates:
+            admitted += 1
+            if num_eval + len(eval_files) < min(self.num_eval,
+                                                admitted // 2):
+                eval_files.append(file)
+            else:
+                train_files.append(file)
+        if train_files and self.stats_path:
+            self._update_stats(train_files)
+        if candidates:
+            for callback in self.callbacks:
+                callback()
+        with self.lock:
+            self.eval_shards += eval_files
+            for file in train_files:
+                self.shards[file] = self.epoch
+        return candidates
+
+    def start(self, poll_seconds=60, callbacks=()):
+        """Polls in a background thread until stop.
+
+        Parameters
+        ----------
+        poll_seconds : float, optional
+            Wait between polls. The default is 60.
+        callbacks : list[function], optional
+            Called without arguments by each poll admitting shards, once
+            the statistics are updated. The default is ().
+
+        Returns
+        -------
+        threading.Thread
+
+        """
+        def run():
+            while not self.stopped.is_set():
+                try:
+                    self.poll()
+                except Exception as error:  # retried at the next poll
+                    print("Poll of %s failed: %r" % (self.path, error))
+                self.stopped.wait(poll_seconds)
+
+        self.callbacks = list(callbacks)
+        self.stopped.clear()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stops the thread of start after its current poll."""
+        self.stopped.set()
+
+    def _update_stats(self, files):
+        """Merges the statistics of new shards and saves them."""
+        files = [file for file in files if file not in self.ingested]
+        os.makedirs(self.stats_path, exist_ok=True)
+        accumulators = accumulate_band_stats(
+            files, sorted(self.features_dict), self.quantization,
+            self.processes)
+        with self.lock:
+            for band, accumulator in accumulators.items():
+                self.accumulators.setdefault(
+                    band, BandAccumulator()).merge(accumulator)
+            self.ingested += files
+        save_accumulators(self.accumulators,
+                          os.path.join(self.stats_path, ACCUMULATORS_FILE))
+        save_band_stats(self.band_stats(), self.stats_path)
+        json.dump(self.ingested, open(os.path.join(self.stats_path,
+                                                   INGESTED_FILE), 'w'),
+                  indent=2)
+
+    def band_stats(self):
+        """Returns the statistics of the ingested shards."""
+        with self.lock:
+            return {band: accumulator.summary() for band, accumulator
+                    in self.accumulators.items() if accumulator.count}
+
+    def epoch_files(self, fresh_weight=None):
+        """Starts an epoch and returns the shuffled training shards to read.
+
+        Fresh shards, admitted during the last fresh_epochs epochs, are
+        repeated or subsampled so that they make fresh_weight of the shards
+        of the epoch, which weights the records as well since exported
+        shards have similar numbers of records.
+
+        Parameters
+        ----------
+        fresh_weight : float, optional
+            Fraction of fresh shards in (0, 1). The default is None to
+            read every shard once.
+
+        Returns
+        -------
+        list[str]
+
+        """
+        with self.lock:
+            self.epoch += 1
+            files = sorted(self.shards)
+            first_fresh = self.epoch - self.fresh_epochs
+            fresh = [file for file in files
+                     if self.shards[file] >= first_fresh]
+            old = [file for file in files
+                   if self.shards[file] < first_fresh]
+        if fresh_weight is None or not fresh or not old:
+            return list(self.rng.permutation(files))
+        assert 0 < fresh_weight < 1, "fresh_weight should be in (0, 1)"
+        num_fresh = max(int(round(fresh_weight / (1 - fresh_weight) *
+                                  len(old))), 1)
+        fresh = self.rng.choice(fresh, num_fresh,
+                                replace=num_fresh > len(fresh))
+        return list(self.rng.permutation(old + list(fresh)))
+
+    def train_files(self):
+        """Returns the admitted training shards, sorted."""
+        with self.lock:
+            return sorted(self.shards)
+
+    def eval_files(self):
+        """Returns the shards held out for evaluation, in admission order."""
+        with self.lock:
+            return list(self.eval_shards)
+
+
+class IncrementalNormalization:
+    """Normalization of stacked bands following the stats of a ShardWatcher.
+
+    The offsets and scales of normalize_stacked are variables captured by
+    the datasets, so update changes the normalization of datasets already
+    built. Batches parsed during an update may use either statistics.
+    """
+
+    def __init__(self, watcher, input_bands, output_bands):
+        """Initializes the variables with the current stats of the watcher.
+
+        Parameters
+        ----------
+        watcher : ShardWatcher
+            Watcher with a stats_path
+        input_bands : list[list[str]]
+            Groups of bands stacked together as inputs
+        output_bands : list[str]
+            Bands stacked as outputs
+
+        """
+        self.watcher = watcher
+        self.groups = input_bands + [output_bands]
+        self.num_inputs = len(input_bands)
+        self.variables = [(tf.Variable(tf.zeros([len(bands)]),
+                                       trainable=False),
+                           tf.Variable(tf.ones([len(bands)]),
+                                       trainable=False))
+                          for bands in self.groups]
+        self.update()
+
+    def update(self):
+        """Assigns the normalization constants of the watcher stats."""
+        stats = self.watcher.band_stats()
+        for i, (bands, (offsets, scales)) in enumerate(
+                zip(self.groups, self.variables)):
+            values = normalization_constants(stats, bands,
+                                             center=i < self.num_inputs)
+            offsets.assign(values[0])
+            scales.assign(values[1])
+
+    def __call__(self, *stacked):
+        """Normalizes the stacked groups, as normalize_stacked."""
+        return tuple((tensor - offsets) * scales for tensor, (offsets, scales)
+                     in zip(stacked, self.variables))
+
+
+def load_incremental_tfrecords(watcher, features_dict, input_bands,
+                               output_bands, batch_size, fresh_weight=None,
+                               poll_seconds=60, cycle_length=8,
+                               shuffle_buffer=0, static_cache=None,
+                               quantization=None, drop_remainder=False,
+                               band_stats=None, eval_shards=False):
+    """Loads batches of stacked tensors from the shards of a ShardWatcher.
+
+    The shards admitted by the watcher, polled in the background by
+    ShardWatcher.start, join the mix at the next epoch. The dataset waits
+    until a first shard is admitted and is infinite.
+
+    Parameters
+    ----------
+    watcher : ShardWatcher
+        Watcher of the exported shards
+    features_dict : dict
+        Features of the TFRecords
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs
+    output_bands : list[str]
+        Bands stacked as outputs
+    batch_size : int
+        Number of records per batch
+    fresh_weight : float, optional
+        Fraction of fresh shards in each epoch, see
+        ShardWatcher.epoch_files. The default is None.
+    poll_seconds : float, optional
+        Wait between checks while no shard is admitted. The default is 60.
+    cycle_length : int, optional
+        Number of files read concurrently. The default is 8.
+    shuffle_buffer : int, optional
+        Number of serialized records shuffled before batching.
+        The default is 0.
+    static_cache : StaticLayerCache, optional
+        Cache of the static bands missing from the records.
+        The default is None.
+    quantization : dict, optional
+        Quantization of the records. The default is None.
+    drop_remainder : bool, optional
+        Drops incomplete batches. The default is False.
+    band_stats : dict or IncrementalNormalization, optional
+        Statistics of load_band_stats used to normalize the stacked bands,
+        or a normalization following the statistics of the watcher.
+        The default is None.
+    eval_shards : bool, optional
+        Reads the shards held out for evaluation in order instead of the
+        training ones. The default is False.
+
+    Returns
+    -------
+    tf.data.Dataset
+
+    """
+    normalization = None
+    if isinstance(band_stats, IncrementalNormalization):
+        normalization, band_stats = band_stats, None
+    features_dict = project_features(features_dict, input_bands, output_bands,
+                                     static_cache)
+    parse_batch = batch_parser(features_dict, input_bands, output_bands,
+                               static_cache, quantization, band_stats)
+
+    def epoch_files():
+        while True:
+            if eval_shards:
+                files = watcher.eval_files()
+            else:
+                files = watcher.epoch_files(fresh_weight)
+            if not files:
+                time.sleep(poll_seconds)
+            for file in files:
+                yield file
+
+    files = tf.data.Dataset.from_generator(
+        epoch_files, output_signature=tf.TensorSpec([], tf.string))
+    dataset = files.interleave(
+        lambda file: tf.data.TFRecordDataset(file, compression_type='GZIP'),
+        cycle_length=1 if eval_shards else cycle_length,
+        num_parallel_calls=tf.data.experimental.AUTOTUNE,
+        deterministic=eval_shards)
+    if shuffle_buffer > 0:
+        dataset = dataset.shuffle(shuffle_buffer)
+    dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+    dataset = dataset.map(parse_batch,
+                          num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    if normalization is not None:
+        dataset = dataset.map(normalization)
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
@@ -15,17 +15,41 @@ limitations under the License.
 '''
 
 
+import os
+import re
+import time
+import numpy as np
 import tensorflow as tf
-import random
+
+from training.schema import is_patch_feature, wind_pairs
+from training.quantization import quantized_features_dict, dequantize
+from training.dataset_cache import dataset_fingerprint, cache_dataset
+from training.band_stats import normalize_stacked
+
+# Files written by SampleExporter.export_tiles
+TILE_FILE = re.compile(r'^(.*?)(-\d+)?\.tfrecord(\.gz)?$')
+OFFSETS_FILE = re.compile(r'^(.*)_\d+\.tfrecord(\.gz)?$')
+OFFSET_KEYS = ['tile_row', 'tile_col', 'tile_height', 'tile_width']
 
 
 def load_tfrecords(files, features_dict, input_bands, output_bands,
-                   parallel_calls=8):
+                   parallel_calls=8, static_cache=None, quantization=None,
+                   band_stats=None):
+    features_dict = project_features(features_dict, input_bands, output_bands,
+                                     static_cache)
+    parse_features = features_dict
+    if quantization:
+        parse_features = quantized_features_dict(features_dict, quantization)
+
     def parse_tfrecord(example_proto):
         """The parsing function.
         Read a serialized example into the structure defined by FEATURES_DICT.
+        Quantized bands are decoded back to float32.
         """
-        return tf.io.parse_single_example(example_proto, features_dict)
+        inputs = tf.io.parse_single_example(example_proto, parse_features)
+        if quantization:
+            inputs = dequantize(inputs, features_dict, quantization)
+        return inputs
 
     def stack_inputs(inputs):
         """Function to convert a dictionary of tensors to a tuple of (inputs, outputs).
@@ -35,23 +59,607 @@ def load_tfrecords(files, features_dict, input_bands, output_bands,
         Returns:
           A tuple of (inputs, outputs).
         """
-        inputs_list = []
-        for bands in input_bands:
-            inputs_list.append(tf.stack([inputs.get(band) for band in bands],
-                                        axis=-1))
-        outputs = tf.stack([inputs.get(band) for band in output_bands], axis=-1)
-        return inputs_list+[outputs]
+        stacked = stack_bands(inputs, input_bands, output_bands)
+        if band_stats:
+            stacked = normalize_stacked(stacked, input_bands, output_bands,
+                                        band_stats)
+        return list(stacked)
 
     dataset = tf.data.TFRecordDataset(files, compression_type='GZIP')
     dataset = dataset.map(parse_tfrecord, num_parallel_calls=parallel_calls)
+    if static_cache is not None:
+        # Static bands are not in the records, they are joined by lat/lon
+        dataset = dataset.map(static_cache.attach,
+                              num_parallel_calls=parallel_calls)
     dataset = dataset.map(stack_inputs, num_parallel_calls=parallel_calls)
     return dataset
 
+
+def project_features(features_dict, input_bands, output_bands,
+                     static_cache=None):
+    """Keeps only the features used by the inputs and outputs.
+
+    Features missing from the returned dictionary are not decoded.
+
+    Parameters
+    ----------
+    features_dict : dict
+        Features of the TFRecords
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs
+    output_bands : list[str]
+        Bands stacked as outputs
+    static_cache : StaticLayerCache, optional
+        Cache of the static bands, which needs the latitude and longitude.
+        The default is None.
+
+    Returns
+    -------
+    dict
+        Features needed to build the inputs and outputs
+
+    """
+    needed = set(output_bands)
+    for bands in input_bands:
+        needed.update(bands)
+    if static_cache is not None:
+        needed.update(['latitude', 'longitude'])
+    return {band: feature for band, feature in features_dict.items()
+            if band in needed}
+
+
+def stack_bands(inputs, input_bands, output_bands):
+    """Stacks each group of bands along the last axis.
+
+    Parameters
+    ----------
+    inputs : dict
+        Tensors keyed by band name, batched or not
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs
+    output_bands : list[str]
+        Bands stacked as outputs
+
+    Returns
+    -------
+    tuple
+        One tensor per group of input bands, followed by the outputs
+
+    """
+    stacked = [tf.stack([inputs[band] for band in bands], axis=-1)
+               for bands in input_bands + [output_bands]]
+    return tuple(stacked)
+
+
+def batch_parser(features_dict, input_bands, output_bands, static_cache=None,
+                 quantization=None, band_stats=None):
+    """Returns the function parsing and stacking batches of records.
+
+    Parameters
+    ----------
+    features_dict : dict
+        Features of the TFRecords, already projected
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs
+    output_bands : list[str]
+        Bands stacked as outputs
+    static_cache : StaticLayerCache, optional
+        Cache of the static bands missing from the records.
+        The default is None.
+    quantization : dict, optional
+        Quantization of the records. The default is None.
+    band_stats : dict, optional
+        Statistics of load_band_stats used to normalize the stacked bands.
+        The default is None for no normalization.
+
+    Returns
+    -------
+    function
+        Maps a vector of serialized records to the stacked tensors
+
+    """
+    parse_features = features_dict
+    if quantization:
+        parse_features = quantized_features_dict(features_dict, quantization)
+
+    def parse_batch(example_protos):
+        inputs = tf.io.parse_example(example_protos, parse_features)
+        if quantization:
+            inputs = dequantize(inputs, features_dict, quantization)
+        if static_cache is not None:
+            inputs = static_cache.attach(inputs, batched=True)
+        stacked = stack_bands(inputs, input_bands, output_bands)
+        if band_stats:
+            stacked = normalize_stacked(stacked, input_bands, output_bands,
+                                        band_stats)
+        return stacked
+
+    return parse_batch
+
+
+def read_tfrecords(files, cycle_length=8, shuffle_files=False):
+    """Reads serialized records, interleaving the files in parallel.
+
+    Parameters
+    ----------
+    files : list[str]
+        GZIP TFRecord files
+    cycle_length : int, optional
+        Number of files read concurrently. The default is 8.
+    shuffle_files : bool, optional
+        Shuffles the order of the files every epoch. The default is False.
+
+    Returns
+    -------
+    tf.data.Dataset
+        Serialized records
+
+    """
+    dataset = tf.data.Dataset.from_tensor_slices(files)
+    if shuffle_files:
+        dataset = dataset.shuffle(len(files), reshuffle_each_iteration=True)
+    return dataset.interleave(
+        lambda file: tf.data.TFRecordDataset(file, compression_type='GZIP'),
+        cycle_length=cycle_length,
+        num_parallel_calls=tf.data.experimental.AUTOTUNE,
+        deterministic=False)
+
+
+def load_batched_tfrecords(files, features_dict, input_bands, output_bands,
+                           batch_size, cycle_length=8, shuffle_buffer=0,
+                           static_cache=None, quantization=None,
+                           drop_remainder=False, cache_path=None,
+                           band_stats=None):
+    """Loads batches of stacked tensors with vectorized parsing.
+
+    Files are interleaved in parallel, serialized records are batched, then
+    parsed with tf.io.parse_example and stacked in a single map, and batches
+    are prefetched. The elements are the same as the ones of load_tfrecords
+    with an additional batch dimension.
+
+    Parameters
+    ----------
+    files : list[str]
+        GZIP TFRecord files
+    features_dict : dict
+        Features of the TFRecords
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs
+    output_bands : list[str]
+        Bands stacked as outputs
+    batch_size : int
+        Number of records per batch
+    cycle_length : int, optional
+        Number of files read concurrently. The default is 8.
+    shuffle_buffer : int, optional
+        Number of serialized records shuffled before batching, files are
+        also shuffled if > 0. The default is 0 for no shuffling.
+    static_cache : StaticLayerCache, optional
+        Cache of the static bands missing from the records.
+        The default is None.
+    quantization : dict, optional
+        Quantization of the records. The default is None.
+    drop_remainder : bool, optional
+        Drops the last incomplete batch. The default is False.
+    cache_path : str, optional
+        Folder where decoded batches are cached during the first pass and
+        read from in later passes and runs, records are then shuffled after
+        the cache. The default is None for no cache.
+    band_stats : dict, optional
+        Statistics of load_band_stats, inputs are standardized and outputs
+        divided by their deviation. The default is None.
+
+    Returns
+    -------
+    tf.data.Dataset
+
+    """
+    features_dict = project_features(features_dict, input_bands, output_bands,
+                                     static_cache)
+    parse_batch = batch_parser(features_dict, input_bands, output_bands,
+                               static_cache, quantization, band_stats)
+
+    if cache_path:
+        fingerprint = dataset_fingerprint(files, features_dict, input_bands,
+                                          output_bands,
+                                          quantization=quantization,
+                                          static_bands=static_cache and
+                                          static_cache.bands,
+                                          band_stats=band_stats)
+        dataset = read_tfrecords(files, cycle_length)
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.map(parse_batch,
+                              num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        dataset = cache_dataset(dataset, cache_path, fingerprint)
+        dataset = dataset.unbatch()
+        if shuffle_buffer > 0:
+            dataset = dataset.shuffle(shuffle_buffer)
+        dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+        return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+    dataset = read_tfrecords(files, cycle_length,
+                             shuffle_files=shuffle_buffer > 0)
+    if shuffle_buffer > 0:
+        dataset = dataset.shuffle(shuffle_buffer)
+    dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+    dataset = dataset.map(parse_batch,
+                          num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
+def load_indexed_tfrecords(index, features_dict, input_bands, output_bands,
+                           batch_size, record_ids=None, shuffle=True,
+                           block_size=1, local_buffer=0, static_cache=None,
+                           quantization=None, drop_remainder=False,
+                           band_stats=None):
+    """Loads batches of stacked tensors by random access through an index.
+
+    Shuffling is done on the record ids, so no decoded record is held in a
+    shuffle buffer. Blocks of block_size consecutive records are shuffled,
+    read, and mixed in a local buffer of local_buffer serialized records;
+    block_size=1 is a full random permutation every epoch.
+
+    Parameters
+    ----------
+    index : RecordIndex
+        Index of the records
+    features_dict : dict
+        Features of the TFRecords
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs
+    output_bands : list[str]
+        Bands stacked as outputs
+    batch_size : int
+        Number of records per batch
+    record_ids : np.ndarray, optional
+        Ids of the records to load. The default is None for all records.
+    shuffle : bool, optional
+        Shuffles the records every epoch. The default is True.
+    block_size : int, optional
+        Number of consecutive records shuffled together. The default is 1.
+    local_buffer : int, optional
+        Number of serialized records mixed after reading. The default is 0.
+    static_cache : StaticLayerCache, optional
+        Cache of the static bands missing from the records.
+        The default is None.
+    quantization : dict, optional
+        Quantization of the records. The default is None.
+    drop_remainder : bool, optional
+        Drops the last incomplete batch. The default is False.
+    band_stats : dict, optional
+        Statistics of load_band_stats, inputs are standardized and outputs
+        divided by their deviation. The default is None.
+
+    Returns
+    -------
+    tf.data.Dataset
+
+    """
+    features_dict = project_features(features_dict, input_bands, output_bands,
+                                     static_cache)
+    parse_batch = batch_parser(features_dict, input_bands, output_bands,
+                               static_cache, quantization, band_stats)
+    if record_ids is None:
+        record_ids = np.arange(len(index))
+    record_ids = tf.constant(np.asarray(record_ids, dtype=np.int64))
+    num_records = int(record_ids.shape[0])
+    num_blocks = -(-num_records // block_size)
+
+    def block_positions(block):
+        return tf.data.Dataset.range(
+            block * block_size, tf.minimum((block + 1) * block_size,
+                                           num_records))
+
+    def read_batch(ids):
+        records = tf.numpy_function(index.read_batch, [ids], tf.string)
+        records.set_shape([None])
+        return records
+
+    dataset = tf.data.Dataset.range(num_blocks)
+    if shuffle:
+        dataset = dataset.shuffle(num_blocks, reshuffle_each_iteration=True)
+    dataset = dataset.flat_map(block_positions)
+    dataset = dataset.map(lambda position: tf.gather(record_ids, position))
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(read_batch,
+                          num_parallel_calls=tf.data.experimental.AUTOTUNE,
+                          deterministic=not shuffle)
+    if shuffle and local_buffer > 0:
+        dataset = dataset.unbatch().shuffle(local_buffer)
+        dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+    elif drop_remainder:
+        dataset = dataset.filter(
+            lambda records: tf.shape(records)[0] == batch_size)
+    dataset = dataset.map(parse_batch,
+                          num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
+def measure_throughput(dataset, num_elements, records_per_element=1):
+    """Returns the records per second of iterating over a dataset."""
+    iterator = iter(dataset)
+    next(iterator)  # warm up, builds the pipeline
+    start = time.time()
+    count = 0
+    for _ in range(num_elements):
+        try:
+            next(iterator)
+        except StopIteration:
+            break
+        count += 1
+    return count * records_per_element / max(time.time() - start, 1e-9)
+
+
+def profile_input_pipeline(files, features_dict, input_bands, output_bands,
+                           batch_size, num_batches=50, **kwargs):
+    """Reports the throughput of each stage of load_batched_tfrecords.
+
+    Parameters
+    ----------
+    files : list[str]
+        GZIP TFRecord files
+    features_dict : dict
+        Features of the TFRecords
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs
+    output_bands : list[str]
+        Bands stacked as outputs
+    batch_size : int
+        Number of records per batch
+    num_batches : int, optional
+        Number of batches measured per stage. The default is 50.
+    **kwargs :
+        Other arguments of load_batched_tfrecords
+
+    Returns
+    -------
+    dict
+        records per second after the "read" and "parse_stack" stages
+
+    """
+    cycle_length = kwargs.get('cycle_length', 8)
+    read = read_tfrecords(files, cycle_length).batch(batch_size)
+    parsed = load_batched_tfrecords(files, features_dict, input_bands,
+                                    output_bands, batch_size, **kwargs)
+    return {'read': measure_throughput(read, num_batches, batch_size),
+            'parse_stack': measure_throughput(parsed, num_batches,
+                                              batch_size)}
+
+def group_files(path, pattern):
+    """Groups the files of a folder by export id.
+
+    Parameters
+    ----------
+    path : str
+        Folder containing the files
+    pattern : re.Pattern
+        Pattern whose first group is the export id
+
+    Returns
+    -------
+    dict
+        Sorted lists of file paths keyed by export id
+
+    """
+    groups = {}
+    for file_name in sorted(os.listdir(path)):
+        match = pattern.match(file_name)
+        if match:
+            groups.setdefault(match.group(1), []).append(
+                os.path.join(path, file_name))
+    return groups
+
+
+def load_tiled_tfrecords(tiles_path, offsets_path, features_dict, input_bands,
+                         output_bands, kernel_radius, cycle_length=8):
+    """Loads samples exported as tiles and offsets, rebuilding the patches.
+
+    Exports are interleaved in parallel, each tile is read once and the
+    patches of its samples are cropped from it with tensor ops, so the
+    dataset has the same structure as the one of load_tfrecords. Pixels of
+    patches crossing the edge of their tile are 0, as masked pixels are in
+    the exported tiles. The tile of an export is a single patch, so it is
+    written to a single file.
+
+    Parameters
+    ----------
+    tiles_path : str
+        Folder of the tiles exported by SampleExporter.export_tiles
+    offsets_path : str
+        Folder of the offsets exported by SampleExporter.export_tiles
+    features_dict : dict
+        Features of the patch exports, patches are rebuilt from the tiles
+    input_bands : list[list[str]]
+        Groups of bands stacked together as inputs
+    output_bands : list[str]
+        Bands stacked as outputs
+    kernel_radius : int
+        Radius of the rebuilt patches
+    cycle_length : int, optional
+        Number of exports read concurrently. The default is 8.
+
+    Returns
+    -------
+    tf.data.Dataset
+
+    Raises
+    ------
+    ValueError
+        If the tile of an export is split in several files.
+
+    """
+    features_dict = project_features(features_dict, input_bands, output_bands)
+    patch_bands = [band for band, feature in features_dict.items()
+                   if is_patch_feature(feature)]
+    patch_features = {band: tf.io.FixedLenSequenceFeature(
+        [], tf.float32, allow_missing=True) for band in patch_bands}
+    scalar_features = {band: feature for band, feature in
+                       features_dict.items() if not is_patch_feature(feature)}
+    scalar_features.update({key: tf.io.FixedLenFeature([], tf.float32)
+                            for key in OFFSET_KEYS})
+    size = 2 * kernel_radius + 1
+
+    tiles = group_files(tiles_path, TILE_FILE)
+    offsets = group_files(offsets_path, OFFSETS_FILE)
+    export_ids = sorted(set(tiles) & set(offsets))
+    for export_id in export_ids:
+        if len(tiles[export_id]) != 1:
+            raise ValueError("Export %s has %i tile files, expected one" %
+                             (export_id, len(tiles[export_id])))
+
+    def crop_patch(tile, sample):
+        """Crops the zero padded patch of a sample from a flat tile."""
+        height = tf.cast(sample['tile_height'], tf.int32)
+        width = tf.cast(sample['tile_width'], tf.int32)
+        tile = tf.reshape(tile, [height, width, len(patch_bands)])
+        top = tf.cast(sample['tile_row'], tf.int32) - kernel_radius
+        left = tf.cast(sample['tile_col'], tf.int32) - kernel_radius
+        # Part of the patch inside the tile, padded back to the patch size
+        inner_top = tf.clip_by_value(top, 0, height)
+        inner_left = tf.clip_by_value(left, 0, width)
+        inner_bottom = tf.clip_by_value(top + size, inner_top, height)
+        inner_right = tf.clip_by_value(left + size, inner_left, width)
+        patch = tile[inner_top:inner_bottom, inner_left:inner_right]
+        patch = tf.pad(patch, [[inner_top - top, top + size - inner_bottom],
+                               [inner_left - left,
+                                left + size - inner_right], [0, 0]])
+        patch.set_shape([size, size, len(patch_bands)])
+        inputs = dict(sample)
+        for i, band in enumerate(patch_bands):
+            inputs[band] = patch[..., i]
+        return stack_bands(inputs, input_bands, output_bands)
+
+    def read_export(tile_file, offset_files):
+        """Reads the tile of an export and crops the patches of its samples."""
+        record = tf.data.TFRecordDataset(
+            tile_file, compression_type='GZIP').take(1).get_single_element()
+        parsed = tf.io.parse_single_example(record, patch_features)
+        tile = tf.stack([parsed[band] for band in patch_bands], axis=-1)
+        samples = tf.data.TFRecordDataset(offset_files,
+                                          compression_type='GZIP')
+        samples = samples.map(
+            lambda x: tf.io.parse_single_example(x, scalar_features))
+        return samples.map(lambda sample: crop_patch(tile, sample))
+
+    dataset = tf.data.Dataset.from_tensor_slices((
+        tf.constant([tiles[export_id][0] for export_id in export_ids],
+                    dtype=tf.string),
+        tf.ragged.constant([offsets[export_id] for export_id in export_ids],
+                           dtype=tf.string)))
+    return dataset.interleave(read_export, cycle_length=cycle_length,
+                              num_parallel_calls=tf.data.experimental.AUTOTUNE,
+                              deterministic=False)
+
 def merge_features_without_date(*inputs):
-    return tf.concat(inputs[:-2],2), inputs[-1]
+    return tf.concat(inputs[:-2], -1), inputs[-1]
 
 def augment_after_merge(inputs, output):
-    return tf.image.rot90(inputs, k=random.randint(0, 4)), output
+    k = tf.random.uniform([], 0, 4, dtype=tf.int32)
+    return tf.image.rot90(inputs, k=k), output
+
+
+def dihedral_step(patches, mask, spatial, permutation, signs):
+    """Applies a spatial transform and its vector transform where mask."""
+    transformed = spatial(patches)
+    if permutation is not None:
+        transformed = tf.gather(transformed, permutation, axis=-1) * signs
+    return tf.where(mask[:, None, None, None], transformed, patches)
+
+
+def vector_transforms(num_channels, vector_channels):
+    """Returns the channel permutation and signs of each dihedral step.
+
+    Wind vectors (u eastward, v northward) are transformed with the patches:
+    transposing rows and columns maps (u, v) to (-v, -u), reversing the
+    rows negates v and reversing the columns negates u.
+    """
+    if not vector_channels:
+        return [(None, None)] * 3
+    permutation = list(range(num_channels))
+    transpose_signs = [1.0] * num_channels
+    rows_signs = [1.0] * num_channels
+    cols_signs = [1.0] * num_channels
+    for u, v in vector_channels:
+        permutation[u], permutation[v] = v, u
+        transpose_signs[u] = transpose_signs[v] = -1.0
+        rows_signs[v] = -1.0
+        cols_signs[u] = -1.0
+    identity = list(range(num_channels))
+    return [(permutation, tf.constant(transpose_signs)),
+            (identity, tf.constant(rows_signs)),
+            (identity, tf.constant(cols_signs))]
+
+
+def batch_augmentation(input_bands):
+    """Returns a map function applying random rotations and flips to batches.
+
+    Every sample of a batch gets an independent, uniformly drawn element of
+    the 8 rotations and reflections of the square, the same for all its
+    inputs. Wind u/v bands are rotated with the patches, scalar date bands
+    (1x1 patches) and outputs are unchanged.
+
+    Parameters
+    ----------
+    input_bands : list[list[str]]
+        Groups of bands of the batched inputs
+
+    Returns
+    -------
+    function
+        Map function of (inputs..., outputs) batches
+
+    """
+    transforms = [vector_transforms(len(bands), wind_pairs(bands))
+                  for bands in input_bands]
+    spatials = [lambda x: tf.transpose(x, [0, 2, 1, 3]),
+                lambda x: tf.reverse(x, [1]),
+                lambda x: tf.reverse(x, [2])]
+
+    def augment(*elements):
+        inputs, output = elements[:-1], elements[-1]
+        batch_size = tf.shape(inputs[0])[0]
+        masks = [tf.random.uniform([batch_size]) < 0.5 for _ in spatials]
+        augmented = []
+        for patches, steps in zip(inputs, transforms):
+            for mask, spatial, (permutation, signs) in zip(masks, spatials,
+                                                           steps):
+                patches = dihedral_step(patches, mask, spatial, permutation,
+                                        signs)
+            augmented.append(patches)
+        return tuple(augmented) + (output,)
+    return augment
+
+def center_crop_groups(crop_sizes):
+    """Returns a map function cropping the center of each input group.
+
+    Parameters
+    ----------
+    crop_sizes : list[int]
+        Odd height and width of each input group, None to keep a group.
+        Patches must have static shapes.
+
+    Returns
+    -------
+    function
+        Map function of (inputs..., outputs), batched or not
+
+    """
+    def crop(*elements):
+        cropped = []
+        for patches, size in zip(elements[:-1], crop_sizes):
+            if size is not None:
+                offset = (patches.shape[-3] - size) // 2
+                patches = patches[..., offset:offset + size,
+                                  offset:offset + size, :]
+            cropped.append(patches)
+        return tuple(cropped) + (elements[-1],)
+    return crop
+
+
+def group_inputs(*elements):
+    """Returns the (inputs, outputs) pair of a multi input model."""
+    return tuple(elements[:-1]), elements[-1]
+
 
 def scale_no2(inputs, output):
     return inputs, output*10000.0
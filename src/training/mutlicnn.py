@@ -15,12 +15,12 @@ limitations under the License.
 '''
 
 
-from tensorflow.python.keras import layers
-from tensorflow.python.keras import losses
-from tensorflow.python.keras import models
-from tensorflow.python.keras import metrics
-from tensorflow.python.keras import optimizers
-#from tensorflow.python.keras import activations
+from tensorflow.keras import layers
+from tensorflow.keras import losses
+from tensorflow.keras import models
+from tensorflow.keras import metrics
+from tensorflow.keras import optimizers
+#from tensorflow.keras import activations
 
 def conv_block(input_tensor, num_filters, kernel_size=(3,3),
                                normalize = True,                    
@@ -38,24 +38,69 @@ def encoder_pool(input_tensor, num_filters):
 	encoder_pool = layers.MaxPooling2D((2, 2), strides=(2, 2))(encoder)
 	return encoder_pool
 
-def reduction_block(inp):
-    normalized_input = layers.BatchNormalization()(inp)
-    encoder0 = encoder_pool(normalized_input, 32) # 128x128x32
-    encoder1 = encoder_pool(encoder0, 64) # 64x64x64
-    encoder2 = encoder_pool(encoder1, 128) # 32x32x128
-    encoder3 = encoder_pool(encoder2, 256) # 16x16x256
-    encoder4 = encoder_pool(encoder3, 128) # 8x8x256
-    encoder5 = encoder_pool(encoder4, 16) # 4x4x16
-    return encoder5
-
-def get_model(inputs):
-    outputs = [reduction_block(inp) for inp in inputs]
-    encoder = layers.Concatenate(axis=-1)(outputs)
-    
-    encoder0 = encoder_pool(encoder, 32) # 4x4x32
-    encoder1 = encoder_pool(encoder0, 64) # 2x2x64
-    encoder2 = encoder_pool(encoder1, 1) # 1x1x1
+# Filters of the last pooling blocks of a branch, the first ones use 32
+REDUCTION_FILTERS = [32, 64, 128, 256, 128, 16]
+
+
+def reduction_block(inp, normalize_input=True, output_size=4, resolution=1):
+    """Reduces a branch to output_size x output_size features.
+
+    Branches of any size reducing to output_size by halving are supported,
+    e.g. 257x257 patches or 9x9 center crops. Scalar groups (1x1) are only
+    tiled to output_size.
+    """
+    size = inp.shape[1]
+    if size == 1:
+        return layers.UpSampling2D((output_size, output_size))(inp)
+    normalized_input = inp
+    if normalize_input:
+        normalized_input = layers.BatchNormalization()(inp)
+    if resolution > 1:
+        # Coarse bands are averaged before the convolutions
+        normalized_input = layers.AveragePooling2D(
+            (resolution, resolution))(normalized_input)
+        size //= resolution
+    num_pools = 0
+    while size // 2 >= output_size:
+        size //= 2
+        num_pools += 1
+    if size != output_size:
+        raise ValueError("A %ix%i branch does not reduce to %ix%i" % (
+            inp.shape[1], inp.shape[2], output_size, output_size))
+    filters = [32] * max(num_pools - len(REDUCTION_FILTERS), 0) + \
+        REDUCTION_FILTERS[len(REDUCTION_FILTERS) - min(
+            num_pools, len(REDUCTION_FILTERS)):]
+    encoder = normalized_input
+    for num_filters in filters:
+        encoder = encoder_pool(encoder, num_filters)  # 257x257 -> 4x4x16
+    return encoder
+
+def get_model(inputs, normalize_input=True, resolutions=None):
+    """Returns a model with a branch per band group.
+
+    Parameters
+    ----------
+    inputs : list[Input]
+        One input per band group, with defined spatial shapes
+    normalize_input : bool, optional
+        Adds a BatchNormalization on each input. The default is True.
+    resolutions : list[int], optional
+        Downsampling factor of each input. The default is None for 1.
+
+    Returns
+    -------
+    Model
+
+    """
+    resolutions = resolutions or [1] * len(inputs)
+    outputs = [reduction_block(inp, normalize_input, resolution=resolution)
+               for inp, resolution in zip(inputs, resolutions)]
+    encoder = layers.Concatenate(axis=-1)(outputs)  # 4x4
+
+    encoder0 = encoder_pool(encoder, 32) # 2x2x32
+    encoder1 = encoder_pool(encoder0, 64) # 1x1x64
+    encoder2 = layers.Conv2D(1, (1, 1), activation='softplus')(encoder1) # 1x1x1
 
-    model = models.Model(inputs=[inputs], outputs=[encoder2])
+    model = models.Model(inputs=inputs, outputs=[encoder2])
     
-    return model
\ No newline at end of file
+    return model
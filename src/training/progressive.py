@@ -0,0 +1,120 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import time
+import tensorflow as tf
+from tensorflow.keras import callbacks
+
+
+def parse_crop_schedule(schedule):
+    """Parses a "epoch:size,epoch:size" schedule of crop sizes.
+
+    Parameters
+    ----------
+    schedule : str
+        Comma separated first epoch and odd crop size, e.g.
+        "0:65,20:129,50:257"
+
+    Returns
+    -------
+    list[tuple]
+        (first epoch, crop size) sorted by epoch
+
+    """
+    steps = sorted(tuple(int(value) for value in item.split(':'))
+                   for item in schedule.split(',') if item)
+    assert steps and steps[0][0] == 0, "The schedule should start at epoch 0"
+    return steps
+
+
+def crop_size_at(schedule, epoch):
+    """Returns the crop size of an epoch of a parsed schedule."""
+    return [size for first_epoch, size in schedule if first_epoch <= epoch][-1]
+
+
+class ThroughputCallback(callbacks.Callback):
+    """Adds the training records per second of each epoch to the logs.
+
+    Only the training batches are timed, validation is excluded.
+    """
+
+    def __init__(self, batch_size):
+        super().__init__()
+        self.batch_size = batch_size
+        self.start = self.end = None
+        self.num_batches = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = self.end = time.time()
+        self.num_batches = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.num_batches += 1
+        self.end = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        throughput = self.num_batches * self.batch_size / max(
+            self.end - self.start, 1e-9)
+        if logs is not None:
+            logs['records_per_second'] = throughput
+        print("Epoch %i: %.1f records/s" % (epoch + 1, throughput))
+
+
+class ProgressiveCrop:
+    """Center crops of the training patches, growing over the epochs."""
+
+    def __init__(self, schedule):
+        """Initializes the ProgressiveCrop at the size of epoch 0.
+
+        Parameters
+        ----------
+        schedule : list[tuple]
+            (first epoch, crop size) of parse_crop_schedule
+
+        """
+        self.schedule = schedule
+        self.size = tf.Variable(crop_size_at(schedule, 0), dtype=tf.int32,
+                                trainable=False)
+
+    def crop(self, *elements):
+        """Map function cropping the batched inputs, outputs are kept.
+
+        The size is read when a batch is produced, so batches prefetched
+        before a change of size keep the previous size.
+        """
+        cropped = []
+        for patches in elements[:-1]:
+            size = tf.minimum(self.size, tf.shape(patches)[1])
+            offset = (tf.shape(patches)[1] - size) // 2
+            cropped.append(patches[:, offset:offset + size,
+                                   offset:offset + size, :])
+        return tuple(cropped) + (elements[-1],)
+
+    def callback(self):
+        """Returns a Keras callback updating the size before every epoch."""
+        progressive_crop = self
+
+        class CropCallback(callbacks.Callback):
+
+            def on_epoch_begin(self, epoch, logs=None):
+                progressive_crop.size.assign(
+                    crop_size_at(progressive_crop.schedule, epoch))
+
+            def on_epoch_end(self, epoch, logs=None):
+                if logs is not None:
+                    logs['crop_size'] = int(progressive_crop.size.numpy())
+
+        return CropCallback()
@@ -0,0 +1,223 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+from training.schema import is_patch_feature
+
+QUANTIZATION_FILE = 'quantization.json'
+# Little endian numpy and tensorflow types of each encoding
+ENCODINGS = {'float16': ('<f2', tf.float16), 'int16': ('<i2', tf.int16)}
+INT16_MAX = 32767
+
+
+def compute_quantization(files, features_dict, encoding='int16',
+                         max_records=None):
+    """Computes the per-band scale and offset of the patch bands.
+
+    For int16, the [min, max] range of each band is mapped to
+    [-INT16_MAX, INT16_MAX]. For float16, values are only cast.
+
+    Parameters
+    ----------
+    files : list[str]
+        TFRecord files to compute the ranges from
+    features_dict : dict
+        Features of the TFRecords
+    encoding : str, optional
+        'int16' or 'float16'. The default is 'int16'.
+    max_records : int, optional
+        Number of records used to compute the ranges.
+        The default is None to use all records.
+
+    Returns
+    -------
+    dict
+        {"dtype", "scale", "offset"} of each patch band
+
+    """
+    assert encoding in ENCODINGS, "encoding should be in %s" % list(ENCODINGS)
+    patch_bands = [band for band, feature in features_dict.items()
+                   if is_patch_feature(feature)]
+    if encoding == 'float16':
+        return {band: {'dtype': encoding, 'scale': 1.0, 'offset': 0.0}
+                for band in patch_bands}
+    dataset = tf.data.TFRecordDataset(files, compression_type='GZIP')
+    if max_records:
+        dataset = dataset.take(max_records)
+    dataset = dataset.map(lambda x: tf.io.parse_single_example(
+        x, {band: features_dict[band] for band in patch_bands}))
+    minimums = {band: np.inf for band in patch_bands}
+    maximums = {band: -np.inf for band in patch_bands}
+    for batch in dataset.batch(64).as_numpy_iterator():
+        for band in patch_bands:
+            minimums[band] = min(minimums[band], float(batch[band].min()))
+            maximums[band] = max(maximums[band], float(batch[band].max()))
+    spec = {}
+    for band in patch_bands:
+        offset = (maximums[band] + minimums[band]) / 2
+        scale = (maximums[band] - minimums[band]) / (2 * INT16_MAX) or 1.0
+        spec[band] = {'dtype': encoding, 'scale': scale, 'offset': offset}
+    return spec
+
+
+def encode_band(value, band_spec):
+    """Returns the bytes of a quantized numpy array."""
+    scaled = (value - band_spec['offset']) / band_spec['scale']
+    if band_spec['dtype'] == 'int16':
+        scaled = np.clip(np.round(scaled), -INT16_MAX, INT16_MAX)
+    return scaled.astype(ENCODINGS[band_spec['dtype']][0]).tobytes()
+
+
+def quantize_tfrecords(files, output_path, features_dict, spec):
+    """Writes quantized copies of TFRecord files.
+
+    Bands of spec are stored as raw bytes, other bands are kept as floats.
+    The spec is saved to output_path/quantization.json, which is read by
+    load_quantization.
+
+    Parameters
+    ----------
+    files : list[str]
+        TFRecord files to convert
+    output_path : str
+        Folder of the converted files, file names are kept
+    features_dict : dict
+        Features of the TFRecords
+    spec : dict
+        Quantization returned by compute_quantization
+
+    Returns
+    -------
+    None.
+
+    """
+    os.makedirs(output_path, exist_ok=True)
+    for file in files:
+        dataset = tf.data.TFRecordDataset(file, compression_type='GZIP')
+        dataset = dataset.map(lambda x: tf.io.parse_single_example(
+            x, features_dict))
+        output_file = os.path.join(output_path, os.path.basename(file))
+        with tf.io.TFRecordWriter(output_file, options='GZIP') as writer:
+            for parsed in dataset.as_numpy_iterator():
+                feature = {}
+                for band, value in parsed.items():
+                    if band in spec:
+                        feature[band] = tf.train.Feature(
+                            bytes_list=tf.train.BytesList(
+                                value=[encode_band(value, spec[band])]))
+                    else:
+                        feature[band] = tf.train.Feature(
+                            float_list=tf.train.FloatList(
+                                value=value.ravel()))
+                example = tf.train.Example(
+                    features=tf.train.Features(feature=feature))
+                writer.write(example.SerializeToString())
+    json.dump(spec, open(os.path.join(output_path, QUANTIZATION_FILE), 'w'),
+              indent=2)
+
+
+def load_quantization(tfrecords_path):
+    """Returns the quantization of a folder, None if it is not quantized."""
+    spec_file = os.path.join(tfrecords_path, QUANTIZATION_FILE)
+    if not os.path.exists(spec_file):
+        return None
+    return json.load(open(spec_file, 'r'))
+
+
+def quantized_features_dict(features_dict, spec):
+    """Returns the parsing features of quantized TFRecords."""
+    return {band: tf.io.FixedLenFeature([], tf.string) if band in spec
+            else feature for band, feature in features_dict.items()}
+
+
+def dequantize(inputs, features_dict, spec):
+    """Decodes the quantized bands of parsed tensors to float32.
+
+    Parameters
+    ----------
+    inputs : dict
+        Tensors parsed with quantized_features_dict, batched or not
+    features_dict : dict
+        Features of the original TFRecords, used for the band shapes
+    spec : dict
+        Quantization of the TFRecords
+
+    Returns
+    -------
+    dict
+        inputs with float32 quantized bands
+
+    """
+    inputs = dict(inputs)
+    for band, band_spec in spec.items():
+        if band not in inputs:
+            continue
+        decoded = tf.io.decode_raw(inputs[band],
+                                   ENCODINGS[band_spec['dtype']][1])
+        # Leading dimension is kept for batches parsed with parse_example
+        shape = tf.concat([tf.shape(inputs[band]),
+                           features_dict[band].shape], 0)
+        decoded = tf.reshape(tf.cast(decoded, tf.float32), shape)
+        decoded.set_shape(inputs[band].shape.concatenate(
+            features_dict[band].shape))
+        inputs[band] = decoded * band_spec['scale'] + band_spec['offset']
+    return inputs
+
+
+def benchmark_decoding(files, features_dict, spec=None, num_records=1000):
+    """Measures the record size and the decoding throughput of TFRecords.
+
+    Parameters
+    ----------
+    files : list[str]
+        TFRecord files to benchmark
+    features_dict : dict
+        Features of the original TFRecords
+    spec : dict, optional
+        Quantization of the files. The default is None for float32 files.
+    num_records : int, optional
+        Number of records decoded. The default is 1000.
+
+    Returns
+    -------
+    dict
+        "bytes_per_record" (compressed) and "records_per_second" decoded
+
+    """
+    num_bytes = sum(os.path.getsize(file) for file in files)
+    dataset = tf.data.TFRecordDataset(files, compression_type='GZIP')
+    num_total = int(dataset.reduce(0, lambda count, _: count + 1))
+    parse_features = features_dict
+    if spec:
+        parse_features = quantized_features_dict(features_dict, spec)
+
+    def decode(example_proto):
+        inputs = tf.io.parse_single_example(example_proto, parse_features)
+        if spec:
+            inputs = dequantize(inputs, features_dict, spec)
+        return inputs
+
+    dataset = dataset.take(num_records).map(decode)
+    start = time.time()
+    num_decoded = int(dataset.reduce(0, lambda count, _: count + 1))
+    elapsed = time.time() - start
+    return {'bytes_per_record': num_bytes / max(num_total, 1),
+            'records_per_second': num_decoded / elapsed}
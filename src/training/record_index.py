@@ -0,0 +1,418 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import gzip
+import json
+import os
+import re
+import struct
+import zlib
+import multiprocessing
+import numpy as np
+from tensorflow.core.example import example_pb2
+
+from training.dataset_cache import file_fingerprint
+
+INDEX_FILE = 'index.json'
+KEYS_FILE = 'keys.npz'
+# Scalar bands stored in the index for every record
+KEY_BANDS = ['latitude', 'longitude', 'HOD', 'DOW', 'DOM', 'MOY']
+# SampleExporter.export_tasks writes <export_id>_<shard>.tfrecord.gz
+EXPORT_FILE = re.compile(r'^(.*)_\d+\.tfrecord(\.gz)?$')
+# TFRecord framing: uint64 length, uint32 crc, data, uint32 crc
+HEADER_SIZE = 12
+FOOTER_SIZE = 4
+
+
+def index_file(file, output_file, compress=True):
+    """Copies a GZIP TFRecord file for random access and returns its offsets.
+
+    Parameters
+    ----------
+    file : str
+        GZIP TFRecord file
+    output_file : str
+        Local copy of the file
+    compress : bool, optional
+        Compresses each record separately with zlib, without the TFRecord
+        framing. Else output_file is an uncompressed TFRecord file.
+        The default is True.
+
+    Returns
+    -------
+    offsets : list[int]
+        Offsets of the stored records in output_file
+    lengths : list[int]
+        Lengths of the stored records
+    keys : list[list[float]]
+        KEY_BANDS values of the records, NaN if missing
+
+    """
+    offsets, lengths, keys = [], [], []
+    position = 0
+    with gzip.open(file, 'rb') as source, open(output_file, 'wb') as output:
+        while True:
+            header = source.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                break
+            length = struct.unpack('<Q', header[:8])[0]
+            record = source.read(length + FOOTER_SIZE)
+            if len(record) < length + FOOTER_SIZE:
+                raise IOError("Truncated record in %s" % file)
+            keys.append(record_keys(record[:length]))
+            if compress:
+                data = zlib.compress(record[:length])
+                output.write(data)
+                offsets.append(position)
+                lengths.append(len(data))
+                position += len(data)
+            else:
+                output.write(header)
+                output.write(record)
+                offsets.append(position + HEADER_SIZE)
+                lengths.append(length)
+                position += HEADER_SIZE + length + FOOTER_SIZE
+    return offsets, lengths, keys
+
+
+def iter_records(file):
+    """Yields the serialized records of a GZIP TFRecord file, in order."""
+    with gzip.open(file, 'rb') as source:
+        while True:
+            header = source.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                return
+            length = struct.unpack('<Q', header[:8])[0]
+            record = source.read(length + FOOTER_SIZE)
+            if len(record) < length + FOOTER_SIZE:
+                raise IOError("Truncated record in %s" % file)
+            yield record[:length]
+
+
+def record_keys(serialized):
+    """Returns the KEY_BANDS values of a serialized tf.train.Example."""
+    feature = example_pb2.Example.FromString(serialized).features.feature
+    keys = []
+    for band in KEY_BANDS:
+        values = feature[band].float_list.value if band in feature else []
+        keys.append(values[0] if len(values) else np.nan)
+    return keys
+
+
+def export_id(file):
+    """Returns the export id of an exported TFRecord file."""
+    match = EXPORT_FILE.match(os.path.basename(file))
+    return match.group(1) if match else os.path.basename(file)
+
+
+def _index_file(args):
+    return index_file(*args)
+
+
+def build_record_index(files, index_path, processes=None, compress=True):
+    """Builds an index of the records of GZIP TFRecord files.
+
+    Each file is copied once to index_path, so that any record can be read
+    with a single positional read at its offset. Records of the copies are
+    compressed one by one, so they take about the disk space of the GZIP
+    files, or are stored uncompressed to skip their decompression at read
+    time. The KEY_BANDS and export id of every record are stored with the
+    offsets, to select records without reading them.
+
+    Parameters
+    ----------
+    files : list[str]
+        GZIP TFRecord files
+    index_path : str
+        Folder of the index and of the uncompressed copies
+    processes : int, optional
+        Number of files indexed in parallel. The default is None for the
+        number of CPUs.
+    compress : bool, optional
+        Compresses the records of the copies. The default is True.
+
+    Returns
+    -------
+    RecordIndex
+
+    """
+    os.makedirs(index_path, exist_ok=True)
+    arrays = _index_files(files, index_path, processes, compress)
+    _write_index(index_path, files, *arrays, compress=compress)
+    return RecordIndex(index_path)
+
+
+def _index_files(files, index_path, processes, compress):
+    """Indexes files in parallel and returns the arrays of the index."""
+    suffix = '.z' if compress else ''
+    local_files = [os.path.basename(file).replace('.gz', '') + suffix
+                   for file in files]
+    processes = max(min(processes or os.cpu_count(), len(files)), 1)
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        results = pool.map(_index_file,
+                           [(file, os.path.join(index_path, local_file),
+                             compress)
+                            for file, local_file in zip(files, local_files)])
+    file_ids = np.concatenate([np.full(len(offsets), i, dtype=np.int32)
+                               for i, (offsets, _, _) in enumerate(results)] +
+                              [np.zeros(0, dtype=np.int32)])
+    offsets = np.array([o for offsets, _, _ in results for o in offsets],
+                       dtype=np.int64)
+    lengths = np.array([l for _, lengths, _ in results for l in lengths],
+                       dtype=np.int64)
+    keys = np.array([k for _, _, keys in results for k in keys],
+                    dtype=np.float32).reshape(-1, len(KEY_BANDS))
+    return local_files, file_ids, offsets, lengths, keys
+
+
+def _write_index(index_path, files, local_files, file_ids, offsets, lengths,
+                 keys, compress=True):
+    """Writes the arrays of an index, index.json is written last."""
+    np.save(os.path.join(index_path, 'file_ids.npy'), file_ids)
+    np.save(os.path.join(index_path, 'offsets.npy'), offsets)
+    np.save(os.path.join(index_path, 'lengths.npy'), lengths)
+    np.savez(os.path.join(index_path, KEYS_FILE),
+             **{band: keys[:, i] for i, band in enumerate(KEY_BANDS)})
+    json.dump({'sources': [os.path.abspath(file) for file in files],
+               'fingerprints': [file_fingerprint(file) for file in files],
+               'compressed': compress,
+               'files': local_files,
+               'export_ids': [export_id(file) for file in files]},
+              open(os.path.join(index_path, INDEX_FILE), 'w'), indent=2)
+
+
+class RecordIndex:
+    """Random access to the records of an index built by build_record_index."""
+
+    def __init__(self, index_path):
+        """Loads the index.
+
+        Parameters
+        ----------
+        index_path : str
+            Folder of the index
+
+        """
+        self.index_path = index_path
+        info = json.load(open(os.path.join(index_path, INDEX_FILE), 'r'))
+        self.sources = info['sources']
+        self.fingerprints = info.get('fingerprints')
+        self.compressed = info.get('compressed', False)
+        self.files = [os.path.join(index_path, f) for f in info['files']]
+        self.file_ids = np.load(os.path.join(index_path, 'file_ids.npy'))
+        self.offsets = np.load(os.path.join(index_path, 'offsets.npy'))
+        self.lengths = np.load(os.path.join(index_path, 'lengths.npy'))
+        self.keys = dict(np.load(os.path.join(index_path, KEYS_FILE)))
+        # Export ids are stored per file, keys['export_id'] indexes them
+        self.export_ids = sorted(set(info['export_ids']))
+        file_export_ids = np.array([self.export_ids.index(e)
+                                    for e in info['export_ids']] + [0],
+                                   dtype=np.int32)
+        self.keys['export_id'] = file_export_ids[self.file_ids]
+        self.descriptors = {}
+
+    def __len__(self):
+        """Returns the number of indexed records."""
+        return len(self.offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Closes the files opened by read, they are reopened if needed."""
+        descriptors, self.descriptors = self.descriptors, {}
+        for descriptor in descriptors.values():
+            os.close(descriptor)
+
+    def _descriptor(self, file_id):
+        if file_id not in self.descriptors:
+            self.descriptors[file_id] = os.open(self.files[file_id],
+                                                os.O_RDONLY)
+        return self.descriptors[file_id]
+
+    def read(self, record_id):
+        """Returns the serialized record, thread safe.
+
+        Parameters
+        ----------
+        record_id : int
+            Position of the record in the index
+
+        Returns
+        -------
+        bytes
+
+        """
+        record_id = int(record_id)
+        descriptor = self._descriptor(int(self.file_ids[record_id]))
+        data = os.pread(descriptor, int(self.lengths[record_id]),
+                        int(self.offsets[record_id]))
+        return zlib.decompress(data) if self.compressed else data
+
+    def read_batch(self, record_ids):
+        """Returns the serialized records as an object array."""
+        records = np.empty(len(record_ids), dtype=object)
+        for i, record_id in enumerate(record_ids):
+            records[i] = self.read(record_id)
+        return records
+
+    def select(self, predicate, record_ids=None):
+        """Returns the ids of the records matching a predicate on the keys.
+
+        Parameters
+        ----------
+        predicate : function
+            Takes the dictionary of key arrays (KEY_BANDS and 'export_id')
+            and returns a boolean array
+        record_ids : np.ndarray, optional
+            Ids to select from. The default is None for all records.
+
+        Returns
+        -------
+        np.ndarray
+            Sorted ids of the matching records
+
+        """
+        mask = np.asarray(predicate(self.keys), dtype=bool)
+        selected = np.flatnonzero(mask)
+        if record_ids is not None:
+            selected = np.intersect1d(selected, record_ids)
+        return selected
+
+    @staticmethod
+    def shard(record_ids, num_shards, shard_index):
+        """Returns a shard of record ids, shards differ by at most 1 record.
+
+        Parameters
+        ----------
+        record_ids : np.ndarray
+            Ids to shard
+        num_shards : int
+            Number of workers
+        shard_index : int
+            Index of the worker
+
+        Returns
+        -------
+        np.ndarray
+
+        """
+        return np.array_split(np.asarray(record_ids), num_shards)[shard_index]
+
+
+def block_folds(block_ids, num_folds):
+    """Assigns integer block ids to folds with a deterministic hash."""
+    block_ids = np.asarray(block_ids, dtype=np.int64)
+    return (block_ids * 2654435761 % 4294967296) % num_folds
+
+
+def spatial_folds(keys, block_degrees=1.0, num_folds=5):
+    """Returns the fold of each record, by latitude/longitude blocks.
+
+    Parameters
+    ----------
+    keys : dict
+        Key arrays of a RecordIndex
+    block_degrees : float, optional
+        Size of the square blocks in degrees. The default is 1.0.
+    num_folds : int, optional
+        Number of folds. The default is 5.
+
+    Returns
+    -------
+    np.ndarray
+        Fold of each record
+
+    """
+    rows = np.floor((keys['latitude'] + 90) / block_degrees)
+    cols = np.floor((keys['longitude'] + 180) / block_degrees)
+    return block_folds(rows * int(np.ceil(360 / block_degrees)) + cols,
+                       num_folds)
+
+
+def temporal_folds(keys, band='MOY', num_folds=5):
+    """Returns the fold of each record, by blocks of a date band."""
+    return block_folds(keys[band], num_folds)
+
+
+def eval_records(index, split='file', eval_fold=0, eval_files=()):
+    """Returns whether each record of an index is held out for evaluation.
+
+    Parameters
+    ----------
+    index : RecordIndex
+        Index of the records
+    split : str, optional
+        'file' holds out the records of eval_files, 'spatial' and
+        'temporal' the blocks of eval_fold. The default is 'file'.
+    eval_fold : int, optional
+        Fold of the evaluation blocks. The default is 0.
+    eval_files : list[str], optional
+        Evaluation files of a file split. The default is ().
+
+    Returns
+    -------
+    np.ndarray
+        Boolean mask of the records
+
+    """
+    if split == 'spatial':
+        return spatial_folds(index.keys) == eval_fold
+    if split == 'temporal':
+        return temporal_folds(index.keys) == eval_fold
+    eval_sources = [os.path.abspath(f) for f in eval_files]
+    return np.isin(index.file_ids,
+                   [index.sources.index(f) for f in eval_sources])
+
+
+def load_record_index(files, index_path, processes=None, compress=True):
+    """Loads the index of files, building it if it is missing or stale.
+
+    The index is stale if a file was added, removed or rewritten, as
+    compared by path, size and modification time. The copies of the files
+    removed from a stale index are deleted.
+
+    Parameters
+    ----------
+    files : list[str]
+        GZIP TFRecord files
+    index_path : str
+        Folder of the index
+    processes : int, optional
+        Number of files indexed in parallel. The default is None for the
+        number of CPUs.
+    compress : bool, optional
+        Compresses the records of a built index. The default is True.
+
+    Returns
+    -------
+    RecordIndex
+
+    """
+    if os.path.exists(os.path.join(index_path, KEYS_FILE)):
+        index = RecordIndex(index_path)
+        if index.fingerprints == [file_fingerprint(file) for file in files]:
+            return index
+        index.close()
+        built = build_record_index(files, index_path, processes, compress)
+        for file in set(index.files) - set(built.files):
+            if os.path.exists(file):
+                os.remove(file)
+        return built
+    return build_record_index(files, index_path, processes, compress)
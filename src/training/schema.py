@@ -0,0 +1,155 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import json
+import os
+import random
+import tensorflow as tf
+
+# Bands exported by export_data.py, grouped as the inputs of the models
+SPECTRAL_BANDS = ["patch_%s" % b for b in ['B', 'G', 'R', 'N', 'P']]
+TROPO_BANDS = ['patch_cloud_fraction']
+DSM_BANDS = ['patch_dsm']
+WIND_BANDS = ["patch_%i_%s" % (i, b) for i in range(11, -1, -1)
+              for b in ['u_component_of_wind_10m', 'v_component_of_wind_10m']]
+ROAD_BANDS = ['patch_num_observations']
+DATE_BANDS = ['longitude', 'latitude', 'HOD', 'DOW', 'DOM', 'MOY']
+OUTPUT_BANDS = ['tropospheric_NO2_column_number_density']
+
+INPUT_BANDS = [SPECTRAL_BANDS, TROPO_BANDS, DSM_BANDS, WIND_BANDS, ROAD_BANDS,
+               DATE_BANDS]
+PATCH_BANDS = (SPECTRAL_BANDS + TROPO_BANDS + DSM_BANDS + WIND_BANDS +
+               ROAD_BANDS)
+BAND_GROUPS = {'spectral': SPECTRAL_BANDS, 'tropo': TROPO_BANDS,
+               'dsm': DSM_BANDS, 'wind': WIND_BANDS, 'road': ROAD_BANDS,
+               'date': DATE_BANDS}
+TFRECORD_SUFFIX = '.tfrecord.gz'
+# Train/eval split written by train_models.py next to its checkpoints
+SPLIT_FILE = 'split.json'
+
+
+def is_patch_feature(feature):
+    """Returns True if the feature is a patch, False if it is a scalar."""
+    return list(feature.shape) != [1, 1]
+
+
+def get_features_dict(kernel_radius, patch_bands=PATCH_BANDS,
+                      scalar_bands=DATE_BANDS + OUTPUT_BANDS):
+    """Returns the parsing features of the exported TFRecords.
+
+    Parameters
+    ----------
+    kernel_radius : int
+        Radius of the exported patches
+    patch_bands : list[str], optional
+        Bands exported as patches. The default is PATCH_BANDS.
+    scalar_bands : list[str], optional
+        Bands exported as scalars. The default is DATE_BANDS + OUTPUT_BANDS.
+
+    Returns
+    -------
+    dict
+        tf.io.FixedLenFeature keyed by band name
+
+    """
+    patch_size = [2 * kernel_radius + 1] * 2
+    features_dict = {band: tf.io.FixedLenFeature(shape=patch_size,
+                                                 dtype=tf.float32)
+                     for band in patch_bands}
+    features_dict.update({band: tf.io.FixedLenFeature(shape=[1, 1],
+                                                      dtype=tf.float32)
+                          for band in scalar_bands})
+    return features_dict
+
+
+def select_bands(groups):
+    """Returns the bands of the named groups, in BAND_GROUPS order.
+
+    Parameters
+    ----------
+    groups : list[str]
+        Names of groups in BAND_GROUPS
+
+    Returns
+    -------
+    list[str]
+
+    """
+    unknown = set(groups) - set(BAND_GROUPS)
+    assert not unknown, "Unknown band groups %s" % sorted(unknown)
+    return [band for group, bands in BAND_GROUPS.items() if group in groups
+            for band in bands]
+
+
+def wind_pairs(bands):
+    """Returns the (u, v) channel indices of the wind bands in bands."""
+    pairs = []
+    for u, band in enumerate(bands):
+        if band.endswith('u_component_of_wind_10m'):
+            v_band = band.replace('u_component', 'v_component')
+            if v_band in bands:
+                pairs.append((u, bands.index(v_band)))
+    return pairs
+
+
+def list_tfrecords(path):
+    """Returns the sorted paths of the TFRecord files in a folder."""
+    return sorted(os.path.join(path, f) for f in os.listdir(path)
+                  if f.endswith(TFRECORD_SUFFIX))
+
+
+def split_tfrecords(files, seed=0, num_eval=10):
+    """Returns the training and evaluation files of a seeded shuffle.
+
+    The split only depends on the file names and the seed, so runs and
+    workers with the same seed hold out the same files and the datasets
+    cached on them keep their fingerprints. At most half of the files are
+    held out, so a few files still leave training files.
+
+    Parameters
+    ----------
+    files : list[str]
+        TFRecord files
+    seed : int, optional
+        Seed of the shuffle. The default is 0.
+    num_eval : int, optional
+        Maximum number of evaluation files. The default is 10.
+
+    Returns
+    -------
+    train_files : list[str]
+    eval_files : list[str]
+
+    """
+    assert len(files) >= 2, "At least 2 files are needed to split them"
+    files = sorted(files)
+    random.Random(seed).shuffle(files)
+    num_eval = min(num_eval, len(files) // 2)
+    return files[:-num_eval], files[-num_eval:]
+
+
+def save_split(path, train_files, eval_files, **extra):
+    """Writes the files of a train/eval split and its parameters."""
+    split = dict(extra, train_files=[os.path.abspath(f) for f in train_files],
+                 eval_files=[os.path.abspath(f) for f in eval_files])
+    with open(path, 'w') as file:
+        json.dump(split, file, indent=2)
+
+
+def load_split(path):
+    """Returns the split written by save_split."""
+    with open(path, 'r') as file:
+        return json.load(file)
@@ -0,0 +1,392 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import collections
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+from training.static_cache import StaticLayerCache, cache_regions
+
+# Scenes of a SceneCatalog, time -> folder in the StaticLayerCache layout
+SCENES_FILE = 'scenes.json'
+
+
+class LatencyStats:
+    """Latencies and batch sizes of the most recent predictions."""
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.start = time.time()
+        self.count = 0
+
+    def add_batch(self, latencies):
+        """Adds the latencies in seconds of the records of a batch."""
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.batch_sizes.append(len(latencies))
+            self.count += len(latencies)
+
+    def summary(self):
+        """Returns the p50 and p99 latencies, mean batch size and throughput.
+
+        Returns
+        -------
+        dict
+            "records", "p50_ms" and "p99_ms" of the window, "mean_batch_size"
+            and "records_per_second" since the start
+
+        """
+        with self.lock:
+            latencies = np.array(self.latencies)
+            batch_sizes = np.array(self.batch_sizes)
+            count = self.count
+        summary = {'records': count,
+                   'records_per_second': count / (time.time() - self.start)}
+        if count:
+            summary.update(
+                p50_ms=float(np.percentile(latencies, 50) * 1000),
+                p99_ms=float(np.percentile(latencies, 99) * 1000),
+                mean_batch_size=float(batch_sizes.mean()))
+        return summary
+
+
+class BatchingQueue:
+    """Groups concurrent records into batches run by a pool of workers."""
+
+    def __init__(self, predict_factory, max_batch_size=32, max_delay=0.01,
+                 num_workers=1):
+        """Initializes the BatchingQueue and starts its workers.
+
+        Parameters
+        ----------
+        predict_factory : function
+            Returns the function predicting a stacked batch of a worker,
+            called once per worker so that workers may own an interpreter
+        max_batch_size : int, optional
+            Maximum number of records per batch. The default is 32.
+        max_delay : float, optional
+            Seconds a record waits for others before its batch is run.
+            The default is 0.01.
+        num_workers : int, optional
+            Number of batches run concurrently. The default is 1.
+
+        """
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        self.stats = LatencyStats()
+        self.workers = [threading.Thread(target=self._work,
+                                         args=(predict_factory(),),
+                                         daemon=True)
+                        for _ in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, record):
+        """Queues a record, returns a Future of its prediction."""
+        future = Future()
+        self.queue.put((record, future, time.time()))
+        return future
+
+    def _next_batch(self):
+        """Waits for a record, then for others until the deadline."""
+        batch = [self.queue.get()]
+        deadline = batch[0][2] + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    # Records already queued still join the batch
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self, predict):
+        while True:
+            batch = self._next_batch()
+            records, futures, starts = zip(*batch)
+            try:
+                predictions = predict(np.stack(records))
+            except Exception as error:  # pylint: disable=broad-except
+                for future in futures:
+                    future.set_exception(error)
+                continue
+            end = time.time()
+            for future, prediction in zip(futures, predictions):
+                future.set_result(prediction)
+            self.stats.add_batch([end - start for start in starts])
+
+
+class NoSceneError(LookupError):
+    """No scene of a SceneCatalog covers a location at a time."""
+
+
+def build_scene_catalog(tiles_path, scene_catalog_path, catalog_path):
+    """Converts the scene tiles exported from EE to a SceneCatalog folder.
+
+    Each scene is cached in its own folder in the StaticLayerCache layout,
+    and scenes.json maps the ISO time of each scene to its folder.
+
+    Parameters
+    ----------
+    tiles_path : str
+        Folder of the tiles exported by export_data.py with --scene_catalog
+    scene_catalog_path : str
+        json file written by export_data.py with --scene_catalog, the grid
+        and ISO time of each exported scene
+    catalog_path : str
+        Folder of the catalog
+
+    Returns
+    -------
+    dict
+        ISO time -> folder of the cached scenes
+
+    """
+    scene_catalog = json.load(open(scene_catalog_path, 'r'))
+    scenes = {}
+    for export_id, scene in sorted(scene_catalog.items()):
+        grid = {key: value for key, value in scene.items() if key != 'time'}
+        if cache_regions(tiles_path, {export_id: grid},
+                         os.path.join(catalog_path, export_id)):
+            scenes[scene['time']] = export_id
+    json.dump(scenes, open(os.path.join(catalog_path, SCENES_FILE), 'w'),
+              indent=2)
+    return scenes
+
+
+class SceneCatalog:
+    """Patches of exported scenes, looked up by location and time."""
+
+    def __init__(self, catalog_path, bands, kernel_radius):
+        """Initializes the SceneCatalog.
+
+        Parameters
+        ----------
+        catalog_path : str
+            Folder of scenes.json, mapping the ISO time of each scene to a
+            folder written by build_static_cache with the bands of the scene
+        bands : list[str]
+            Stacked bands of the model
+        kernel_radius : int
+            Radius of the patches
+
+        """
+        scenes = json.load(open(os.path.join(catalog_path, SCENES_FILE), 'r'))
+        self.times = sorted(datetime.datetime.fromisoformat(scene_time)
+                            for scene_time in scenes)
+        self.caches = {}
+        for scene_time, folder in scenes.items():
+            cache = StaticLayerCache(os.path.join(catalog_path, folder),
+                                     kernel_radius)
+            missing = set(bands) - set(cache.bands)
+            assert not missing, "Scene %s misses %s" % (scene_time,
+                                                        sorted(missing))
+            self.caches[datetime.datetime.fromisoformat(scene_time)] = (
+                cache, [cache.bands.index(band) for band in bands])
+
+    def lookup(self, latitude, longitude, scene_time):
+        """Returns the patch of the latest scene covering a location.
+
+        Parameters
+        ----------
+        latitude : float
+        longitude : float
+        scene_time : str
+            ISO time, only the scenes at or before it are looked up
+
+        Raises
+        ------
+        NoSceneError
+            If no scene at or before scene_time covers the location
+
+        Returns
+        -------
+        np.ndarray
+            Patch of the bands of the catalog
+
+        """
+        scene_time = datetime.datetime.fromisoformat(scene_time)
+        for scene in reversed(self.times):
+            if scene > scene_time:
+                continue
+            cache, channels = self.caches[scene]
+            if cache.covers(latitude, longitude):
+                return cache.lookup(latitude, longitude)[..., channels]
+        raise NoSceneError("No scene covers (%g, %g) at or before %s" % (
+            latitude, longitude, scene_time.isoformat()))
+
+
+def serving_predict(predict, offsets=None, scales=None, output_scale=1.0):
+    """Wraps a batch prediction with the normalization of the training.
+
+    Parameters
+    ----------
+    predict : function
+        Predicts a float32 batch of normalized patches
+    offsets : np.ndarray, optional
+        Band offsets of normalization_constants. The default is None.
+    scales : np.ndarray, optional
+        Band scales of normalization_constants. The default is None.
+    output_scale : float, optional
+        Predictions are divided by it, e.g. the 10000 of scale_no2.
+        The default is 1.0.
+
+    Returns
+    -------
+    function
+        Predicts a batch of raw patches, one float per patch
+
+    """
+    def predict_batch(patches):
+        patches = patches.astype(np.float32)
+        if offsets is not None:
+            patches = (patches - offsets) * scales
+        return np.reshape(predict(patches), [len(patches)]) / output_scale
+    return predict_batch
+
+
+def make_handler(batching_queue, patch_shape, catalog=None, timeout=30):
+    """Returns the request handler of a prediction server.
+
+    POST /predict takes {"instances": [...]} where an instance is either
+    {"patch": HxWxC nested lists} or {"latitude": .., "longitude": ..,
+    "time": ISO time} with a catalog, and returns {"predictions": [...]}.
+    Location instances no scene covers are answered with a 422.
+    GET /stats returns the LatencyStats summary.
+
+    Parameters
+    ----------
+    batching_queue : BatchingQueue
+        Queue of the predictions
+    patch_shape : list[int]
+        HxWxC shape of the patches of the model
+    catalog : SceneCatalog, optional
+        Catalog of the location and time instances. The default is None.
+    timeout : float, optional
+        Seconds waited for a prediction. The default is 30.
+
+    Returns
+    -------
+    class
+
+    """
+    class PredictionHandler(BaseHTTPRequestHandler):
+
+        def _reply(self, code, body):
+            content = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _patch(self, instance):
+            if 'patch' in instance:
+                patch = np.asarray(instance['patch'], dtype=np.float32)
+            elif catalog is not None:
+                patch = catalog.lookup(instance['latitude'],
+                                       instance['longitude'],
+                                       instance['time'])
+            else:
+                raise ValueError("No scene catalog for location instances")
+            if list(patch.shape) != list(patch_shape):
+                raise ValueError("Patch of shape %s instead of %s" %
+                                 (list(patch.shape), list(patch_shape)))
+            return patch
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, batching_queue.stats.summary())
+            elif self.path == '/health':
+                self._reply(200, {'status': 'ok'})
+            else:
+                self._reply(404, {'error': 'Unknown path %s' % self.path})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._reply(404, {'error': 'Unknown path %s' % self.path})
+                return
+            try:
+                body = json.loads(self.rfile.read(
+                    int(self.headers.get('Content-Length', 0))))
+                patches = [self._patch(instance)
+                           for instance in body['instances']]
+            except NoSceneError as error:
+                self._reply(422, {'error': str(error)})
+                return
+            except (ValueError, KeyError, TypeError) as error:
+                self._reply(400, {'error': str(error)})
+                return
+            futures = [batching_queue.submit(patch) for patch in patches]
+            try:
+                predictions = [float(future.result(timeout))
+                               for future in futures]
+            except Exception as error:  # pylint: disable=broad-except
+                self._reply(500, {'error': str(error)})
+                return
+            self._reply(200, {'predictions': predictions})
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    return PredictionHandler
+
+
+def start_server(batching_queue, patch_shape, host='localhost', port=8080,
+                 catalog=None):
+    """Starts a prediction server in a background thread.
+
+    Parameters
+    ----------
+    batching_queue : BatchingQueue
+        Queue of the predictions
+    patch_shape : list[int]
+        HxWxC shape of the patches of the model
+    host : str, optional
+        The default is 'localhost'.
+    port : int, optional
+        The default is 8080, 0 picks a free port.
+    catalog : SceneCatalog, optional
+        Catalog of the location and time instances. The default is None.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        Running server, stopped by shutdown
+
+    """
+    class PredictionServer(ThreadingHTTPServer):
+        # Concurrent clients are queued instead of refused
+        request_queue_size = 128
+        daemon_threads = True
+
+    server = PredictionServer((host, port), make_handler(
+        batching_queue, patch_shape, catalog))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
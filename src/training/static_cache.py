@@ -0,0 +1,206 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import json
+import os
+import numpy as np
+import tensorflow as tf
+
+from training.load_data import TILE_FILE, group_files
+
+INDEX_FILE = 'index.json'
+
+
+def build_static_cache(tiles_path, static_index_path, cache_path):
+    """Converts static layer tiles exported from EE to a local cache.
+
+    Each region is stored as a HxWxC float32 .npy array so that it can be
+    memory mapped, and the grids of all regions are stored in index.json.
+
+    Parameters
+    ----------
+    tiles_path : str
+        Folder of the tiles exported by SampleExporter.export_static_layers
+    static_index_path : str
+        json file written by export_data.py with --static_index
+    cache_path : str
+        Folder of the cache
+
+    Returns
+    -------
+    None.
+
+    """
+    cache_regions(tiles_path, json.load(open(static_index_path, 'r')),
+                  cache_path)
+
+
+def cache_regions(tiles_path, static_index, cache_path):
+    """Converts the tiles of the regions of a static index to a cache.
+
+    Parameters
+    ----------
+    tiles_path : str
+        Folder of the tiles, named after their region id
+    static_index : dict
+        Grid of each region id, as SampleExporter.export_static_layers
+        returns them
+    cache_path : str
+        Folder of the cache
+
+    Returns
+    -------
+    list[str]
+        Ids of the cached regions, the ones whose tile was found
+
+    """
+    tiles = group_files(tiles_path, TILE_FILE)
+    os.makedirs(cache_path, exist_ok=True)
+    index = {}
+    for region_id, grid in static_index.items():
+        if region_id not in tiles:
+            print("Missing tile for %s" % region_id)
+            continue
+        features = {band: tf.io.FixedLenFeature(
+            [grid['height'], grid['width']], tf.float32)
+            for band in grid['bands']}
+        record = next(iter(tf.data.TFRecordDataset(tiles[region_id],
+                                                   compression_type='GZIP')))
+        parsed = tf.io.parse_single_example(record, features)
+        array = np.stack([parsed[band].numpy() for band in grid['bands']],
+                         axis=-1)
+        np.save(os.path.join(cache_path, region_id + '.npy'), array)
+        index[region_id] = grid
+    json.dump(index, open(os.path.join(cache_path, INDEX_FILE), 'w'))
+    return sorted(index)
+
+
+class StaticLayerCache:
+    """Local cache of static layers, looked up by latitude and longitude."""
+
+    def __init__(self, cache_path, kernel_radius):
+        """Initializes the StaticLayerCache.
+
+        Parameters
+        ----------
+        cache_path : str
+            Folder written by build_static_cache
+        kernel_radius : int
+            Radius of the patches returned by lookup
+
+        """
+        self.kernel_radius = kernel_radius
+        self.index = json.load(open(os.path.join(cache_path, INDEX_FILE), 'r'))
+        self.region_ids = sorted(self.index)
+        self.bands = self.index[self.region_ids[0]]['bands']
+        self.arrays = {region_id: np.load(os.path.join(cache_path,
+                                                       region_id + '.npy'),
+                                          mmap_mode='r')
+                       for region_id in self.region_ids}
+        # Bounding boxes (west, south, east, north) to locate the regions
+        self.bounds = np.array([self._bounds(self.index[region_id])
+                                for region_id in self.region_ids])
+
+    @staticmethod
+    def _bounds(grid):
+        x_res, _, west, _, y_res, north = grid['transform']
+        return [west, north + y_res * grid['height'],
+                west + x_res * grid['width'], north]
+
+    def _inside(self, latitude, longitude):
+        """Returns whether each region contains a location."""
+        return ((self.bounds[:, 0] <= longitude) &
+                (self.bounds[:, 1] <= latitude) &
+                (longitude < self.bounds[:, 2]) &
+                (latitude < self.bounds[:, 3]))
+
+    def covers(self, latitude, longitude):
+        """Returns whether a region of the cache contains a location."""
+        return bool(self._inside(latitude, longitude).any())
+
+    def lookup(self, latitude, longitude):
+        """Returns the static patch centered on latitude and longitude.
+
+        Pixels outside of the region are 0, as they are in the exported
+        patches of unmasked bands.
+
+        Parameters
+        ----------
+        latitude : float
+        longitude : float
+
+        Returns
+        -------
+        np.ndarray
+            float32 patch of shape (2r+1)x(2r+1)xC
+
+        """
+        latitude = float(np.reshape(latitude, -1)[0])
+        longitude = float(np.reshape(longitude, -1)[0])
+        size = 2 * self.kernel_radius + 1
+        patch = np.zeros([size, size, len(self.bands)], dtype=np.float32)
+        inside = self._inside(latitude, longitude)
+        if not inside.any():
+            return patch
+        region_id = self.region_ids[int(np.argmax(inside))]
+        x_res, _, west, _, y_res, north = self.index[region_id]['transform']
+        array = self.arrays[region_id]
+        row = int((latitude - north) / y_res) - self.kernel_radius
+        col = int((longitude - west) / x_res) - self.kernel_radius
+        top, left = max(row, 0), max(col, 0)
+        bottom = min(row + size, array.shape[0])
+        right = min(col + size, array.shape[1])
+        patch[top - row:bottom - row, left - col:right - col] = array[
+            top:bottom, left:right]
+        return patch
+
+    def lookup_batch(self, latitudes, longitudes):
+        """Returns the stacked static patches of a batch of locations."""
+        return np.stack([self.lookup(latitude, longitude) for
+                         latitude, longitude in zip(latitudes, longitudes)])
+
+    def attach(self, inputs, batched=False):
+        """Adds the static bands to a dictionary of parsed tensors.
+
+        Parameters
+        ----------
+        inputs : dict
+            Parsed tensors with 'latitude' and 'longitude' keys
+        batched : bool, optional
+            True if inputs were parsed with tf.io.parse_example.
+            The default is False.
+
+        Returns
+        -------
+        dict
+            inputs with a (2r+1)x(2r+1) tensor for each static band
+
+        """
+        size = 2 * self.kernel_radius + 1
+        if batched:
+            static = tf.numpy_function(self.lookup_batch,
+                                       [inputs['latitude'],
+                                        inputs['longitude']], tf.float32)
+            static.set_shape([None, size, size, len(self.bands)])
+        else:
+            static = tf.numpy_function(self.lookup, [inputs['latitude'],
+                                                     inputs['longitude']],
+                                       tf.float32)
+            static.set_shape([size, size, len(self.bands)])
+        inputs = dict(inputs)
+        for i, band in enumerate(self.bands):
+            inputs[band] = static[..., i]
+        return inputs
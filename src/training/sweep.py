@@ -0,0 +1,387 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import callbacks
+from tensorflow.keras import layers
+from tensorflow.keras import losses
+from tensorflow.keras import metrics
+from tensorflow.keras import optimizers
+
+from training.architectures import build_model
+from training.dataset_cache import dataset_fingerprint
+from training.load_data import load_batched_tfrecords, scale_no2
+from training.progressive import ThroughputCallback
+from training.record_index import iter_records
+
+# Hyperparameters of train_models.py, used for the ones a space leaves out
+DEFAULT_HPARAMS = {'learning_rate': 1e-5, 'optimizer': 'RMSprop',
+                   'batch_size': 32, 'loss': 'MeanSquaredError'}
+# Metric comparing trials whatever their loss
+MONITOR = 'val_root_mean_squared_error'
+COMPLETE_FILE = 'complete.json'
+
+
+def decode_arrays(files, features_dict, bands, output_bands, cache_path,
+                  static_cache=None, quantization=None, band_stats=None,
+                  max_records=None, batch_size=64):
+    """Decodes records once into memory mapped .npy arrays.
+
+    Outputs are scaled as in train_models.py. Arrays are reused while the
+    fingerprint of the files and of the decoding does not change.
+
+    Parameters
+    ----------
+    files : list[str]
+        GZIP TFRecord files
+    features_dict : dict
+        Features of the TFRecords
+    bands : list[str]
+        Stacked input bands
+    output_bands : list[str]
+        Stacked output bands
+    cache_path : str
+        Folder of the decoded arrays
+    static_cache : StaticLayerCache, optional
+        Cache of the static bands missing from the records.
+        The default is None.
+    quantization : dict, optional
+        Quantization of the records. The default is None.
+    band_stats : dict, optional
+        Statistics of load_band_stats normalizing the bands.
+        The default is None.
+    max_records : int, optional
+        Number of decoded records, all if None. The default is None.
+    batch_size : int, optional
+        Number of records decoded at once. The default is 64.
+
+    Returns
+    -------
+    str
+        Folder of inputs.npy and outputs.npy
+
+    Raises
+    ------
+    ValueError
+        If the files have no record.
+
+    """
+    fingerprint = dataset_fingerprint(
+        files, features_dict, [bands], output_bands,
+        quantization=quantization, band_stats=band_stats,
+        max_records=max_records)
+    path = os.path.join(cache_path, fingerprint)
+    if os.path.exists(os.path.join(path, COMPLETE_FILE)):
+        return path
+    num_records = sum(sum(1 for _ in iter_records(file)) for file in files)
+    if max_records:
+        num_records = min(num_records, max_records)
+    if num_records == 0:
+        raise ValueError("No record to decode in %i files" % len(files))
+    os.makedirs(path, exist_ok=True)
+    dataset = load_batched_tfrecords(files, features_dict, [bands],
+                                     output_bands, batch_size,
+                                     static_cache=static_cache,
+                                     quantization=quantization,
+                                     band_stats=band_stats)
+    if band_stats is None:
+        dataset = dataset.map(scale_no2)
+    arrays, offset = None, 0
+    for batch in dataset:
+        if arrays is None:
+            arrays = [np.lib.format.open_memmap(
+                os.path.join(path, name + '.npy'), mode='w+',
+                dtype=np.float32, shape=(num_records,) + tuple(
+                    tensor.shape[1:]))
+                for name, tensor in zip(['inputs', 'outputs'], batch)]
+        count = min(int(batch[0].shape[0]), num_records - offset)
+        for array, tensor in zip(arrays, batch):
+            array[offset:offset + count] = tensor.numpy()[:count]
+        offset += count
+        if offset == num_records:
+            break
+    for array in arrays:
+        array.flush()
+    json.dump({'records': num_records, 'files': len(files)},
+              open(os.path.join(path, COMPLETE_FILE), 'w'))
+    return path
+
+
+def load_array_dataset(path, batch_size, shuffle=True, seed=None):
+    """Loads batches of the arrays of decode_arrays without decoding.
+
+    The arrays are memory mapped, so trials reading the same arrays share
+    the pages cached by the OS.
+
+    Parameters
+    ----------
+    path : str
+        Folder returned by decode_arrays
+    batch_size : int
+        Number of records per batch
+    shuffle : bool, optional
+        Shuffles the records at every pass. The default is True.
+    seed : int, optional
+        Seed of the shuffling. The default is None.
+
+    Returns
+    -------
+    tf.data.Dataset
+        (inputs, outputs) batches
+
+    """
+    inputs = np.load(os.path.join(path, 'inputs.npy'), mmap_mode='r')
+    outputs = np.load(os.path.join(path, 'outputs.npy'), mmap_mode='r')
+
+    def gather(ids):
+        ids = np.sort(ids)
+        return inputs[ids], outputs[ids]
+
+    def read(ids):
+        batch = tf.numpy_function(gather, [ids], (tf.float32, tf.float32))
+        return (tf.ensure_shape(batch[0], (None,) + inputs.shape[1:]),
+                tf.ensure_shape(batch[1], (None,) + outputs.shape[1:]))
+
+    dataset = tf.data.Dataset.range(len(outputs))
+    if shuffle:
+        dataset = dataset.shuffle(len(outputs), seed=seed)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(read,
+                          num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
+def grid_trials(space, num_trials=None, seed=0):
+    """Returns the trials of a search space.
+
+    Parameters
+    ----------
+    space : dict
+        Hyperparameter -> list of values, e.g. {"learning_rate": [1e-5,
+        1e-4], "optimizer": ["RMSprop", "Adam"]}
+    num_trials : int, optional
+        Number of trials sampled from the grid, all if None.
+        The default is None.
+    seed : int, optional
+        Seed of the sampling. The default is 0.
+
+    Returns
+    -------
+    list[dict]
+        Hyperparameters of each trial, completed by DEFAULT_HPARAMS
+
+    """
+    names = sorted(space)
+    grid = [dict(DEFAULT_HPARAMS, **dict(zip(names, values)))
+            for values in itertools.product(*(space[name] for name in names))]
+    if num_trials and num_trials < len(grid):
+        rng = np.random.default_rng(seed)
+        grid = [grid[i] for i in sorted(rng.choice(len(grid), num_trials,
+                                                   replace=False))]
+    return grid
+
+
+class MedianStopping(callbacks.Callback):
+    """Stops a trial whose best metric is worse than the median of others.
+
+    Trials share their histories through json files of the sweep folder,
+    so trials running in other processes are compared as well.
+    """
+
+    def __init__(self, trials_path, trial_id, grace_epochs=2, min_trials=2):
+        """Initializes the MedianStopping.
+
+        Parameters
+        ----------
+        trials_path : str
+            Folder of the histories of the trials
+        trial_id : int
+            Id of the trial
+        grace_epochs : int, optional
+            Epochs before the trial may be stopped. The default is 2.
+        min_trials : int, optional
+            Number of other trials which reached the epoch needed to stop.
+            The default is 2.
+
+        """
+        super().__init__()
+        self.trials_path = trials_path
+        self.trial_id = trial_id
+        self.grace_epochs = grace_epochs
+        self.min_trials = min_trials
+        self.history = []
+        self.stopped_epoch = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.history.append(float((logs or {}).get(MONITOR, np.nan)))
+        file = os.path.join(self.trials_path, 'trial_%i.json' % self.trial_id)
+        with open(file + '.tmp', 'w') as history_file:
+            json.dump(self.history, history_file)
+        os.replace(file + '.tmp', file)
+        if epoch + 1 < self.grace_epochs:
+            return
+        others = []
+        for name in os.listdir(self.trials_path):
+            if name.endswith('.json') and \
+                    name != os.path.basename(file):
+                with open(os.path.join(self.trials_path, name), 'r') as \
+                        history_file:
+                    history = json.load(history_file)
+                if len(history) > epoch:
+                    others.append(np.nanmin(history[:epoch + 1]))
+        if len(others) >= self.min_trials and \
+                np.nanmin(self.history) > np.median(others):
+            self.stopped_epoch = epoch + 1
+            self.model.stop_training = True
+
+
+def run_trial(trial):
+    """Trains the model of a trial, run in a process of run_sweep.
+
+    Parameters
+    ----------
+    trial : dict
+        Hyperparameters of grid_trials with "trial_id", "cpus",
+        "train_path", "eval_path", "sweep_path", "model_type",
+        "normalize_input", "epochs", "steps_per_epoch", "patience",
+        "grace_epochs" and "seed"
+
+    Returns
+    -------
+    dict
+        Hyperparameters, "status", "epochs", "best_val_rmse",
+        "final_val_rmse", "records_per_second" and "seconds"
+
+    """
+    start = time.time()
+    tf.config.threading.set_intra_op_parallelism_threads(trial['cpus'])
+    tf.config.threading.set_inter_op_parallelism_threads(
+        min(trial['cpus'], 2))
+    train_dataset = load_array_dataset(trial['train_path'],
+                                       trial['batch_size'],
+                                       seed=trial['seed']).repeat()
+    eval_dataset = load_array_dataset(trial['eval_path'], 256, shuffle=False)
+    num_bands = np.load(os.path.join(trial['train_path'], 'inputs.npy'),
+                        mmap_mode='r').shape[-1]
+    model = build_model(trial['model_type'],
+                        layers.Input(shape=[None, None, num_bands]),
+                        trial['normalize_input'])
+    optimizer = optimizers.get(trial['optimizer'])
+    optimizer.learning_rate = trial['learning_rate']
+    model.compile(optimizer=optimizer, loss=losses.get(trial['loss']),
+                  metrics=[metrics.RootMeanSquaredError()])
+    median_stopping = MedianStopping(
+        os.path.join(trial['sweep_path'], 'trials'), trial['trial_id'],
+        trial['grace_epochs'])
+    early_stopping = callbacks.EarlyStopping(MONITOR,
+                                             patience=trial['patience'])
+    throughput = ThroughputCallback(trial['batch_size'])
+    history = model.fit(train_dataset, epochs=trial['epochs'],
+                        steps_per_epoch=trial['steps_per_epoch'],
+                        validation_data=eval_dataset, verbose=0,
+                        callbacks=[median_stopping, early_stopping,
+                                   throughput]).history
+    status = 'completed'
+    if median_stopping.stopped_epoch:
+        status = 'pruned'
+    elif early_stopping.stopped_epoch:
+        status = 'early_stopped'
+    result = {name: trial[name] for name in DEFAULT_HPARAMS}
+    result.update(trial_id=trial['trial_id'], status=status,
+                  epochs=len(history[MONITOR]),
+                  best_val_rmse=float(np.nanmin(history[MONITOR])),
+                  final_val_rmse=float(history[MONITOR][-1]),
+                  records_per_second=float(np.mean(
+                      history['records_per_second'])),
+                  seconds=time.time() - start)
+    return result
+
+
+def run_sweep(trials, train_path, eval_path, sweep_path, model_type='CNN',
+              parallel_trials=2, cpus_per_trial=None, normalize_input=True,
+              epochs=20, steps_per_epoch=100, patience=3, grace_epochs=2,
+              seed=0):
+    """Runs trials concurrently on a process pool and collects the results.
+
+    Parameters
+    ----------
+    trials : list[dict]
+        Hyperparameters of grid_trials
+    train_path : str
+        Training arrays of decode_arrays
+    eval_path : str
+        Evaluation arrays of decode_arrays
+    sweep_path : str
+        Folder of the histories and results of the sweep
+    model_type : str, optional
+        Type of SINGLE_INPUT_MODELS. The default is 'CNN'.
+    parallel_trials : int, optional
+        Number of trials run at once. The default is 2.
+    cpus_per_trial : int, optional
+        CPU threads of a trial. The default is None to share the CPUs.
+    normalize_input : bool, optional
+        False if the arrays are normalized with band statistics.
+        The default is True.
+    epochs : int, optional
+        Maximum number of epochs of a trial. The default is 20.
+    steps_per_epoch : int, optional
+        Training steps per epoch. The default is 100.
+    patience : int, optional
+        Epochs without improvement before early stopping. The default is 3.
+    grace_epochs : int, optional
+        Epochs before a trial may be pruned. The default is 2.
+    seed : int, optional
+        Seed of the shuffling of the records. The default is 0.
+
+    Returns
+    -------
+    list[dict]
+        Results of run_trial sorted by best_val_rmse
+
+    """
+    os.makedirs(os.path.join(sweep_path, 'trials'), exist_ok=True)
+    cpus = cpus_per_trial or max((os.cpu_count() or 1) // parallel_trials, 1)
+    tasks = [dict(trial, trial_id=i, cpus=cpus, train_path=train_path,
+                  eval_path=eval_path, sweep_path=sweep_path,
+                  model_type=model_type, normalize_input=normalize_input,
+                  epochs=epochs, steps_per_epoch=steps_per_epoch,
+                  patience=patience, grace_epochs=grace_epochs, seed=seed)
+             for i, trial in enumerate(trials)]
+    results = []
+    # A fresh process per trial applies its thread budget
+    with multiprocessing.get_context('spawn').Pool(
+            parallel_trials, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(run_trial, tasks):
+            print("Trial %i %s after %i epochs, best val RMSE %.4g" % (
+                result['trial_id'], result['status'], result['epochs'],
+                result['best_val_rmse']))
+            results.append(result)
+    return sorted(results, key=lambda result: result['best_val_rmse'])
+
+
+def save_results(results, path):
+    """Writes the results of run_sweep as a CSV table."""
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
@@ -0,0 +1,252 @@
+'''
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import json
+import os
+import shutil
+import time
+import zlib
+import multiprocessing
+import numpy as np
+from google.protobuf.message import DecodeError
+from tensorflow.core.example import example_pb2
+
+from training.schema import is_patch_feature
+from training.record_index import iter_records
+from training.band_stats import decode_band
+
+MANIFEST_FILE = 'shard_manifest.json'
+
+
+def validate_file(file, features_dict, quantization=None):
+    """Scans a GZIP TFRecord file and checks its records against a schema.
+
+    Every record must have all the bands of features_dict with the number
+    of values of their shape. Records with NaN or Inf values and patches
+    with a single value are counted per band.
+
+    Parameters
+    ----------
+    file : str
+        GZIP TFRecord file
+    features_dict : dict
+        Features expected in every record
+    quantization : dict, optional
+        Quantization of the file. The default is None.
+
+    Returns
+    -------
+    dict
+        Manifest entry of the file: "file", "bytes", "records", "invalid",
+        "nonfinite", "missing", "shape_errors", "nonfinite_bands",
+        "constant_patches", "error" and "seconds"
+
+    """
+    quantization = quantization or {}
+    sizes = {band: int(np.prod(feature.shape))
+             for band, feature in features_dict.items()}
+    entry = {'file': os.path.abspath(file),
+             'bytes': os.path.getsize(file),
+             'records': 0, 'invalid': 0, 'nonfinite': 0,
+             'missing': {}, 'shape_errors': {}, 'nonfinite_bands': {},
+             'constant_patches': {}, 'error': None}
+    start = time.time()
+    try:
+        for serialized in iter_records(file):
+            feature = example_pb2.Example.FromString(
+                serialized).features.feature
+            invalid = nonfinite = False
+            for band, size in sizes.items():
+                if band not in feature:
+                    entry['missing'][band] = entry['missing'].get(band, 0) + 1
+                    invalid = True
+                    continue
+                values = decode_band(feature[band], -1,
+                                     quantization.get(band))
+                if values.size != size:
+                    entry['shape_errors'][band] = \
+                        entry['shape_errors'].get(band, 0) + 1
+                    invalid = True
+                    continue
+                if not np.isfinite(values).all():
+                    entry['nonfinite_bands'][band] = \
+                        entry['nonfinite_bands'].get(band, 0) + 1
+                    nonfinite = True
+                elif (is_patch_feature(features_dict[band]) and
+                      values.min() == values.max()):
+                    entry['constant_patches'][band] = \
+                        entry['constant_patches'].get(band, 0) + 1
+            entry['records'] += 1
+            entry['invalid'] += invalid
+            entry['nonfinite'] += nonfinite
+    except (IOError, EOFError, zlib.error, DecodeError, ValueError,
+            IndexError) as error:
+        # Records read before the error are kept in the counts
+        entry['error'] = "%s: %s" % (type(error).__name__, error)
+    entry['seconds'] = time.time() - start
+    return entry
+
+
+def shard_status(entry, max_nonfinite=0.0):
+    """Returns "ok", or why the shard of a manifest entry is bad.
+
+    Parameters
+    ----------
+    entry : dict
+        Manifest entry of validate_file
+    max_nonfinite : float, optional
+        Largest accepted fraction of records with NaN or Inf values.
+        The default is 0.0.
+
+    Returns
+    -------
+    str
+        "ok", "corrupt", "empty", "invalid" or "nonfinite"
+
+    """
+    if entry['error']:
+        return 'corrupt'
+    if entry['records'] == 0:
+        return 'empty'
+    if entry['invalid']:
+        return 'invalid'
+    if entry['nonfinite'] > max_nonfinite * entry['records']:
+        return 'nonfinite'
+    return 'ok'
+
+
+def _validate_file(args):
+    return validate_file(*args)
+
+
+def validate_tfrecords(files, features_dict, quantization=None,
+                       processes=None, max_nonfinite=0.0):
+    """Validates TFRecord files in parallel and returns their manifest.
+
+    Parameters
+    ----------
+    files : list[str]
+        GZIP TFRecord files
+    features_dict : dict
+        Features expected in every record
+    quantization : dict, optional
+        Quantization of the files. The default is None.
+    processes : int, optional
+        Number of files scanned in parallel. The default is None for the
+        number of CPUs.
+    max_nonfinite : float, optional
+        Largest accepted fraction of records with NaN or Inf values per
+        shard. The default is 0.0.
+
+    Returns
+    -------
+    dict
+        "shards" entries sorted by file with their "status", and the
+        total "records" and "bytes" of the valid shards
+
+    """
+    start = time.time()
+    # Spawned workers each import TensorFlow, so none is left idle
+    processes = max(min(processes or os.cpu_count(), len(files)), 1)
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        shards = pool.map(_validate_file, [(file, features_dict, quantization)
+                                           for file in files], chunksize=1)
+    for entry in shards:
+        entry['status'] = shard_status(entry, max_nonfinite)
+    valid = [entry for entry in shards if entry['status'] == 'ok']
+    elapsed = time.time() - start
+    num_bytes = sum(entry['bytes'] for entry in shards)
+    return {'shards': sorted(shards, key=lambda entry: entry['file']),
+            'records': sum(entry['records'] for entry in valid),
+            'bytes': sum(entry['bytes'] for entry in valid),
+            'seconds': elapsed,
+            'bytes_per_second': num_bytes / max(elapsed, 1e-9)}
+
+
+def save_manifest(manifest, path):
+    """Writes a manifest to path/shard_manifest.json."""
+    os.makedirs(path, exist_ok=True)
+    json.dump(manifest, open(os.path.join(path, MANIFEST_FILE), 'w'),
+              indent=2)
+
+
+def load_manifest(path):
+    """Returns the manifest of a folder or file, None if there is none."""
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    return json.load(open(path, 'r'))
+
+
+def quarantine_shards(manifest, quarantine_path):
+    """Moves the shards that are not "ok" to a quarantine folder.
+
+    Parameters
+    ----------
+    manifest : dict
+        Manifest of validate_tfrecords, the moved entries are updated
+    quarantine_path : str
+        Folder of the bad shards
+
+    Returns
+    -------
+    list[str]
+        New paths of the moved shards
+
+    """
+    os.makedirs(quarantine_path, exist_ok=True)
+    moved = []
+    for entry in manifest['shards']:
+        if entry['status'] == 'ok' or not os.path.exists(entry['file']):
+            continue
+        destination = os.path.join(quarantine_path,
+                                   os.path.basename(entry['file']))
+        shutil.move(entry['file'], destination)
+        entry['file'] = os.path.abspath(destination)
+        moved.append(entry['file'])
+    return moved
+
+
+def balance_shards(manifest, num_workers):
+    """Splits the valid shards between workers with balanced record counts.
+
+    Shards are assigned from the largest to the worker with the fewest
+    records so far.
+
+    Parameters
+    ----------
+    manifest : dict
+        Manifest of validate_tfrecords
+    num_workers : int
+        Number of training workers
+
+    Returns
+    -------
+    list[list[str]]
+        Sorted files of each worker
+
+    """
+    valid = sorted((entry for entry in manifest['shards']
+                    if entry['status'] == 'ok'),
+                   key=lambda entry: (-entry['records'], entry['file']))
+    workers = [[] for _ in range(num_workers)]
+    counts = np.zeros(num_workers, dtype=np.int64)
+    for entry in valid:
+        worker = int(np.argmin(counts))
+        workers[worker].append(entry['file'])
+        counts[worker] += entry['records']
+    return [sorted(files) for files in workers]
@@ -2,3 +2,6 @@ from .export_mapping import stack_bands_from_imagery
 from .sampler import SampleExporter
 from .wrappers import RoadImagery, MultiSpectralImagery, TropomiImagery, DSMImagery, WindImagery
 from .taskmanager import TaskManager
+from .stratification import ValidStratification, TargetStratification
+from .scene_index import (SceneIndex, geometry_bounds, grid_cells,
+                          date_to_millis)
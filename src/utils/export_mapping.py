@@ -108,6 +108,9 @@ def stack_bands_from_imagery(multispectral_image, wind, dsm, road, tropomi,
                                        valid_neighborhood])
         combined_bands = combined_bands.updateMask(total_mask)
         combined_bands = combined_bands.select(bands)
+        # Properties are the multispectral ones, the time is the TROPOMI one
+        combined_bands = combined_bands.set('system:time_start',
+                                            tropomi_date.millis())
 
         num_valid_pixels = ee.Number(valid_pixels.get('valid'))
 
@@ -14,14 +14,19 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import json
+import math
+import os
 import ee
+from .stratification import ValidStratification
 
 
 class SampleExporter:
     """Manages export operations, takes images from which to extract patches."""
 
     def __init__(self, task_manager, num_samples, num_shards, kernel, scale,
-                 bucket, directory):
+                 bucket, directory, sampling=None, manifest_path=None,
+                 manifest_batch=20):
         """Initializes the SampleExporter object.
 
         Parameters
@@ -40,6 +45,16 @@ class SampleExporter:
             Google Cloud Storage Bucket name
         directory : str
             Folder to extract the TFRecords t
+        sampling : ValidStratification, optional
+            Sampling strategy of the points. The default is None to sample
+            uniformly from the valid pixels.
+        manifest_path : str, optional
+            Local json file where the achieved strata of every export are
+            recorded, merged with the exports it already records.
+            The default is None to skip the manifest.
+        manifest_batch : int, optional
+            Number of exports whose strata are requested from EE at once.
+            The default is 20.
 
         """
         # Task parameters
@@ -55,6 +70,15 @@ class SampleExporter:
         self.bucket = bucket
         self.directory = directory
 
+        # Sampling strategy
+        self.sampling = sampling or ValidStratification()
+        self.manifest_path = manifest_path
+        self.manifest_batch = manifest_batch
+        self.manifest = {}
+        self.pending_manifest = {}
+        if manifest_path and os.path.exists(manifest_path):
+            self.manifest = json.load(open(manifest_path, 'r'))
+
     def export_patches(self, image, bands, patch_bands, export_id):
         """Exports patch and scalar bands and submit tasks to the task manager.
 
@@ -71,16 +95,7 @@ class SampleExporter:
 
 
         """
-        valid_pixels = image.select('valid').int()
-        valid_pixels = valid_pixels.updateMask(valid_pixels)
-        # Extract points from the valid pixels
-        valid_samples = valid_pixels.stratifiedSample(
-            numPoints=self.num_samples,
-            classBand="valid",
-            region=image.geometry(),
-            scale=self.scale,
-            tileScale=2,
-            geometries=True)
+        valid_samples = self.sample_valid_points(image, export_id)
 
         patch_names = ["patch_%s" % b for b in patch_bands]
         patches = image.select(patch_bands).neighborhoodToArray(self.kernel)
@@ -93,11 +108,228 @@ class SampleExporter:
                                    region=feature.geometry(),
                                    scale=self.scale).first()
 
-        samples = valid_samples.map(get_sample)
+        # Points without an unmasked pixel are dropped server side
+        samples = valid_samples.map(get_sample, True)
         features = bands + patch_names
         self.export_tasks(samples, features, export_id)
 
-    def export_tasks(self, samples, features, export_id):
+    def export_tiles(self, image, bands, patch_bands, export_id,
+                     crs='EPSG:3857'):
+        """Exports one deduplicated tile and a table of sample offsets.
+
+        Instead of one neighborhoodToArray patch per sample, the patch bands
+        are exported once as a single raster tile covering the image, and the
+        samples are exported as a table of scalar bands with the row and
+        column of each sample in the tile. Patches are rebuilt by slicing the
+        tile at load time (see training.load_tiled_tfrecords).
+
+        Tiles are written to <directory>/tiles/<export_id> and offsets to
+        <directory>/offsets/<export_id>_<shard>.
+
+        Parameters
+        ----------
+        image : ee.Image
+            Image from which to extract patches. Assumed to have a 'valid' band
+        bands : list[str]
+            bands exported as scalars
+        patch_bands : list[str]
+            bands exported in the tile
+        export_id : str
+            prefix for the task description
+        crs : str, optional
+            Projection of the exported tile, in meters or Web Mercator.
+            The default is 'EPSG:3857'.
+
+        """
+        pixel_size = self.scale
+        if crs == 'EPSG:3857':
+            # Web Mercator units are 1 / cos(latitude) meters, pixels are
+            # about scale meters wide at the center of the image
+            latitude = image.geometry().centroid(1).coordinates().get(1)
+            pixel_size = self.scale / max(
+                math.cos(math.radians(latitude.getInfo())), 1e-6)
+
+        valid_samples = self.sample_valid_points(image, export_id)
+
+        patch_names = ["patch_%s" % b for b in patch_bands]
+        tile = image.select(patch_bands, patch_names)
+        grid = self.export_tile(tile, image.geometry(), export_id + "_tile",
+                                self.directory + '/tiles/' + export_id,
+                                crs, pixel_size)
+        tile_height, tile_width = grid['height'], grid['width']
+        tile_projection = ee.Projection(crs, grid['transform'])
+
+        offsets = ee.Image.pixelCoordinates(tile_projection).floor().toFloat()
+        offsets = offsets.rename(['tile_col', 'tile_row'])
+        combined = image.select(bands).addBands(offsets)
+
+        def get_offset(feature):
+            sample = combined.sample(numPixels=1,
+                                     region=feature.geometry(),
+                                     scale=self.scale).first()
+            return ee.Algorithms.If(
+                sample,
+                ee.Feature(sample).set({'tile_height': float(tile_height),
+                                        'tile_width': float(tile_width)}),
+                None)
+
+        # Points without an unmasked pixel are dropped server side
+        samples = valid_samples.map(get_offset, True)
+        features = bands + ['tile_row', 'tile_col', 'tile_height',
+                            'tile_width']
+        self.export_tasks(samples, features, export_id,
+                          directory=self.directory + '/offsets')
+
+    def export_static_layers(self, image, region_id, bounds,
+                             folder='static'):
+        """Exports static layers once for a region as a single raster tile.
+
+        Static and slowly changing layers (road, DSM) do not depend on the
+        sample, so they are exported once per region instead of as a patch
+        of every sample. The returned grid is written to the static index
+        used to build the local static layer cache (see
+        training.StaticLayerCache).
+
+        The tile is geographic (EPSG:4326) so that samples can be located by
+        latitude and longitude. Its pixels are scale meters high and the
+        longitude step is divided by the cosine of the latitude of the
+        center of the region so that they are about scale meters wide.
+
+        Tiles are written to <directory>/<folder>/<region_id>. The scenes
+        of the serving catalog are exported the same way, with their time
+        dependent bands, to another folder.
+
+        Parameters
+        ----------
+        image : ee.Image
+            Image with the static bands, band names are kept in the tile
+        region_id : str
+            identifier of the region, used for the task description
+        bounds : list[float]
+            [west, south, east, north] bounds of the region in degrees
+        folder : str, optional
+            Subfolder of the tiles. The default is 'static'.
+
+        Returns
+        -------
+        dict
+            Grid of the exported tile with keys "crs", "transform", "height",
+            "width" and "bands"
+
+        """
+        # Scale is in meters, geographic pixel size is in degrees
+        y_size = float(self.scale) / 111319.49
+        latitude = math.radians((bounds[1] + bounds[3]) / 2)
+        x_size = y_size / max(math.cos(latitude), 1e-6)
+        grid = self.export_tile(image, ee.Geometry.Rectangle(bounds),
+                                region_id + "_" + folder,
+                                self.directory + '/' + folder + '/' +
+                                region_id,
+                                'EPSG:4326', (x_size, y_size))
+        grid['bands'] = image.bandNames().getInfo()
+        return grid
+
+    def export_tile(self, image, geometry, description, file_prefix, crs,
+                    pixel_size):
+        """Exports an image as a single TFRecord patch covering geometry.
+
+        Parameters
+        ----------
+        image : ee.Image
+            Image to export, masked pixels are exported as 0
+        geometry : ee.Geometry
+            Geometry whose bounds are covered by the tile
+        description : str
+            task description
+        file_prefix : str
+            export file name prefix in the bucket
+        crs : str
+            Projection of the exported tile
+        pixel_size : float or tuple[float]
+            Size of the tile pixels in crs units, or their (width, height)
+
+        Returns
+        -------
+        dict
+            Grid of the exported tile with keys "crs", "transform", "height"
+            and "width"
+
+        """
+        if isinstance(pixel_size, (int, float)):
+            pixel_size = (pixel_size, pixel_size)
+        x_size, y_size = pixel_size
+        # Tile grid anchored on the top left corner of the geometry bounds
+        bounds = geometry.bounds(1, ee.Projection(crs)).getInfo()
+        x_coords = [point[0] for point in bounds['coordinates'][0]]
+        y_coords = [point[1] for point in bounds['coordinates'][0]]
+        width = int(math.ceil((max(x_coords) - min(x_coords)) / x_size))
+        height = int(math.ceil((max(y_coords) - min(y_coords)) / y_size))
+        crs_transform = [x_size, 0, min(x_coords),
+                         0, -y_size, max(y_coords)]
+        region = ee.Geometry.Rectangle([min(x_coords), min(y_coords),
+                                        max(x_coords), max(y_coords)],
+                                       ee.Projection(crs), False)
+        task = ee.batch.Export.image.toCloudStorage(
+            image=image.unmask(0, False).toFloat(),
+            description=description,
+            bucket=self.bucket,
+            fileNamePrefix=file_prefix,
+            region=region,
+            crs=crs,
+            crsTransform=crs_transform,
+            fileFormat='TFRecord',
+            formatOptions={'patchDimensions': [width, height],
+                           'compressed': True},
+            maxPixels=1e10)
+        self.task_manager.submit(task)
+        return {"crs": crs, "transform": crs_transform,
+                "height": height, "width": width}
+
+    def sample_valid_points(self, image, export_id):
+        """Samples num_samples points from the valid pixels of the image.
+
+        If a manifest_path is set, the strata and the number of points
+        achieved in each stratum are recorded in the manifest. They are
+        requested every manifest_batch exports, see flush_manifest.
+
+        Parameters
+        ----------
+        image : ee.Image
+            Image to sample from. Assumed to have a 'valid' band
+        export_id : str
+            key of the export in the manifest
+
+        Returns
+        -------
+        ee.FeatureCollection
+            Sampled points with their geometries
+
+        """
+        samples, info = self.sampling.sample(image, self.num_samples,
+                                             self.scale)
+        if self.manifest_path:
+            info = info.set('achieved', samples.aggregate_histogram('stratum'))
+            info = info.set('num_samples', samples.size())
+            self.pending_manifest[export_id] = info
+            if len(self.pending_manifest) >= self.manifest_batch:
+                self.flush_manifest()
+        return samples
+
+    def flush_manifest(self):
+        """Requests the pending strata in one call and writes the manifest.
+
+        Returns
+        -------
+        None.
+
+        """
+        if not self.manifest_path or not self.pending_manifest:
+            return
+        self.manifest.update(ee.Dictionary(self.pending_manifest).getInfo())
+        self.pending_manifest = {}
+        json.dump(self.manifest, open(self.manifest_path, 'w'), indent=2)
+
+    def export_tasks(self, samples, features, export_id, directory=None):
         """Shards the samples into num_shards and submit tasks to TaskManager.
 
         Parameters
@@ -108,12 +340,16 @@ class SampleExporter:
             features to export from samples
         export_id : str
             prefix for the task description
+        directory : str, optional
+            Folder to export to. The default is None to use self.directory.
 
         Returns
         -------
         None.
 
         """
+        if directory is None:
+            directory = self.directory
         samples_for_sharding = samples.randomColumn('shard_split')
         for i in range(self.num_shards):
             range_min = float(i) / float(self.num_shards)
@@ -127,7 +363,7 @@ class SampleExporter:
                 collection=samples_to_export,
                 description=export_id + "_%i" % i,
                 bucket=self.bucket,
-                fileNamePrefix=self.directory + '/' + export_id + "_%i" % i,
+                fileNamePrefix=directory + '/' + export_id + "_%i" % i,
                 fileFormat='TFRecord',
                 selectors=features,
                 maxWorkers=2000)
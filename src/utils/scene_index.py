@@ -0,0 +1,282 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import math
+import os
+from datetime import datetime, timezone
+import ee
+
+
+def geometry_bounds(geometry):
+    """Returns the [west, south, east, north] bounds of a GeoJSON geometry.
+
+    Parameters
+    ----------
+    geometry : dict
+        GeoJSON Geometry, Feature or FeatureCollection
+
+    Returns
+    -------
+    list[float]
+
+    """
+    if geometry['type'] == 'FeatureCollection':
+        bounds = [geometry_bounds(f) for f in geometry['features']]
+        return [min(b[0] for b in bounds), min(b[1] for b in bounds),
+                max(b[2] for b in bounds), max(b[3] for b in bounds)]
+    if geometry['type'] == 'Feature':
+        return geometry_bounds(geometry['geometry'])
+    points = []
+
+    def flatten(coordinates):
+        if isinstance(coordinates[0], (int, float)):
+            points.append(coordinates)
+        else:
+            for c in coordinates:
+                flatten(c)
+    flatten(geometry['coordinates'])
+    return [min(p[0] for p in points), min(p[1] for p in points),
+            max(p[0] for p in points), max(p[1] for p in points)]
+
+
+def grid_cells(bbox, cell_size=1.0):
+    """Returns the cells of a fixed degree grid intersecting a box.
+
+    Parameters
+    ----------
+    bbox : list[float]
+        [west, south, east, north] bounds in degrees
+    cell_size : float, optional
+        Size of the cells in degrees. The default is 1.0.
+
+    Returns
+    -------
+    dict
+        [west, south, east, north] bounds of each cell, keyed by an id
+        built from the column and row of the cell
+
+    """
+    cells = {}
+    for col in range(int(math.floor(bbox[0] / cell_size)),
+                     int(math.floor(bbox[2] / cell_size)) + 1):
+        for row in range(int(math.floor(bbox[1] / cell_size)),
+                         int(math.floor(bbox[3] / cell_size)) + 1):
+            cells['cell_%i_%i' % (col, row)] = [
+                col * cell_size, row * cell_size,
+                (col + 1) * cell_size, (row + 1) * cell_size]
+    return cells
+
+
+def date_to_millis(date):
+    """Converts a YYYY-MM-DD date to UTC milliseconds since epoch."""
+    date = datetime.strptime(date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return int(date.timestamp() * 1000)
+
+
+def intersects(bbox, other):
+    """Returns True if two [west, south, east, north] boxes intersect."""
+    return (bbox[0] <= other[2] and other[0] <= bbox[2] and
+            bbox[1] <= other[3] and other[1] <= bbox[3])
+
+
+class SceneIndex:
+    """STR packed R-tree over scene footprints and acquisition times."""
+
+    NODE_CAPACITY = 16
+
+    def __init__(self, scenes, link=None, filters=None):
+        """Initializes the SceneIndex and packs the tree.
+
+        Parameters
+        ----------
+        scenes : list[dict]
+            Scenes with keys "id" (system:index), "bbox" ([west, south,
+            east, north]) and "time" (system:time_start in milliseconds)
+        link : str, optional
+            link to the indexed ImageCollection. The default is None.
+        filters : dict, optional
+            date range the collection was filtered on. The default is None.
+
+        """
+        self.scenes = scenes
+        self.link = link
+        self.filters = filters or {}
+        nodes = [{'bbox': scene['bbox'], 'tmin': scene['time'],
+                  'tmax': scene['time'], 'scene': i}
+                 for i, scene in enumerate(scenes)]
+        while len(nodes) > self.NODE_CAPACITY:
+            nodes = self._pack_level(nodes)
+        self.root = self._parent(nodes)
+
+    def _parent(self, children):
+        """Returns the node containing children."""
+        if not children:
+            return {'bbox': [0, 0, 0, 0], 'tmin': 0, 'tmax': -1,
+                    'children': []}
+        return {'bbox': [min(c['bbox'][0] for c in children),
+                         min(c['bbox'][1] for c in children),
+                         max(c['bbox'][2] for c in children),
+                         max(c['bbox'][3] for c in children)],
+                'tmin': min(c['tmin'] for c in children),
+                'tmax': max(c['tmax'] for c in children),
+                'children': children}
+
+    def _pack_level(self, nodes):
+        """Sort-Tile-Recursive packing of one level of the tree."""
+        num_parents = int(math.ceil(len(nodes) / self.NODE_CAPACITY))
+        num_slices = int(math.ceil(math.sqrt(num_parents)))
+        slice_size = num_slices * self.NODE_CAPACITY
+        nodes = sorted(nodes, key=lambda n: n['bbox'][0] + n['bbox'][2])
+        parents = []
+        for i in range(0, len(nodes), slice_size):
+            tile = sorted(nodes[i:i + slice_size],
+                          key=lambda n: n['bbox'][1] + n['bbox'][3])
+            for j in range(0, len(tile), self.NODE_CAPACITY):
+                parents.append(self._parent(tile[j:j + self.NODE_CAPACITY]))
+        return parents
+
+    def query(self, bbox, start_time=None, end_time=None):
+        """Returns the ids of the scenes intersecting bbox in a time range.
+
+        Parameters
+        ----------
+        bbox : list[float]
+            [west, south, east, north] bounds to intersect
+        start_time : int, optional
+            Inclusive start in milliseconds. The default is None.
+        end_time : int, optional
+            Exclusive end in milliseconds. The default is None.
+
+        Returns
+        -------
+        list[str]
+            ids of the matching scenes, in acquisition order
+
+        """
+        start_time = -math.inf if start_time is None else start_time
+        end_time = math.inf if end_time is None else end_time
+        matches = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if (node['tmax'] < start_time or node['tmin'] >= end_time or
+                    not intersects(node['bbox'], bbox)):
+                continue
+            if 'scene' in node:
+                matches.append(self.scenes[node['scene']])
+            else:
+                stack.extend(node['children'])
+        return [scene['id'] for scene in sorted(matches,
+                                                key=lambda s: s['time'])]
+
+    def query_geometries(self, geometries, start_time=None, end_time=None):
+        """Returns the ids of the scenes intersecting any of the geometries.
+
+        Each geometry is queried with its own bounds, so that scenes lying
+        between distant geometries are not selected.
+
+        Parameters
+        ----------
+        geometries : list[dict]
+            GeoJSON geometries or features
+        start_time : int, optional
+            Inclusive start in milliseconds. The default is None.
+        end_time : int, optional
+            Exclusive end in milliseconds. The default is None.
+
+        Returns
+        -------
+        list[str]
+            ids of the matching scenes, in acquisition order
+
+        """
+        ids = set()
+        for geometry in geometries:
+            ids.update(self.query(geometry_bounds(geometry), start_time,
+                                  end_time))
+        times = {scene['id']: scene['time'] for scene in self.scenes}
+        return sorted(ids, key=lambda scene_id: (times[scene_id], scene_id))
+
+    def save(self, path):
+        """Saves the scenes to a json file."""
+        json.dump({'link': self.link, 'filters': self.filters,
+                   'scenes': self.scenes}, open(path, 'w'))
+
+    @classmethod
+    def load(cls, path):
+        """Loads a SceneIndex saved with save."""
+        cached = json.load(open(path, 'r'))
+        return cls(cached['scenes'], cached['link'], cached.get('filters'))
+
+    @classmethod
+    def from_collection(cls, link, path=None, page_size=1000,
+                        start_date=None, end_date=None):
+        """Builds the index from the metadata of an EE ImageCollection.
+
+        The metadata is only requested if there is no cached index for the
+        same link and date range at path, the index of a date range is then
+        queried for any area of interest.
+
+        Parameters
+        ----------
+        link : str
+            link to the ImageCollection
+        path : str, optional
+            json file caching the index. The default is None for no cache.
+        page_size : int, optional
+            Number of scenes requested at once. The default is 1000.
+        start_date : str, optional
+            Inclusive YYYY-MM-DD start of the indexed scenes.
+            The default is None.
+        end_date : str, optional
+            Exclusive YYYY-MM-DD end of the indexed scenes.
+            The default is None.
+
+        Returns
+        -------
+        SceneIndex
+
+        """
+        filters = {'start_date': start_date, 'end_date': end_date}
+        if path and os.path.exists(path):
+            index = cls.load(path)
+            if index.link == link and index.filters == filters:
+                return index
+        imagery = ee.ImageCollection(link).filter(
+            ee.Filter.notNull(['collectionStartTime']))
+        if start_date or end_date:
+            imagery = imagery.filter(ee.Filter.date(
+                start_date or '1970-01-01', end_date or '2100-01-01'))
+
+        def scene_feature(image):
+            return ee.Feature(image.geometry(),
+                              {'id': image.get('system:index'),
+                               'time': image.get('system:time_start')})
+
+        features = ee.FeatureCollection(imagery.map(scene_feature))
+        size = features.size().getInfo()
+        scenes = []
+        for offset in range(0, size, page_size):
+            page = features.toList(page_size, offset).getInfo()
+            for feature in page:
+                scenes.append({'id': feature['properties']['id'],
+                               'time': feature['properties']['time'],
+                               'bbox': geometry_bounds(feature['geometry'])})
+        index = cls(scenes, link, filters)
+        if path:
+            index.save(path)
+        return index
@@ -0,0 +1,184 @@
+"""
+Copyright 2020 Google LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import ee
+
+
+class ValidStratification:
+    """Samples uniformly from the valid pixels (single stratum)."""
+
+    def sample(self, image, num_samples, scale):
+        """Samples points from the valid pixels of the image.
+
+        Parameters
+        ----------
+        image : ee.Image
+            Image to sample from. Assumed to have a 'valid' band
+        num_samples : int
+            Number of points to sample
+        scale : int
+            Scale of the sampling (in meters/pixel)
+
+        Returns
+        -------
+        samples : ee.FeatureCollection
+            Sampled points with their geometries and 'stratum' property
+        info : ee.Dictionary
+            Parameters of the strata computed for the image
+
+        """
+        valid_pixels = image.select('valid').int()
+        valid_pixels = valid_pixels.updateMask(valid_pixels)
+        # Extract points from the valid pixels
+        samples = valid_pixels.rename(['stratum']).stratifiedSample(
+            numPoints=num_samples,
+            classBand="stratum",
+            region=image.geometry(),
+            scale=scale,
+            tileScale=2,
+            geometries=True)
+        return samples, ee.Dictionary({})
+
+
+class TargetStratification(ValidStratification):
+    """Stratifies the valid pixels on quantile bins of the target band.
+
+    Strata are the quantile bins of the target band (TROPOMI NO2), computed
+    over the valid pixels of each image, optionally crossed with fixed
+    threshold bins of another band (land cover, road density).
+    """
+
+    def __init__(self, num_bins=4,
+                 target_band='tropospheric_NO2_column_number_density',
+                 strata_band=None, strata_thresholds=None, quotas=None):
+        """Initializes TargetStratification.
+
+        Parameters
+        ----------
+        num_bins : int, optional
+            Number of quantile bins of the target band. The default is 4.
+        target_band : str, optional
+            Band of the quantile bins.
+            The default is 'tropospheric_NO2_column_number_density'.
+        strata_band : str, optional
+            Band crossed with the quantile bins. The default is None.
+        strata_thresholds : list[float], optional
+            Increasing thresholds of the strata_band bins.
+            The default is None.
+        quotas : list[int], optional
+            Number of points to sample in each stratum, strata are ordered
+            by target bin then strata_band bin. The default is None to split
+            the samples equally between strata.
+
+        """
+        if strata_thresholds and not strata_band:
+            raise ValueError("strata_thresholds require a strata_band")
+        self.num_bins = num_bins
+        self.target_band = target_band
+        self.strata_band = strata_band
+        self.strata_thresholds = strata_thresholds or []
+        self.quotas = quotas
+        self.num_strata = num_bins * (len(self.strata_thresholds) + 1)
+        if quotas is not None:
+            assert len(quotas) == self.num_strata, \
+                "%i quotas expected" % self.num_strata
+
+    def get_quotas(self, num_samples):
+        """Returns the number of points to sample in each stratum."""
+        if self.quotas is not None:
+            return list(self.quotas)
+        quota, remainder = divmod(num_samples, self.num_strata)
+        # Remaining points go to the highest target bins
+        return [quota + int(i >= self.num_strata - remainder)
+                for i in range(self.num_strata)]
+
+    def get_strata(self, image, scale):
+        """Computes the strata of the valid pixels.
+
+        Parameters
+        ----------
+        image : ee.Image
+            Image with the 'valid', target and strata bands
+        scale : int
+            Scale of the quantiles computation (in meters/pixel)
+
+        Returns
+        -------
+        strata : ee.Image
+            Integer 'stratum' band masked outside of the valid pixels
+        thresholds : ee.List
+            Quantiles of the target band delimiting the bins
+
+        """
+        valid = image.select('valid').gt(0)
+        target = image.select(self.target_band).updateMask(valid)
+        percentiles = [100 * i // self.num_bins
+                       for i in range(1, self.num_bins)]
+        # Zero padded names keep the dictionary keys in increasing order
+        names = ['p%03i' % p for p in percentiles]
+        quantiles = target.reduceRegion(
+            ee.Reducer.percentile(percentiles, names),
+            geometry=image.geometry(),
+            scale=scale,
+            tileScale=2,
+            bestEffort=True)
+        thresholds = ee.Dictionary(quantiles).values()
+        strata = ee.Image.constant(0)
+        for i in range(self.num_bins - 1):
+            strata = strata.add(target.gt(ee.Number(thresholds.get(i))))
+        if self.strata_band:
+            band = image.select(self.strata_band)
+            band_bins = ee.Image.constant(0)
+            for threshold in self.strata_thresholds:
+                band_bins = band_bins.add(band.gt(threshold))
+            strata = strata.multiply(len(self.strata_thresholds) + 1)
+            strata = strata.add(band_bins)
+        strata = strata.int().updateMask(valid).rename(['stratum'])
+        return strata, thresholds
+
+    def sample(self, image, num_samples, scale):
+        """Samples points with a per-stratum quota.
+
+        Parameters
+        ----------
+        image : ee.Image
+            Image with the 'valid', target and strata bands
+        num_samples : int
+            Total number of points, split between strata if there is no quota
+        scale : int
+            Scale of the sampling (in meters/pixel)
+
+        Returns
+        -------
+        samples : ee.FeatureCollection
+            Sampled points with their geometries and 'stratum' property
+        info : ee.Dictionary
+            Target thresholds and quotas of the strata
+
+        """
+        strata, thresholds = self.get_strata(image, scale)
+        quotas = self.get_quotas(num_samples)
+        samples = strata.stratifiedSample(
+            numPoints=0,
+            classBand="stratum",
+            region=image.geometry(),
+            scale=scale,
+            classValues=list(range(self.num_strata)),
+            classPoints=quotas,
+            tileScale=2,
+            geometries=True)
+        return samples, ee.Dictionary({'thresholds': thresholds,
+                                       'quotas': quotas})
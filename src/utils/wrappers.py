@@ -153,7 +153,8 @@ class TropomiImagery(CollectionClass):
 class MultiSpectralImagery(CollectionClass):
     """Wraps Multispectral ImageCollection."""
 
-    def __init__(self, link, start_date, end_date, bands, scale):
+    def __init__(self, link, start_date, end_date, bands, scale, aoi=None,
+                 scene_ids=None):
         """.
 
         Parameters
@@ -169,6 +170,12 @@ class MultiSpectralImagery(CollectionClass):
             bands to select. The default is None, where all bands are selected
         scale : int
             scale to use for scaling, reduces multispectral resolution
+        aoi : ee.Geometry, optional
+            area of interest, images are filtered on and clipped to it.
+            The default is None to take whole images.
+        scene_ids : list[str], optional
+            system:index of the images to keep, as selected by a SceneIndex.
+            The default is None to keep all images.
 
         Returns
         -------
@@ -177,9 +184,15 @@ class MultiSpectralImagery(CollectionClass):
         """
         super(MultiSpectralImagery, self).__init__(link, bands)
 
+        if scene_ids is not None:
+            self.imagery = self.imagery.filter(
+                ee.Filter.inList('system:index', scene_ids))
         self.imagery = self.imagery.filterDate(start_date, end_date)
         self.imagery = self.imagery.filter(ee.Filter.notNull(
             ['collectionStartTime']))
+        self.aoi = aoi
+        if self.aoi is not None:
+            self.imagery = self.imagery.filterBounds(self.aoi)
         self.size = self.imagery.size().getInfo()
         self.imagery_list = self.imagery.toList(self.size)
         print("Base Imagery has %i elements" % self.size)
@@ -200,6 +213,9 @@ class MultiSpectralImagery(CollectionClass):
         """
         assert i < len(self), "index exceeds MultiSpectral size"
         image = ee.Image(self.imagery_list.get(i))
+        if self.aoi is not None:
+            # Footprint is clipped to the AOI before stacking
+            image = image.clip(self.aoi)
         return image.clipToBoundsAndScale(image.geometry(), scale=self.scale)
 
     def __len__(self):
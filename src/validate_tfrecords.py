@@ -0,0 +1,76 @@
+"""
+Copyright 2020 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Can be run as follows:
+# python3 validate_tfrecords.py --params_path=candid.json
+#     --tfrecords_path=samples --quarantine_path=samples_bad --num_workers=4
+
+import argparse
+import json
+import training
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Validate TFRecords')
+    parser.add_argument('--params_path', type=str,
+                        help="json parameters file location")
+    parser.add_argument('--tfrecords_path', type=str,
+                        help="folder of the GZIP TFRecords")
+    parser.add_argument('--manifest_path', type=str, default=None,
+                        help="folder of shard_manifest.json, defaults to "
+                        "tfrecords_path")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="number of files scanned in parallel")
+    parser.add_argument('--max_nonfinite', type=float, default=0.0,
+                        help="largest fraction of records with NaN/Inf "
+                        "values of a valid shard")
+    parser.add_argument('--quarantine_path', type=str, default=None,
+                        help="folder where invalid shards are moved")
+    parser.add_argument('--static_cache', type=str, default=None,
+                        help="static layer cache built by "
+                        "build_static_cache.py, for shards exported with "
+                        "--static_index")
+    parser.add_argument('--num_workers', type=int, default=0,
+                        help="prints the shards of each training worker")
+
+    args = parser.parse_args()
+    params = json.load(open(args.params_path, 'r'))
+    features_dict = training.get_features_dict(params['kernel_radius'])
+    if args.static_cache:
+        # Static bands are not in the records, they are in the cache
+        for band in training.StaticLayerCache(
+                args.static_cache, params['kernel_radius']).bands:
+            features_dict.pop(band, None)
+    manifest = training.validate_tfrecords(
+        training.list_tfrecords(args.tfrecords_path), features_dict,
+        quantization=training.load_quantization(args.tfrecords_path),
+        processes=args.processes, max_nonfinite=args.max_nonfinite)
+    if args.quarantine_path:
+        moved = training.quarantine_shards(manifest, args.quarantine_path)
+        print("Moved %i shards to %s" % (len(moved), args.quarantine_path))
+    if args.num_workers:
+        manifest['workers'] = training.balance_shards(manifest,
+                                                      args.num_workers)
+    training.save_manifest(manifest, args.manifest_path or
+                           args.tfrecords_path)
+
+    for entry in manifest['shards']:
+        if entry['status'] != 'ok':
+            print("%s: %s %s" % (entry['status'], entry['file'],
+                                 entry['error'] or ''))
+    print("%i records in %i valid shards, %.1f MB/s" % (
+        manifest['records'],
+        sum(entry['status'] == 'ok' for entry in manifest['shards']),
+        manifest['bytes_per_second'] / 1e6))